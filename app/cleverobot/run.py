@@ -2,17 +2,21 @@
 # encoding: utf-8
 from __future__ import unicode_literals
 import os
-import time
 from flask import Flask, render_template, request, jsonify
 import flask.ext.socketio as fsocketio
 import argparse
 import cbot
-from cbot.bot.connectors import ChatBotConnector, forwarder_device_start
-from cbot.bot.log import chatbot2file_log_loop, topic_msg_to_json, setup_logging
+from cbot.bot.connectors import ChatBotConnector, ConnectorHub
+from cbot.bot.transport import PubSubEndpoints, RouterEndpoints, InProcEndpoints, stop_devices
+from cbot.bot.pool import ChatBotPool, ChatBotHostPool
+from cbot.bot.fleet import ChatBotFleet, start_hosts
+from cbot.bot.supervisor import ChatBotSupervisor
+import cbot.bot.metrics as metrics
+from cbot.bot.zygote import ChatBotZygote
+from cbot.bot.log import chatbot2file_log_loop, setup_logging
 import cbot.bot_exceptions as botex
 from multiprocessing import Process
 import zmq.green as zmqg
-import zmq
 
 
 app = Flask(__name__)
@@ -21,9 +25,22 @@ socketio = fsocketio.SocketIO(app)
 log_name = 'cleverobot.log'
 bot_input, bot_output = 6666, 7777
 user_input, user_output = 8888, 9999
+broker_port = 6677
+bind = '127.0.0.1'  # interface of the ZMQ devices, other machines of the fleet need e.g. '*'
 host, port = '0.0.0.0', 3000
 ctx = zmqg.Context()
-pub2bot = ctx.socket(zmq.PUB)
+endpoints = PubSubEndpoints(bot_input, bot_output, user_input, user_output)
+hub = None  # one transport shared by the connectors, see connector_hub()
+pool = None  # pre-started ChatBots, if None each dialogue starts its own ChatBot process
+zygote = None  # forks pool ChatBots with preloaded models
+supervisor = None  # reaps and recycles the ChatBot processes
+pool_min, pool_max = 2, 20
+hosts, host_sessions = 0, 1000
+ready_timeout = 30.0  # seconds to wait for a cold started ChatBot
+idle_timeout = None  # seconds after which an idle dialogue releases its ChatBot, None never
+log_validate_rate = 0.0  # fraction of the logged ChatBot messages validated by the log process
+log_store, log_segment_mb = None, 64  # directory of the SegmentStore instead of the session log files
+log_workers, log_queue_size = 1, 10000  # log processes with sessions sharded among them
 log_config = os.path.realpath(os.path.join(os.path.dirname(cbot.__file__), 'logging.json'))
 
 @app.before_request
@@ -44,28 +61,55 @@ def index():
     return render_template('index.html')
 
 
+def connector_hub():
+    global hub
+    if hub is None:
+        hub = ConnectorHub(endpoints, ctx)
+    return hub
+
+
 @app.route('/stats/<chatbot_id>')
 def request_stats(chatbot_id):
-    context = zmqg.Context()
     app.logger.debug('sent stats req to %s' % chatbot_id)
-    async_stat_sub = context.socket(zmq.SUB)
-    async_stat_sub.setsockopt_string(zmq.SUBSCRIBE, 'stat_%s' % chatbot_id)
-    async_stat_sub.connect('tcp://127.0.0.1:%d' % user_output)
-    poller = zmqg.Poller()
-    poller.register(async_stat_sub, zmqg.POLLIN)
-    time.sleep(0.1)
-    pub2bot.send_string('stat_%s request' % chatbot_id)
-    socks = dict(poller.poll(timeout=2000))
-    app.logger.debug('sockets %s' % socks)
-    if async_stat_sub in socks and socks[async_stat_sub] == zmqg.POLLIN:
-        topic, msg = topic_msg_to_json(async_stat_sub.recv())
-        assert topic == 'stat_%s' % chatbot_id
-        app.logger.debug('sending back requested stats %s' % str(msg))
-        return jsonify(msg), 200
+    stats = connector_hub().request_stats([chatbot_id]).get(chatbot_id)
+    if stats is not None:
+        app.logger.debug('sending back requested stats %s' % stats)
+        return jsonify(stats), 200
     else:
         return jsonify({'response': 'Chatbot %s unknown' % chatbot_id}), 200
 
 
+@app.route('/stats')
+def fleet_stats():
+    names = set(pool.bot_names()) if pool is not None else set()
+    # dialogues with their own ChatBot, hosted sessions are counted by their hosts
+    names.update(name for name, c in connector_hub().connectors.iteritems() if c.pool is None)
+    stats = metrics.aggregate_stats(connector_hub().request_stats(names))
+    stats['queried'] = len(names)
+    stats['hibernated'] = metrics.counters['sessions_hibernated']
+    if pool is not None:
+        stats['pool'] = pool.stats()
+    if supervisor is not None:
+        stats['supervisor'] = supervisor.stats()
+    return jsonify(stats), 200
+
+
+@app.route('/pool')
+def pool_stats():
+    if pool is None:
+        return jsonify({'response': 'ChatBot pool disabled'}), 200
+    return jsonify(pool.stats()), 200
+
+
+@app.route('/metrics')
+def connector_metrics():
+    m = metrics.snapshot()
+    m['idle_timeout_s'] = idle_timeout
+    if hub is not None:
+        m['hub'] = hub.stats()
+    return jsonify(m), 200
+
+
 @app.errorhandler(404)
 def page_not_found(e):
     app.logger.error('Page not found 404: %s' % e)
@@ -82,16 +126,17 @@ def internal_server_err(e):
 def begin_dialog(msg):
     try:
         cbc = fsocketio.session['chatbot'] = ChatBotConnector(web_response,
-                                                        bot_input,
-                                                        bot_output,
-                                                        user_input,
-                                                        user_output,
-                                                        ctx=ctx)
+                                                        endpoints,
+                                                        ctx=ctx,
+                                                        pool=pool,
+                                                        ready_timeout=ready_timeout,
+                                                        hub=connector_hub(),
+                                                        idle_timeout=idle_timeout)
         cbc.start()
         if not cbc.initialized.get():
             app.logger.debug('Chatbot cannot be initialized')
             raise botex.BotNotAvailableException()
-        fsocketio.join_room(cbc.name)
+        fsocketio.join_room(cbc.room)
         app.logger.debug('ChatbotConnector initiated')
     except botex.BotNotAvailableException as exp:
         err_msg = {'status': 'error', 'message': 'Chatbot not available'}
@@ -114,6 +159,7 @@ def process_utt(msg):
             err_msg = {'status': 'error', 'message': 'Chatbot lost'}
             socketio.emit('server_error', err_msg)
             app.logger.error('Error: %s\nInput config %s\nSent to client %s', exp, msg, err_msg)
+            fsocketio.leave_room(cbc.room)
             del fsocketio.session['chatbot']
     else:
         err_msg = {'status': 'error', 'message': 'Internal server error'}
@@ -126,8 +172,8 @@ def process_utt(msg):
 def end_recognition(msg):
     try:
         cbc = fsocketio.session['chatbot']
-        fsocketio.leave_room(cbc.name)
-        fsocketio.close_room(cbc.name)
+        fsocketio.leave_room(cbc.room)
+        fsocketio.close_room(cbc.room)
         cbc.kill()
     except botex.BotEndException as exp:
         app.logger.error('Error on end: %s\n%s', exp, msg)
@@ -140,30 +186,27 @@ def web_response(msg, room_id):
     app.logger.debug('sent: %s to %s', msg, room_id)
 
 
-def start_zmq_processes(bot_in, bot_out, user_in, user_out):
+def start_zmq_processes(zmq_endpoints):
+    """Start forwarders or broker for the endpoints"""
+    devices = []
     try:
-        forwarder_process_bot = forwarder_device_start(bot_in, bot_out)
-        forwarder_process_user = forwarder_device_start(user_in, user_out)
-
-        pub2bot.connect('tcp://127.0.0.1:%d' % bot_input)
-        return forwarder_process_bot, forwarder_process_user
+        devices = zmq_endpoints.start_devices()
+        return devices
     except Exception as e:
-        shutdown_zmq_processes(forwarder_process_bot, forwarder_process_user)
+        shutdown_zmq_processes(devices)
         app.logger.error("Exception during setup processes %s" % str(e), exc_info=True)
 
 
-def shutdown_zmq_processes(forwarder_process_bot, forwarder_process_user):
-    if forwarder_process_bot is not None:
-        forwarder_process_bot.join(timeout=0.1)
-        print 'TODO terminate zmq_device'
-    if forwarder_process_user is not None:
-        forwarder_process_user.join(timeout=0.1)
-        print 'TODO terminate zmq_device'
+def shutdown_zmq_processes(devices):
+    stop_devices(devices)
 
 
 def start_log_process():
     try:
-        log_process = Process(target=chatbot2file_log_loop, kwargs={'log_name': log_name})
+        log_process = Process(target=chatbot2file_log_loop,
+                              kwargs={'log_name': log_name, 'validate_rate': log_validate_rate,
+                                      'store_dir': log_store, 'segment_bytes': int(log_segment_mb * 2 ** 20),
+                                      'workers': log_workers, 'queue_size': log_queue_size})
         log_process.start()
         return log_process
     except Exception as e:
@@ -189,16 +232,78 @@ if __name__ == '__main__':
     parser.add_argument('--bot-output', type=int, default=bot_output)
     parser.add_argument('--user-input', type=int, default=user_input)
     parser.add_argument('--user-output', type=int, default=user_output)
+    parser.add_argument('--transport', choices=['pubsub', 'router', 'inproc'], default='pubsub',
+                        help='pubsub: topic filtering forwarders, router: messages addressed via broker, '
+                             'inproc: ChatBots hosted in the web process (single node)')
+    parser.add_argument('--broker-port', type=int, default=broker_port)
+    parser.add_argument('--bind', default=bind,
+                        help='Interface the forwarders or the broker listen on, e.g. * for fleet hosts on other '
+                             'machines. Expose it only to the trusted machines, the bots exchange marshal bodies.')
     parser.add_argument('--log-config', default=log_config)
+    parser.add_argument('--pool-min', type=int, default=pool_min, help='Number of pre-started ChatBots')
+    parser.add_argument('--pool-max', type=int, default=pool_max, help='0 disables the pool')
+    parser.add_argument('--zygote', action='store_true', help='Fork pool ChatBots from process with loaded models')
+    parser.add_argument('--hosts', type=int, default=hosts,
+                        help='Number of processes hosting multiple ChatBots. If positive, used instead of the pool.')
+    parser.add_argument('--host-sessions', type=int, default=host_sessions, help='Maximum dialogues per host')
+    parser.add_argument('--fleet', action='store_true',
+                        help='Place the dialogues on the hosts registered by any machine (python -m cbot.bot.fleet), '
+                             'the --hosts local hosts join the fleet too')
+    parser.add_argument('--ready-timeout', type=float, default=ready_timeout,
+                        help='Seconds to wait until a ChatBot is ready for the dialogue')
+    parser.add_argument('--idle-timeout', type=float, default=idle_timeout,
+                        help='Seconds after which an idle dialogue is checkpointed and its ChatBot released')
+    parser.add_argument('--max-bot-rss-mb', type=float, default=None,
+                        help='ChatBot processes above the resident memory are replaced by fresh ones')
+    parser.add_argument('--max-bot-turns', type=int, default=None,
+                        help='ChatBot processes are replaced by fresh ones after the number of messages')
+    parser.add_argument('--log-validate-rate', type=float, default=log_validate_rate,
+                        help='Fraction of the logged ChatBot messages validated against the schema, e.g. 1.0 to debug')
+    parser.add_argument('--log-store', default=log_store,
+                        help='Append the ChatBot messages to a segmented store in the directory '
+                             'instead of a log file pair per session')
+    parser.add_argument('--log-segment-mb', type=float, default=log_segment_mb,
+                        help='Size of the store segments, full segments are compressed')
+    parser.add_argument('--log-workers', type=int, default=log_workers,
+                        help='Log writer processes, the sessions are sharded among them by hash')
+    parser.add_argument('--log-queue-size', type=int, default=log_queue_size,
+                        help='Messages queued for a log writer, further messages are dropped and counted')
     args = parser.parse_args()
 
     bot_input, bot_output = args.bot_input, args.bot_output
     user_input, user_output = args.user_input, args.user_output
     host, port, log_name, log_config = args.host, args.port, args.log, args.log_config
+    ready_timeout, idle_timeout = args.ready_timeout, args.idle_timeout
+    log_validate_rate = args.log_validate_rate
+    log_store, log_segment_mb = args.log_store, args.log_segment_mb
+    log_workers, log_queue_size = args.log_workers, args.log_queue_size
+
+    if args.transport == 'router':
+        endpoints = RouterEndpoints(args.broker_port, bind=args.bind)
+    elif args.transport == 'inproc':
+        assert not args.fleet, 'The fleet hosts are separate processes'
+        endpoints = InProcEndpoints()
+        args.hosts = 1  # one ChatBotHostGreenlet hosts all the dialogues
+    else:
+        endpoints = PubSubEndpoints(bot_input, bot_output, user_input, user_output, bind=args.bind)
 
     setup_logging(log_config)
-    forwarder_process_bot, forwarder_process_user = start_zmq_processes(bot_input, bot_output, user_input, user_output)
+    if args.zygote:
+        zygote = ChatBotZygote()
+        zygote.start()
+    zmq_devices = start_zmq_processes(endpoints)
     log_process = start_log_process()
+    fleet_hosts = []
+    if args.fleet:
+        pool = ChatBotFleet(endpoints, ready_timeout=ready_timeout, ctx=ctx)
+        fleet_hosts = start_hosts(endpoints, args.hosts, args.host_sessions, register_interval=1.0)
+    elif args.hosts > 0:
+        pool = ChatBotHostPool(endpoints, hosts=args.hosts, max_sessions=args.host_sessions, ctx=ctx)
+    elif args.pool_max > 0:
+        pool = ChatBotPool(endpoints, min_size=min(args.pool_min, args.pool_max), max_size=args.pool_max,
+                           spawn=zygote.spawn if zygote is not None else None, ctx=ctx)
+    max_rss_bytes = int(args.max_bot_rss_mb * 2 ** 20) if args.max_bot_rss_mb is not None else None
+    supervisor = ChatBotSupervisor(connector_hub(), pool, max_rss_bytes=max_rss_bytes, max_turns=args.max_bot_turns)
     try:
         socketio.run(app, host=host, port=port, use_reloader=False,)
     except Exception as e:
@@ -207,5 +312,14 @@ if __name__ == '__main__':
         if app.debug:
             raise e
     finally:
-        shutdown_zmq_processes(forwarder_process_bot, forwarder_process_user)
+        supervisor.shutdown()
+        if pool is not None:
+            pool.shutdown()
+        for h in fleet_hosts:
+            h.terminate()
+        if hub is not None:
+            hub.close()
+        if zygote is not None:
+            zygote.shutdown()
+        shutdown_zmq_processes(zmq_devices)
         shutdown_log_process(log_process)
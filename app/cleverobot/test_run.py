@@ -6,6 +6,7 @@ import datetime
 import app.cleverobot.run as run
 import time
 from cbot.bot.alias import HUMAN
+from cbot.bot.fixtures import make_endpoints
 
 
 class RoutingTestCase(unittest.TestCase):
@@ -27,15 +28,13 @@ class TestSocketIO(unittest.TestCase):
 
     def setUp(self):
         self.client = run.socketio.test_client(run.app)
-        port_offset = len(__file__)  # TODO hack randomize ports
-        self.forwarder_process_bot, self.forwarder_process_user = run.start_zmq_processes(
-            run.bot_input + port_offset, run.bot_output + port_offset,
-            run.user_input + port_offset, run.user_output + port_offset)
+        run.endpoints = make_endpoints('pubsub')
+        self.zmq_devices = run.start_zmq_processes(run.endpoints)
         self.logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
 
     def tearDown(self):
         self.client.disconnect()
-        run.shutdown_zmq_processes(self.forwarder_process_bot, self.forwarder_process_user)
+        run.shutdown_zmq_processes(self.zmq_devices)
         del self.client
 
     # @unittest.expectedFailure
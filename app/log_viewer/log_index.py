@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Cached listing of the log directories with the metadata of each log for the log viewer index.
+"""
+from __future__ import unicode_literals
+from collections import OrderedDict
+import json
+import logging
+import os
+import threading
+import time
+from cbot.bot.alias import HUMAN, BELIEF_STATE
+
+SORT_KEYS = ['name', 'size', 'turns', 'first', 'last']
+
+
+def scan_log(path, meta):
+    """Update the metadata of the log from the lines appended after meta['offset']:
+    the number of human messages and belief states and the first and last message time."""
+    with open(path, 'rb') as r:
+        r.seek(meta['offset'])
+        for line in r:
+            if not line.endswith(b'\n'):
+                break  # being written, scanned again once complete
+            meta['offset'] += len(line)
+            try:
+                msg = json.loads(line)
+            except ValueError:
+                continue
+            if not isinstance(msg, dict):
+                continue
+            name = msg.get('name', msg.get('user'))
+            meta['humans'] += name == HUMAN
+            meta['states'] += name == BELIEF_STATE
+            t = msg.get('time')
+            if isinstance(t, (int, float)):
+                meta['first'] = t if meta['first'] is None else min(meta['first'], t)
+                meta['last'] = t if meta['last'] is None else max(meta['last'], t)
+    meta['turns'] = meta['humans'] if meta['humans'] > 0 else meta['states']  # dm_logic logs hold the states only
+    return meta
+
+
+def new_meta(name):
+    return {'name': name, 'size': 0, 'mtime': None, 'offset': 0, 'humans': 0, 'states': 0, 'turns': 0,
+            'first': None, 'last': None}
+
+
+class LogIndex(object):
+    """Listings of the log directories kept up to date by a background thread, see start.
+
+    A directory is listed again only when its mtime changes. A log is scanned from the offset
+    it was scanned to when its size or mtime changes, so the appended session logs are read once.
+    A request reads the listing of the last refresh, the first request of a directory lists it.
+    The sorted and filtered lists of names are cached until the next change of the directory.
+    """
+    def __init__(self, interval=5.0, suffix='log', max_cached=64):
+        self.interval, self.suffix, self.max_cached = interval, suffix, max_cached
+        self.logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
+        self.dirs = {}  # path -> {'mtime', 'version', 'dirs': [names], 'logs': {name: meta}}
+        self.lock = threading.Lock()
+        self._ordered = OrderedDict()  # (path, version, sort, reverse, q) -> names, the least recently used first
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._refresh_loop, name=self.__class__.__name__)
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _refresh_loop(self):
+        while True:
+            time.sleep(self.interval)
+            for path in list(self.dirs):
+                try:
+                    self.refresh(path)
+                except EnvironmentError as e:  # removed meanwhile
+                    self.logger.warning('Dropping %s from the index: %s', path, e)
+                    with self.lock:
+                        self.dirs.pop(path, None)
+
+    def refresh(self, path):
+        """List the directory again if its mtime changed and scan the changed logs."""
+        old = self.dirs.get(path)
+        mtime = os.stat(path).st_mtime
+        if old is not None and old['mtime'] == mtime:
+            names, dirs = old['logs'].keys(), old['dirs']
+        else:
+            names, dirs = [], []
+            for n in os.listdir(path):
+                if os.path.isdir(os.path.join(path, n)):
+                    dirs.append(n)
+                elif n.endswith(self.suffix):
+                    names.append(n)
+            dirs.sort()
+        changed = old is None or old['mtime'] != mtime
+        logs, skipped = {}, False
+        for n in names:
+            meta = old['logs'].get(n) if old is not None else None
+            try:
+                st = os.stat(os.path.join(path, n))
+                if meta is None or meta['size'] != st.st_size or meta['mtime'] != st.st_mtime:
+                    meta = dict(meta) if meta is not None and st.st_size >= meta['offset'] else new_meta(n)
+                    meta['size'], meta['mtime'] = st.st_size, st.st_mtime
+                    scan_log(os.path.join(path, n), meta)
+                    changed = True
+            except EnvironmentError as e:  # removed meanwhile or unreadable
+                self.logger.warning('Skipping %s: %s', n, e)
+                changed, skipped = changed or meta is not None, True  # dropped if listed before
+                continue
+            logs[n] = meta
+        if changed:
+            with self.lock:
+                self.dirs[path] = {'mtime': mtime, 'version': old['version'] + 1 if old is not None else 0,
+                                   'dirs': dirs, 'logs': logs}
+        if skipped:
+            self.dirs[path]['mtime'] = None  # listed again by the next refresh
+        return self.dirs[path]
+
+    def _names(self, path, d, sort, reverse, q):
+        key = (path, d['version'], sort, reverse, q)
+        with self.lock:
+            names = self._ordered.pop(key, None)
+        if names is None:
+            metas = [m for m in d['logs'].itervalues() if q is None or q in m['name']]
+            # the logs without a value, e.g. without time, are last in both orders
+            present = sorted((m for m in metas if m[sort] is not None), key=lambda m: (m[sort], m['name']),
+                             reverse=reverse)
+            names = [m['name'] for m in present] + sorted(m['name'] for m in metas if m[sort] is None)
+        with self.lock:
+            self._ordered[key] = names
+            while len(self._ordered) > self.max_cached:
+                self._ordered.popitem(last=False)
+        return names
+
+    def listing(self, path, sort='name', reverse=False, q=None, page=0, per_page=100):
+        """Page of the directory: {'dirs': names, 'logs': metadata of the logs of the page, 'total', 'pages'}.
+        The logs are sorted by one of SORT_KEYS and filtered by q, a substring of their names."""
+        assert sort in SORT_KEYS, 'Unknown sort key %s' % sort
+        d = self.dirs.get(path)
+        if d is None:
+            d = self.refresh(path)
+        names = self._names(path, d, sort, reverse, q or None)
+        start = page * per_page
+        return {'dirs': [n for n in d['dirs'] if not q or q in n],
+                'logs': [d['logs'][n] for n in names[start:start + per_page]],
+                'total': len(names),
+                'pages': (len(names) + per_page - 1) // per_page, }
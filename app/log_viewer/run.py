@@ -8,16 +8,15 @@ import json
 import logging
 import os
 import time
-from zmq.utils import jsonapi
-from app.cleverobot.run import shutdown_zmq_processes, start_zmq_processes
-import zmq.green as zmqg
-from flask import Flask, render_template, request, Response, stream_with_context
+from flask import Flask, render_template, request, Response, stream_with_context, url_for
 import functools
 import cbot
-from cbot.bot.connectors import ChatBotConnector
-from cbot.bot.log import wrap_msg, topic_msg_to_json, setup_logging
-from cbot.bot.alias import HUMAN, BELIEF_STATE, SYSTEM, REPLAYED, BELIEF_STATE_REPLAY, LOGGING_ADDRESS
-from gevent.queue import Empty
+from app.log_viewer.log_index import LogIndex, SORT_KEYS
+from app.log_viewer.search import UtteranceIndex
+from cbot.bot.log import setup_logging, read_log
+from cbot.bot.replay import ReplayEngine
+from cbot.bot.alias import HUMAN, BELIEF_STATE, SYSTEM, REPLAYED, BELIEF_STATE_REPLAY
+import cbot.kb as kb
 
 
 app = Flask(__name__)
@@ -25,16 +24,13 @@ app.secret_key = 12345  # TODO
 root = os.path.realpath(os.path.join(os.path.dirname(__file__), '../../cbot/bot/logs'))
 log_name = 'logs.cleverobot.log'
 log_config = os.path.realpath(os.path.join(os.path.dirname(cbot.__file__), 'logging.json'))
-bot_input, bot_output = 6665, 7776
-user_input, user_output = 8887, 9998
 host, port = '0.0.0.0', 4000
-ctx = zmqg.Context()
-
-replay_listener = ctx.socket(zmqg.SUB)
-replay_listener.setsockopt_string(zmqg.SUBSCRIBE, '')
-replay_listener.bind(LOGGING_ADDRESS)
-poller = zmqg.Poller()
-poller.register(replay_listener, zmqg.POLLIN)
+replay_seed = 0
+_knowledge_base = None  # shared by the replays, loaded by the first one
+log_index = LogIndex()  # refreshed in the background once started
+search_dir = None  # of the utterance index, next to the root by default
+search_stores = []  # segment stores searched besides the root
+_utterance_index = None  # built by the first search
 
 FLAT_EMPTY_TURN = OrderedDict([(k, None) for k in [HUMAN, SYSTEM, BELIEF_STATE]])
 PICK_VALUES_TURN = {BELIEF_STATE: 'attributes', SYSTEM: 'utterance', HUMAN: 'utterance'}
@@ -80,21 +76,62 @@ def log_response(res):
     return res
 
 
+@app.template_filter('timestamp')
+def format_timestamp(t):
+    return '' if t is None else time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(t))
+
+
+def _int_arg(name, default, low, high):
+    try:
+        return min(max(int(request.args.get(name, default)), low), high)
+    except ValueError:
+        return default
+
+
 @app.route('/index')
 @app.route('/')
 @with_path
 def index():
     abs_path = request.normalized_path
-    content = os.listdir(abs_path)
-    name_paths = [(n, os.path.join(abs_path, n)) for n in content]
-    name_paths = [(n, p, True) if os.path.isdir(p) else (n, p, False) for n, p in name_paths]
-    name_paths = [(n, os.path.relpath(p, root), d) for n, p, d in name_paths]
-    # FIXME use url_for
-    dirs = [('/?path=%s' % p, n) for n, p, d in name_paths if d]
-    logs = [('/log?path=%s' % p, n) for n, p, d in name_paths if not d and p.endswith('log')]
+    sort = request.args.get('sort', 'name')
+    sort = sort if sort in SORT_KEYS else 'name'
+    order = 'desc' if request.args.get('order') == 'desc' else 'asc'
+    q = request.args.get('q', '')
+    page, per_page = _int_arg('page', 0, 0, 10 ** 9), _int_arg('per_page', 100, 1, 1000)
+    listing = log_index.listing(abs_path, sort, order == 'desc', q, page, per_page)
+    rel_path = os.path.relpath(abs_path, root)
+    dirs = [(url_for('index', path=os.path.join(rel_path, n)), n) for n in listing['dirs']]
+    logs = [(url_for('replay_log_path', path=os.path.join(rel_path, m['name'])), m) for m in listing['logs']]
 
     app.logger.debug('Rendering list of logs')
-    return render_template('index.html', dirs=dirs, logs=logs)
+    return render_template('index.html', dirs=dirs, logs=logs, total=listing['total'], pages=listing['pages'],
+                           path=rel_path, sort=sort, order=order, q=q, page=page, per_page=per_page,
+                           sort_keys=SORT_KEYS)
+
+
+def utterance_index():
+    global _utterance_index
+    if _utterance_index is None:
+        dir_name = search_dir if search_dir is not None else os.path.join(os.path.dirname(root), 'logs_search')
+        _utterance_index = UtteranceIndex(dir_name, root, search_stores)
+        _utterance_index.update()
+    return _utterance_index
+
+
+@app.route('/search')
+def search():
+    q = request.args.get('q', '')
+    name = request.args.get('name')
+    name = name if name in [HUMAN, SYSTEM] else None
+    limit = _int_arg('limit', 50, 1, 1000)
+    start = time.time()
+    found = utterance_index().search(q, name, limit)
+    took_ms = (time.time() - start) * 1000
+    for r in found['results']:
+        r['url'] = url_for('replay_log_path', path=r['source']) if r['source'] not in search_stores else None
+    if request.args.get('format') == 'json':
+        return Response(json.dumps(dict(found, query=q, took_ms=took_ms)), mimetype='application/json')
+    return render_template('search.html', q=q, name=name, limit=limit, took_ms=took_ms, **found)
 
 
 def _stream_template(template_name, **context):
@@ -106,9 +143,12 @@ def _stream_template(template_name, **context):
 
 
 def turnify_conversation(msgs):
+    """Yield the turns of the messages as soon as they are complete, msgs may be a generator."""
     previous, last = 'Previous', 'Last'
-    turns, flat = [], FLAT_EMPTY_TURN.copy()
+    flat = FLAT_EMPTY_TURN.copy()
+    n_msgs, n_turns = 0, 0
     for m in msgs:
+        n_msgs += 1
         if 'name' not in m and 'user' in m:
             m['name'] = m['user']  # TODO HACK FOR BACKWARD COMPATIBILITY
         assert 'name' in m, 'Broken msg: %s' % m
@@ -116,122 +156,92 @@ def turnify_conversation(msgs):
         flat[last] = str(m[PICK_VALUES_TURN[last]])  # extract content based on the type from the wrapper message
         assert last in FLAT_EMPTY_TURN, 'last %s not in FLAT_EMPTY_TURN %s' % (last, FLAT_EMPTY_TURN)
         if previous == last or all([v is not None for v in flat.values()]):
-            turns.append(flat)
+            n_turns += 1
+            yield flat
             flat = FLAT_EMPTY_TURN.copy()
 
     not_none = [v is not None for v in flat.values()]
     if last != 'Last' and previous != last and not all(not_none) and any(not_none):
-        turns.append(flat)
-    app.logger.debug(
-        'Created %d turns from %d msgs: %.2f msg per turn (expected 3)' % (len(turns), len(msgs), len(msgs) / len(turns)))
-    return turns
+        n_turns += 1
+        yield flat
+    app.logger.debug('Created %d turns from %d msgs: %.2f msg per turn (expected 3)' % (
+        n_turns, n_msgs, n_msgs / n_turns if n_turns > 0 else 0))
 
 
 def _read_conversation(abs_path):
-    with open(abs_path, 'r') as r:
-        msgs = []
-        for line in r:
-            try:
-                msgs.append(jsonapi.loads(line))
-            except ValueError as e:
-                app.logger.warning('Skipping utterance %s cannot parse as json (Exception: %s)' % (line, e))
-    return msgs
-
-
-def _just_logging(msg, chatbot_id):
-    app.logger.info('ChatBot[%s] replied %s' % (chatbot_id, msg))
-
-
-def _get_answers_and_states(timeout):
-    assert timeout >= 0
-    raw_answers, raw_belief_states = [], []
-    start = time.clock()
-    remaining = timeout + start - time.clock()
-    eps = timeout / 10.0
-    while remaining > eps:
-        # app.logger.debug('seconds remaining till timeout %f', remaining)
-        socks = dict(poller.poll(timeout=remaining))
-        # app.logger.debug('after poll')
-        if replay_listener in socks and socks[replay_listener] == zmqg.POLLIN:
-            app.logger.debug('Received message.')
-            level, anw = replay_listener.recv_multipart()
-            app.logger.debug('Reply answer: %s' % str(anw))
-            _, msg = topic_msg_to_json(anw)
-            assert 'name' in msg, 'Broken msg %s' % msg
-            if msg['name'] == SYSTEM:
-                raw_answers.append(msg)
-            elif msg['name'] == BELIEF_STATE:
-                raw_belief_states.append(msg)
-            else:
-                app.logger.warning('Unknown message from ChatBot')
-        else:
-            # app.logger.debug('Nothing received, just timeout expired.')
-            pass
-        remaining = timeout + start - time.clock()
-    answers = [str(m['utterance']) for m in raw_answers]
-    belief_states = [json.dumps(bs['attributes'], sort_keys=True, indent=4, separators=(',', ': ')) for bs in raw_belief_states]
-
-    return answers, belief_states
-
-
-def _gen_data(cbc, recorded_ms, replay_listener, timeout=0.1):
-    recorded_turns = turnify_conversation(recorded_ms)
-    i = 0
-    while i < len(recorded_turns):
-        app.logger.debug('processing [%d/%d] turns' % (i, len(recorded_turns)))
-        if recorded_turns[i][HUMAN] is not None:
-            app.logger.debug('%d: Sending msg to replay bot %s' % (i, recorded_turns[i][HUMAN]))
-            cbc.send(wrap_msg(recorded_turns[i][HUMAN]))
-            try:
-                anws, bss = _get_answers_and_states(timeout)
-                app.logger.debug('answers and belief states: %s' % [(a,b) for a,b in izip_longest(anws, bss)])
-                anws_bss = list(izip_longest(anws, bss))
-                for j, (a, b) in enumerate(anws_bss):
-                    app.logger.debug('j: %d, i: %d' % (j, i))
-                    if j == 0:
-                        recorded_turns[i][REPLAYED], recorded_turns[i][BELIEF_STATE_REPLAY] = a, b
-                        yield recorded_turns[i]
-                        i += 1
-                    else:  # j >= 1
-                        # More answer for one input
-                        if i < len(recorded_turns) and recorded_turns[i][HUMAN] is None:
-                            # If the recorded answers had more answers too
-                            recorded_turns[i][REPLAYED], recorded_turns[i][BELIEF_STATE_REPLAY] = a, b
-                            yield recorded_turns[i]
-                            i += 1
-                        else:
-                            new_turn = FLAT_EMPTY_TURN.copy()
-                            new_turn[REPLAYED], new_turn[BELIEF_STATE_REPLAY] = a, b
-                            yield new_turn
-                if len(anws_bss) == 0:
-                    app.logger.info("No replayed answers.")
-                    recorded_turns[i][REPLAYED], recorded_turns[i][BELIEF_STATE_REPLAY] = None, None
-                    yield recorded_turns[i]
-                    i += 1
-            except Empty:
-                i += 1
-                app.logger.warning('System not responded to "%s"' % recorded_turns[i][HUMAN])
-        else:
-            yield recorded_turns[i]
-            i += 1
+    """Yield the messages of the log file one by one, the belief state deltas expanded."""
+    return read_log(abs_path)
+
+
+class Lookahead(object):
+    """Iterator which can peek at its next item."""
+    _empty = object()
+
+    def __init__(self, iterable):
+        self.it, self.head = iter(iterable), self._empty
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        if self.head is not self._empty:
+            head, self.head = self.head, self._empty
+            return head
+        return next(self.it)
+
+    def peek(self, default=None):
+        if self.head is self._empty:
+            self.head = next(self.it, self._empty)
+        return default if self.head is self._empty else self.head
+
+
+def replay_engine():
+    """ReplayEngine of one replay, the dialogues streamed to several clients do not share ChatBots."""
+    global _knowledge_base
+    if _knowledge_base is None:
+        _knowledge_base = kb.KnowledgeBase()
+        _knowledge_base.load_default_models()
+    return ReplayEngine(_knowledge_base, seed=replay_seed)
+
+
+def _gen_data(engine, recorded_ms):
+    """Yield the recorded turns with the replayed ones as soon as they are replayed."""
+    recorded_turns = Lookahead(turnify_conversation(recorded_ms))
+    engine.start()
+    for i, turn in enumerate(recorded_turns):
+        app.logger.debug('processing %d turn' % i)
+        if turn[HUMAN] is None:
+            yield turn
+            continue
+        app.logger.debug('%d: Sending msg to replay bot %s' % (i, turn[HUMAN]))
+        anws, bss = engine.turn(turn[HUMAN])
+        bss = [json.dumps(bs, sort_keys=True, indent=4, separators=(',', ': ')) for bs in bss]
+        anws_bss = list(izip_longest(anws, bss))
+        app.logger.debug('answers and belief states: %s' % anws_bss)
+        if len(anws_bss) == 0:
+            app.logger.info("No replayed answers.")
+            turn[REPLAYED], turn[BELIEF_STATE_REPLAY] = None, None
+            yield turn
+        for j, (a, b) in enumerate(anws_bss):
+            if j > 0:  # More answer for one input
+                next_turn = recorded_turns.peek()
+                if next_turn is not None and next_turn[HUMAN] is None:
+                    turn = next(recorded_turns)  # If the recorded answers had more answers too
+                else:
+                    turn = FLAT_EMPTY_TURN.copy()
+            turn[REPLAYED], turn[BELIEF_STATE_REPLAY] = a, b
+            yield turn
         app.logger.debug("finished processing %d turn" % i)
-    cbc.kill()
 
 
 def _replay_log(abs_path):
-    cbc = ChatBotConnector(_just_logging, bot_input, bot_output, user_input, user_output, ctx=ctx)
-    cbc.start()
-
-    # TODO fix handlers so it does not polute the logs with user human interactive communication
-    if not cbc.initialized.get():
-        res = render_template("error.html", msg="Chatbot not initialized")
-    else:
-        msgs = _read_conversation(abs_path)
-        res = Response(stream_with_context(
-            _stream_template('log.html',
-                             headers=EXTENDED_VALUES_TURN,
-                             data=_gen_data(cbc, msgs, replay_listener))))
-    return res
+    if not os.path.isfile(abs_path):  # the log is read only once the page is streamed
+        return render_template("error.html", error='404', msg='No log %s' % os.path.relpath(abs_path, root)), 404
+    msgs = _read_conversation(abs_path)
+    return Response(stream_with_context(
+        _stream_template('log.html',
+                         headers=EXTENDED_VALUES_TURN,
+                         data=_gen_data(replay_engine(), msgs))))
 
 
 @app.route('/log')
@@ -261,23 +271,25 @@ if __name__ == '__main__':
     parser.set_defaults(debug=True)
     parser.add_argument('-l', '--log', default=log_name)
     parser.add_argument('-r', '--root', default=root)
-    parser.add_argument('--bot-input', type=int, default=bot_input)
-    parser.add_argument('--bot-output', type=int, default=bot_output)
-    parser.add_argument('--user-input', type=int, default=user_input)
-    parser.add_argument('--user-output', type=int, default=user_output)
+    parser.add_argument('--seed', type=int, default=replay_seed, help='Seed of the replays')
+    parser.add_argument('--search-index', default=None, help='Directory of the utterance index, '
+                                                             'default: logs_search next to the root')
+    parser.add_argument('--store', action='append', default=[], help='Segment store to search besides the root, '
+                                                                    'may be repeated')
     parser.add_argument('--log-config', default=log_config)
     args = parser.parse_args()
 
-    bot_input, bot_output = args.bot_input, args.bot_output
-    user_input, user_output = args.user_input, args.user_output
     host, port, log_name, log_config = args.host, args.port, args.log, args.log_config
+    replay_seed = args.seed
+    search_dir, search_stores = args.search_index, args.store
 
     root = os.path.realpath(args.root)
     if not os.path.isdir(root):
         raise KeyError("argument root is not a directory: %s" % root)
 
     setup_logging(log_config)
-    forwarder_process_bot, forwarder_process_user = start_zmq_processes(bot_input, bot_output, user_input, user_output)
+    log_index.start()
+    utterance_index().start()
     try:
         app.run(host=host, port=port, debug=args.debug, use_reloader=False)
     except Exception as e:
@@ -285,5 +297,3 @@ if __name__ == '__main__':
         app.logger.error("Top level exception", exc_info=True)
         if app.debug:
             raise e
-    finally:
-        shutdown_zmq_processes(forwarder_process_bot, forwarder_process_user)
@@ -0,0 +1,267 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Full-text index of the recorded human and ChatBot utterances for the log viewer search.
+
+Each utterance is a document with its session and turn, the turn of a reply is the turn of the human
+message it follows. The index directory holds
+
+    docs.jsonl      a line per document [session, turn, name, utterance, time, source]
+    postings.jsonl  a line per update {term: [document numbers]}, merged when loaded
+    state.json      the sizes of the files above and how far the session logs and segment stores were read
+
+Only the lines appended to the session logs and the newly sealed segments of the stores are read by an update,
+the lines appended after the last state.json, e.g. by an interrupted update, are cut when the index is opened.
+An update reads into a copy of the state, which replaces the state once the documents and postings are synced.
+A log or store which cannot be read is skipped by the update and read from where it was by the next one.
+"""
+from __future__ import unicode_literals
+from array import array
+from bisect import bisect_left
+import copy
+import errno
+import json
+import logging
+import os
+import re
+import threading
+import time
+from cbot.bot.alias import HUMAN, SYSTEM
+from cbot.bot.log import session_logs
+from cbot.bot.store import SegmentStore
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+UTTERANCE_NAMES = [HUMAN, SYSTEM]
+DOC_FIELDS = ['session', 'turn', 'name', 'utterance', 'time', 'source']
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(text.lower())
+
+
+def name_term(name):
+    return 'name:%s' % name  # never a token, the tokens have no colon
+
+
+def contains(ids, doc):
+    i = bisect_left(ids, doc)
+    return i < len(ids) and ids[i] == doc
+
+
+class UtteranceIndex(object):
+    """Inverted index of the utterances of the session logs in root and of the sealed segments of the stores.
+    The index is updated by update or by a background thread, see start, and searched concurrently."""
+    def __init__(self, dir_name, root=None, stores=(), interval=5.0, compact_batches=64):
+        self.dir_name, self.root, self.stores = dir_name, root, list(stores)
+        self.interval, self.compact_batches = interval, compact_batches
+        self.logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
+        try:
+            os.makedirs(dir_name)
+        except OSError, e:
+            if e.errno != errno.EEXIST:
+                raise
+        self.lock = threading.Lock()
+        self.postings = {}  # term -> array of the increasing document numbers
+        self.offsets = array(b'L')  # document number -> offset in docs.jsonl
+        self.state = {'docs_bytes': 0, 'postings_bytes': 0, 'batches': 0, 'files': {}, 'stores': {}}
+        self._thread = None
+        self.load()
+
+    def path(self, name):
+        return os.path.join(self.dir_name, name)
+
+    def load(self):
+        """Read the index written by the last completed update."""
+        try:
+            with open(self.path('state.json'), 'rb') as r:
+                self.state = json.load(r)
+        except IOError, e:
+            if e.errno != errno.ENOENT:
+                raise
+        self._cut_interrupted(self.state)
+        offsets, postings = array(b'L'), {}
+        with open(self.path('docs.jsonl'), 'rb') as r:
+            offset = 0
+            for line in r:
+                offsets.append(offset)
+                offset += len(line)
+        with open(self.path('postings.jsonl'), 'rb') as r:
+            for line in r:
+                for term, ids in json.loads(line).iteritems():
+                    postings.setdefault(term, array(b'L')).extend(ids)
+        with self.lock:
+            self.offsets, self.postings = offsets, postings
+
+    def _cut_interrupted(self, state):
+        for name, size in [('docs.jsonl', state['docs_bytes']), ('postings.jsonl', state['postings_bytes'])]:
+            with open(self.path(name), 'ab') as f:
+                if f.tell() > size:
+                    self.logger.warning('Cutting %d bytes of an interrupted update from %s', f.tell() - size, name)
+                    f.truncate(size)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._update_loop, name=self.__class__.__name__)
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _update_loop(self):
+        while True:
+            try:
+                self.update()
+            except Exception as e:
+                self.logger.exception(e)
+            time.sleep(self.interval)
+
+    def _read_files(self, state, docs):
+        if self.root is None:
+            return
+        for session, (io_path, dm_path) in sorted(session_logs(self.root).iteritems()):
+            path = io_path if io_path is not None else dm_path  # dm_logic of the former layout holds the utterances
+            read = dict(state['files'].get(path, {'offset': 0, 'humans': 0}))
+            first = len(docs)
+            try:
+                self._read_file(session, path, read, docs)
+            except EnvironmentError as e:
+                self.logger.warning('Skipping %s in this update: %s', path, e)
+                del docs[first:]
+                continue
+            state['files'][path] = read
+
+    def _read_file(self, session, path, read, docs):
+        size = os.path.getsize(path)
+        if size < read['offset']:  # truncated or rotated, read again from the start
+            self.logger.warning('Reading %s again, it is shorter than when it was read', path)
+            read['offset'], read['humans'] = 0, 0
+        if size <= read['offset']:
+            return
+        source = os.path.relpath(path, self.root)
+        with open(path, 'rb') as r:
+            r.seek(read['offset'])
+            for line in r:
+                if not line.endswith(b'\n'):
+                    break  # being written, read once complete
+                read['offset'] += len(line)
+                if b'"utterance"' in line:  # the belief states are not parsed
+                    read['humans'] = self._add_doc(docs, session, read['humans'], line, source)
+
+    def _read_stores(self, state, docs):
+        for store_dir in self.stores:
+            read = copy.deepcopy(state['stores'].get(store_dir, {'segments': [], 'humans': {}}))
+            first = len(docs)
+            try:
+                self._read_store(store_dir, read, docs)
+            except EnvironmentError as e:
+                self.logger.warning('Skipping the store %s in this update: %s', store_dir, e)
+                del docs[first:]
+                continue
+            state['stores'][store_dir] = read
+
+    def _read_store(self, store_dir, read, docs):
+        store = SegmentStore(store_dir)
+        done = set(read['segments'])
+        for segment in sorted(store.sealed - done):
+            entries = sorted((e for es in store.index.itervalues() for e in es if e['segment'] == segment),
+                             key=lambda e: e['offset'])
+            for entry in entries:
+                session = entry['session']
+                humans = read['humans'].get(session, 0)
+                for level, msg in store.read_entry(entry):
+                    if level == 'WARNING':  # the input_output messages
+                        humans = self._add_doc(docs, session, humans, msg, store_dir)
+                read['humans'][session] = humans
+            read['segments'].append(segment)
+
+    def _add_doc(self, docs, session, humans, line, source):
+        """Append the document of the message line if it has an utterance, return the number of human messages."""
+        try:
+            msg = json.loads(line)
+        except ValueError:
+            self.logger.warning('Skipping broken line %r', line)
+            return humans
+        name = msg.get('name', msg.get('user')) if isinstance(msg, dict) else None
+        if name not in UTTERANCE_NAMES or not msg.get('utterance'):
+            return humans
+        turn = humans if name == HUMAN else max(humans - 1, 0)
+        docs.append([session, turn, name, msg['utterance'], msg.get('time'), source])
+        return humans + (name == HUMAN)
+
+    def update(self):
+        """Index the utterances appended since the last update, return the number of new documents.
+        Only one thread updates the index."""
+        state, docs = copy.deepcopy(self.state), []
+        self._read_files(state, docs)
+        self._read_stores(state, docs)
+        first = len(self.offsets)
+        offsets, batch = array(b'L'), {}
+        if len(docs) > 0:
+            self._cut_interrupted(state)
+            with open(self.path('docs.jsonl'), 'ab') as w:
+                offset = state['docs_bytes']
+                for i, doc in enumerate(docs):
+                    line = json.dumps(doc).encode('utf-8') + b'\n'
+                    w.write(line)
+                    offsets.append(offset)
+                    offset += len(line)
+                    for term in set(tokenize(doc[3])) | {name_term(doc[2])}:
+                        batch.setdefault(term, []).append(first + i)
+                w.flush()
+                os.fsync(w.fileno())
+                state['docs_bytes'] = offset
+            with open(self.path('postings.jsonl'), 'ab') as w:
+                w.write(json.dumps(batch, sort_keys=True).encode('utf-8') + b'\n')
+                w.flush()
+                os.fsync(w.fileno())
+                state['postings_bytes'] = w.tell()
+            state['batches'] += 1
+        self._write_state(state)  # also the read offsets of the logs without utterances
+        self.state = state
+        with self.lock:
+            self.offsets.extend(offsets)  # before the postings refer to them
+            for term, ids in batch.iteritems():
+                self.postings.setdefault(term, array(b'L')).extend(ids)
+        if self.state['batches'] > self.compact_batches:
+            self.compact()
+        return len(docs)
+
+    def _write_state(self, state):
+        tmp = self.path('state.json.tmp')
+        with open(tmp, 'wb') as w:
+            json.dump(state, w)
+            w.flush()
+            os.fsync(w.fileno())
+        os.rename(tmp, self.path('state.json'))
+
+    def compact(self):
+        """Rewrite the postings of all the updates as one."""
+        with self.lock:
+            merged = dict((term, ids.tolist()) for term, ids in self.postings.iteritems())
+        tmp = self.path('postings.jsonl.tmp')
+        with open(tmp, 'wb') as w:
+            w.write(json.dumps(merged, sort_keys=True).encode('utf-8') + b'\n')
+            w.flush()
+            os.fsync(w.fileno())
+            size = w.tell()
+        os.rename(tmp, self.path('postings.jsonl'))
+        self.state['postings_bytes'], self.state['batches'] = size, 1
+        self._write_state(self.state)
+
+    def search(self, query, name=None, limit=50):
+        """{'total', 'results'} of the utterances with all the words of the query, optionally of the
+        human or the ChatBot only. The results are the last limit documents, the latest first."""
+        terms = set(tokenize(query))
+        if len(terms) == 0:
+            return {'total': 0, 'results': []}
+        if name is not None:
+            terms.add(name_term(name))
+        with self.lock:
+            lists = [self.postings.get(t, ()) for t in terms]
+            offsets = self.offsets
+        lists.sort(key=len)
+        matches = [d for d in lists[0] if all(contains(ids, d) for ids in lists[1:])]
+        results = []
+        with open(self.path('docs.jsonl'), 'rb') as r:
+            for d in reversed(matches[-limit:] if limit > 0 else []):
+                r.seek(offsets[d])
+                results.append(dict(zip(DOC_FIELDS, json.loads(r.readline()))))
+        return {'total': len(matches), 'results': results}
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# encoding: utf-8
+from __future__ import unicode_literals
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from app.log_viewer import log_index
+from app.log_viewer.log_index import LogIndex
+
+
+class LogIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.dir_name = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.dir_name, 'old'))
+        for i in range(25):
+            self.append('%02dinput_output.log' % i, [{'name': 'human', 'time': 100 + i}] * (i % 5) +
+                        [{'name': 'chat_bot', 'time': 200 - i}])
+        self.index = LogIndex()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir_name)
+
+    def append(self, name, msgs, tail=b''):
+        with open(os.path.join(self.dir_name, name), 'ab') as w:
+            w.writelines(json.dumps(m).encode('utf-8') + b'\n' for m in msgs)
+            w.write(tail)
+
+    def test_listing(self):
+        page = self.index.listing(self.dir_name, 'turns', reverse=True, page=1, per_page=10)
+        self.assertEqual((page['total'], page['pages'], page['dirs']), (25, 3, ['old']))
+        self.assertEqual([m['turns'] for m in page['logs']], [2, 2, 2, 2, 2, 1, 1, 1, 1, 1])
+        self.assertEqual(page['logs'][0]['name'], '22input_output.log')  # the ties by name in the same order
+        log = self.index.listing(self.dir_name, 'first', q='04')['logs'][0]
+        self.assertEqual((log['first'], log['last'], log['turns']), (100 + 4, 200 - 4, 4))
+        self.assertEqual(self.index.listing(self.dir_name, q='old')['total'], 0)
+        self.assertEqual(self.index.listing(self.dir_name, q='old')['dirs'], ['old'])
+
+    def test_incremental_refresh(self):
+        self.index.listing(self.dir_name)
+        version = self.index.dirs[self.dir_name]['version']
+        self.index.refresh(self.dir_name)
+        self.assertEqual(self.index.dirs[self.dir_name]['version'], version)  # nothing changed
+        self.append('00input_output.log', [{'name': 'human', 'time': 50}], tail=b'{"name": "hu')
+        self.index.refresh(self.dir_name)
+        log = self.index.listing(self.dir_name, 'first')['logs'][0]
+        self.assertEqual((log['name'], log['turns'], log['first']), ('00input_output.log', 1, 50))
+        self.assertLess(log['offset'], log['size'])  # the incomplete line is scanned once complete
+        self.append('00input_output.log', [], tail=b'man", "time": 300}\n')
+        self.append('99dm_logic.log', [{'name': 'belief_state'}] * 7)
+        self.index.refresh(self.dir_name)
+        page = self.index.listing(self.dir_name, 'last', reverse=True)
+        self.assertEqual(page['total'], 26)
+        self.assertEqual([(m['name'], m['turns']) for m in page['logs'][:1] + page['logs'][-1:]],
+                         [('00input_output.log', 2), ('99dm_logic.log', 7)])  # no time, last in both orders
+
+    def test_unreadable_log(self):
+        def scan_log(path, meta):
+            if path.endswith('03input_output.log'):
+                raise IOError(13, 'Permission denied', path)
+            return original(path, meta)
+        original = log_index.scan_log
+        log_index.scan_log = scan_log
+        try:
+            page = self.index.listing(self.dir_name)
+        finally:
+            log_index.scan_log = original
+        self.assertEqual(page['total'], 24)
+        self.index.refresh(self.dir_name)
+        self.assertEqual(self.index.listing(self.dir_name)['total'], 25)  # scanned once readable
+
+
+if __name__ == '__main__':
+    unittest.main()
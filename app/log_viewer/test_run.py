@@ -1,10 +1,12 @@
 #!/usr/bin/env python
 # encoding: utf-8
+import json
 import os
-from app.cleverobot.run import shutdown_zmq_processes, start_zmq_processes
+import shutil
+import tempfile
 import unittest
 import app.log_viewer.run as run
-from cbot.bot.alias import REPLAYED
+from cbot.bot.alias import REPLAYED, HUMAN, SYSTEM, BELIEF_STATE
 
 
 class RoutingTestCase(unittest.TestCase):
@@ -25,21 +27,67 @@ class RoutingTestCase(unittest.TestCase):
         rs = self.client.get('/')
         self.assertIn('test_dm_logic.log', rs.data)
 
+    def test_sorted_page(self):
+        rs = self.client.get('/?sort=size&order=desc&per_page=1&page=1&q=test_')
+        self.assertEqual(rs.status, '200 OK')
+        self.assertIn('test_input_output.log', rs.data)  # the smaller log on the second page
+        self.assertNotIn('test_dm_logic.log</a>', rs.data)
+        self.assertIn('Page 2 of 2', rs.data)
+
+
+class SearchTestCase(unittest.TestCase):
+    def setUp(self):
+        run.root = os.path.realpath(os.path.join(os.path.dirname(__file__), 'test_logs'))
+        run.search_dir, run._utterance_index = tempfile.mkdtemp(), None
+        self.client = run.app.test_client()
+
+    def tearDown(self):
+        shutil.rmtree(run.search_dir)
+        run.search_dir, run._utterance_index = None, None
+
+    def test_search(self):
+        rs = self.client.get('/search?q=hello&format=json')
+        found = json.loads(rs.data)
+        self.assertGreater(found['total'], 0)
+        self.assertEqual(found['results'][0]['session'], 'test_')
+        self.assertIn('hello', found['results'][0]['utterance'].lower())
+        rs = self.client.get('/search?q=hello&name=human')
+        self.assertEqual(rs.status, '200 OK')
+        self.assertIn('/log?path=test_input_output.log', rs.data)
+
+
+class StreamingTestCase(unittest.TestCase):
+    def test_read_lazily(self):
+        msgs = run._read_conversation(os.path.join(os.path.dirname(__file__), 'test_logs', 'test_dm_logic.log'))
+        self.assertEqual(next(msgs)['utterance'], 'Hello')
+        self.assertEqual(next(msgs)['name'], BELIEF_STATE)
+        self.assertGreater(len(list(run.turnify_conversation(msgs))), 1)
+
+    def test_turnify_lazily(self):
+        def msgs():
+            yield {'name': HUMAN, 'utterance': 'Hello'}
+            yield {'name': BELIEF_STATE, 'attributes': {}}
+            yield {'name': SYSTEM, 'utterance': 'Hi!'}
+            raise AssertionError('The first turn was not yielded before the next message')
+        turn = next(run.turnify_conversation(msgs()))
+        self.assertEqual((turn[HUMAN], turn[SYSTEM]), ('Hello', 'Hi!'))
+
+    def test_lookahead(self):
+        it = run.Lookahead(range(2))
+        self.assertEqual(it.peek(), 0)
+        self.assertEqual(list(it), [0, 1])
+        self.assertIsNone(it.peek())
+
 
 class ReplayingLogTestCase(unittest.TestCase):
     def setUp(self):
         log_root = os.path.realpath(os.path.join(os.path.dirname(__file__), 'test_logs'))
         run.root = log_root
-        port_offset = 0  # len(__file__)  # TODO hack randomize ports TODO works only 0 probably bug
         run.app.config['TESTING'] = True
         self.client = run.app.test_client()
-        self.forwarder_process_bot, self.forwarder_process_user = \
-            start_zmq_processes(run.bot_input + port_offset, run.bot_output + port_offset,
-                                        run.user_input + port_offset, run.user_output + port_offset)
 
     def tearDown(self):
         self.client.delete()
-        shutdown_zmq_processes(self.forwarder_process_bot, self.forwarder_process_user)
 
     def test_display_recorded_data(self):
         rs = self.client.get('/log?path=test_dm_logic.log')
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# encoding: utf-8
+from __future__ import unicode_literals
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from app.log_viewer.search import UtteranceIndex, tokenize
+from cbot.bot.alias import HUMAN, SYSTEM, BELIEF_STATE
+from cbot.bot.store import SegmentStore, encode_line
+
+
+def dialogue(*utterances):
+    msgs = []
+    for i, u in enumerate(utterances):
+        msgs.append({'name': HUMAN if i % 2 == 0 else SYSTEM, 'utterance': u, 'time': 100 + i})
+    return msgs
+
+
+class UtteranceIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.root, self.dir_name = tempfile.mkdtemp(), tempfile.mkdtemp()
+        self.append('1input_output.log', dialogue('Hello', 'Hi!', 'Who is Little Richard?', 'A singer.'))
+        self.append('1dm_logic.log', [{'name': BELIEF_STATE, 'attributes': {'utterance': 'not indexed'}}])
+        self.append('2dm_logic.log', dialogue('I know Little Richard', 'Great!'))
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+        shutil.rmtree(self.dir_name)
+
+    def append(self, name, msgs, tail=b''):
+        with open(os.path.join(self.root, name), 'ab') as w:
+            w.writelines(json.dumps(m).encode('utf-8') + b'\n' for m in msgs)
+            w.write(tail)
+
+    def found(self, index, query, name=None):
+        return [(r['session'], r['turn'], r['utterance']) for r in index.search(query, name)['results']]
+
+    def test_search(self):
+        index = UtteranceIndex(self.dir_name, self.root)
+        self.assertEqual(index.update(), 6)
+        self.assertEqual(self.found(index, 'little RICHARD'),
+                         [('2', 0, 'I know Little Richard'), ('1', 1, 'Who is Little Richard?')])
+        self.assertEqual(self.found(index, 'richard singer'), [])
+        self.assertEqual(self.found(index, 'hi', SYSTEM), [('1', 0, 'Hi!')])
+        self.assertEqual(self.found(index, 'hi', HUMAN), [])
+        self.assertEqual(self.found(index, 'indexed'), [])
+        self.assertEqual(index.search('richard', limit=1)['total'], 2)
+        self.assertEqual(index.search('?!')['total'], 0)
+
+    def test_incremental_and_persistent(self):
+        index = UtteranceIndex(self.dir_name, self.root)
+        index.update()
+        self.append('1input_output.log', dialogue('Bye Richard'), tail=b'{"name": "human", "utt')
+        self.assertEqual(index.update(), 1)
+        self.assertEqual(index.update(), 0)
+        self.assertEqual(self.found(index, 'richard', HUMAN)[0], ('1', 2, 'Bye Richard'))
+
+        with open(os.path.join(self.dir_name, 'docs.jsonl'), 'ab') as w:
+            w.write(b'["interrupted", 0, "human", "richard"')  # an update cut before its state was written
+        reopened = UtteranceIndex(self.dir_name, self.root)
+        self.assertEqual(self.found(reopened, 'richard'), self.found(index, 'richard'))
+        self.append('1input_output.log', [], tail=b'erance": "Richard again"}\n')
+        self.assertEqual(reopened.update(), 1)
+        self.assertEqual(self.found(reopened, 'richard')[0], ('1', 3, 'Richard again'))
+
+    def test_truncated_log(self):
+        index = UtteranceIndex(self.dir_name, self.root)
+        index.update()
+        with open(os.path.join(self.root, '1input_output.log'), 'wb'):
+            pass  # rotated
+        self.append('1input_output.log', dialogue('Richard after rotation'))
+        self.assertEqual(index.update(), 1)
+        self.assertEqual(self.found(index, 'rotation'), [('1', 0, 'Richard after rotation')])
+
+    def test_failed_update(self):
+        index = UtteranceIndex(self.dir_name, self.root)
+        getsize, fsync, missing = os.path.getsize, os.fsync, os.path.join(self.root, '1input_output.log')
+
+        def removed(path):
+            if path == missing:
+                raise OSError(2, 'No such file or directory', path)
+            return getsize(path)
+
+        def failing(fd):
+            raise OSError(28, 'No space left on device')
+
+        try:
+            os.path.getsize = removed
+            self.assertEqual(index.update(), 2)  # the other log is indexed
+            os.path.getsize = getsize
+            os.fsync = failing
+            self.assertRaises(OSError, index.update)
+        finally:
+            os.path.getsize, os.fsync = getsize, fsync
+        self.assertEqual(index.update(), 4)  # neither the skipped log nor the failed update were lost
+        self.assertEqual(len(self.found(index, 'richard')), 2)
+        self.assertEqual(self.found(UtteranceIndex(self.dir_name, self.root), 'hi'), [('1', 0, 'Hi!')])
+
+    def test_compact(self):
+        index = UtteranceIndex(self.dir_name, self.root, compact_batches=1)
+        index.update()
+        self.append('2dm_logic.log', dialogue('Richard'))
+        index.update()
+        self.assertEqual(index.state['batches'], 1)
+        self.assertEqual(self.found(UtteranceIndex(self.dir_name, self.root), 'richard'), self.found(index, 'richard'))
+
+    def test_store(self):
+        store_dir = os.path.join(self.root, 'store')
+        store = SegmentStore(store_dir)
+        for session, msgs in [('a', dialogue('Hello store')), ('b', dialogue('Hello', 'Hi store'))]:
+            store.append(b''.join(encode_line('WARNING', session, json.dumps(m).encode('utf-8')) for m in msgs))
+        index = UtteranceIndex(self.dir_name, stores=[store_dir])
+        self.assertEqual(index.update(), 0)  # the active segment is not sealed yet
+        store.seal()
+        store.append(encode_line('WARNING', 'b', json.dumps(dialogue('Bye store')[0]).encode('utf-8')))
+        store.seal()
+        store.close()
+        self.assertEqual(index.update(), 4)
+        self.assertEqual(self.found(index, 'store'), [('b', 1, 'Bye store'), ('b', 0, 'Hi store'),
+                                                      ('a', 0, 'Hello store')])
+
+    def test_tokenize(self):
+        self.assertEqual(tokenize('Who is Mötley Crüe?'), ['who', 'is', 'mötley', 'crüe'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -6,8 +6,10 @@ REPLAYED = 'replayed'
 BELIEF_STATE_REPLAY = BELIEF_STATE + '_' + REPLAYED
 
 BASIC_JSON_MSG_SCHEMA = {
-    "name": "string",
-    "session": "string"
+    "type": "object",
+    "properties": {"name": {"type": "string"}, "session": {"type": "string"}},
+    "required": ["name", "session"]
 }
 
 CHATBOT_MSG_LOGGER = 'ChatBotZMQ_messages'
+STATE_SNAPSHOT_INTERVAL = 10  # the belief state is logged in full every 10 turns and as deltas in between, None full
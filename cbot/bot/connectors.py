@@ -1,52 +1,97 @@
 #!/usr/bin/env python
 # encoding: utf-8
 from __future__ import unicode_literals
+from collections import deque
 from greenlet import GreenletExit
-import json
 import multiprocessing
+import os
+import socket
 import time
 import logging
 import cbot
-from cbot.bot.alias import BELIEF_STATE, SYSTEM, HUMAN
+from cbot.bot.alias import BELIEF_STATE, SYSTEM, HUMAN, STATE_SNAPSHOT_INTERVAL, LOGGING_ADDRESS
 import cbot.bot.log as cblog
+import cbot.bot.metrics as metrics
+from cbot.bot import wire
+from cbot.bot.transport import recv_waiting
+from cbot.bot.proc import rss_bytes
 import uuid
 
 import zmq.green as zmqg
 import zmq
-from zmq.devices import ProcessDevice
+import gevent
 from gevent import Greenlet
 
-from cbot.kb.kb_data import data
 from cbot.dm.state import SimpleTurnState, Utterance
 from cbot.dm.policy import RuleBasedPolicy
 import cbot.kb as kb
-from gevent.event import AsyncResult
+from gevent.event import AsyncResult, Event
+from gevent.lock import Semaphore
+from gevent.threadpool import ThreadPool
+import cbot.bot_exceptions as botex
 
 
 class ChatBot(object):
-    def __init__(self, name, send_reply):
+    def __init__(self, name, send_reply, knowledge_base=None, log_handler=None,
+                 state_snapshot_interval=STATE_SNAPSHOT_INTERVAL, log_address=LOGGING_ADDRESS):
+        """knowledge_base and log_handler may be shared by ChatBots living in one process,
+        without a log_handler the messages are published to the log sink at log_address.
+        The belief state is logged in full every state_snapshot_interval turns and as deltas in between,
+        see cbot.bot.log.BeliefStateWriter."""
         self.send_reply = send_reply
+        self.state_snapshot_interval = state_snapshot_interval
+        self.state_log = cblog.BeliefStateWriter(state_snapshot_interval)
         self.name = str(name)
 
-        logger_name, ctx = __name__ + '.' + self.__class__.__name__, zmqg.Context()
+        logger_name = __name__ + '.' + self.__class__.__name__
         self.logger = logging.getLogger(logger_name)
-        cblog.connect_logger(logger_name, self.name, ctx)
+        if log_handler is None:
+            log_handler = cblog.connect_logger(logger_name, self.name, zmqg.Context(), log_address)
+        self.log_handler = log_handler
 
-        self.kb = kb.KnowledgeBase()
-        self.kb.load_default_models()
-        self.kb.add_triplets(data)
+        if knowledge_base is None:
+            knowledge_base = kb.KnowledgeBase()
+            knowledge_base.load_default_models()
+        self.kb = knowledge_base
 
         dat_trans_prob = None  # TODO load transition probabilities, update them online for well accepted dialogues
         self.policy = RuleBasedPolicy(self.kb, SimpleTurnState(dat_trans_prob))
 
+    def reset(self, session):
+        """Forget the dialogue and continue as a fresh bot for a new session.
+        The knowledge base and the loaded models are kept."""
+        self.name = str(session)
+        self.log_handler.session = self.name
+        self.policy = RuleBasedPolicy(self.kb, SimpleTurnState(self.policy.state.dat_trans_prob))
+        self.state_log = cblog.BeliefStateWriter(self.state_snapshot_interval)
+
+    def checkpoint(self):
+        """Compact snapshot of the dialogue from which any bot can continue, see restore.
+        Return None if the state cannot be encoded."""
+        try:
+            return wire.encode({'session': self.name, 'state': self.policy.state.checkpoint()}, compress=True)
+        except ValueError as e:
+            self.logger.exception(e)
+            return None
+
+    def restore(self, checkpoint):
+        """Continue the dialogue of the checkpoint, the session name is taken from it."""
+        checkpoint = wire.decode(checkpoint)
+        self.name = str(checkpoint['session'])
+        self.log_handler.session = self.name
+        state = SimpleTurnState.from_checkpoint(checkpoint['state'], self.policy.state.dat_trans_prob)
+        self.policy = RuleBasedPolicy(self.kb, state)
+        self.state_log = cblog.BeliefStateWriter(self.state_snapshot_interval)  # starts with a snapshot
+
     def receive_msg(self, msg):
         # TODO use gevent.AsyncResult to make it asynchronous
         assert msg is not None and 'utterance' in msg and 'name' in msg, 'Broken msg: %s' % msg
-        self.logger.warning(json.dumps(msg))
+        self.log_handler.session = self.name  # the handler may be shared with other sessions
+        self.logger.warning(msg)  # serialized once by the log handler
 
         self.policy.update_state(Utterance(msg['utterance']))
         response = self.policy.act()
-        self.logger.info(str(self.policy.state))
+        self.logger.info(self.state_log.record(self.policy.state.log_record()))
 
         # TODO REMOVE DUPLICATE name and user
         m = {'utterance': response,
@@ -55,111 +100,316 @@ class ChatBot(object):
              'name': SYSTEM,
              'session': self.name, }
         self.send_reply(m)
-        self.logger.warning(json.dumps(m))
+        self.logger.warning(m)
+
 
+def drop_inherited_log_handlers():
+    """Remove the ChatBot log handlers a forked process inherited from its parent.
+    Their sockets belong to the context of the parent, the first log call of the child would hang."""
+    logging.getLogger(__name__ + '.' + ChatBot.__name__).handlers = []
 
-def forwarder_device_start(frontend_port, backend_port):
-    forwarder = ProcessDevice(zmq.FORWARDER, zmq.SUB, zmq.PUB)
-    forwarder.setsockopt_in(zmq.SUBSCRIBE, b'')
 
-    logger = logging.getLogger(__name__)
-    logger.debug('forwarder binding in to tcp://*:%d', frontend_port)
-    logger.debug('forwarder binding out to tcp://*:%d', backend_port)
-    forwarder.bind_in("tcp://*:%d" % frontend_port)
-    forwarder.bind_out("tcp://*:%d" % backend_port)
+class ConnectorHub(object):
+    """One transport shared by all ChatBotConnectors of the web process.
 
-    forwarder.start()
-    return forwarder
+    A single dispatcher greenlet receives the messages from all the ChatBots
+    and passes them to the connector of the dialogue found by its name,
+    so the web process has two (pubsub) or one (router) sockets in total
+    instead of a few sockets and a listening greenlet for every dialogue.
+    Stats replies are matched to the requests by their request ids.
+    """
+    def __init__(self, endpoints, ctx=None):
+        self.context = ctx if ctx is not None else zmqg.Context()
+        self.logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
+        self.transport = endpoints.connector(self.context)
+        self.transport.subscribe('', ['stat'])  # of all bots, answered or not by this hub
+        self.connectors = {}  # name -> ChatBotConnector
+        self.stat_requests = {}  # request id -> AsyncResult
+        self.counts = {'dispatched': 0, 'unroutable': 0, 'errors': 0}
+        self._dispatcher = gevent.spawn(self._dispatch)
+
+    def register(self, connector, signals=None):
+        self.connectors[connector.name] = connector
+        self.transport.subscribe(connector.name, signals)
+
+    def unregister(self, connector, signals=None):
+        if self.connectors.get(connector.name) is connector:
+            del self.connectors[connector.name]
+            self.transport.unsubscribe(connector.name, signals)
+
+    def send(self, signal, name, payload):
+        self.transport.send(signal, name, payload)
+
+    def request_stats(self, names, timeout=2.0):
+        """Ask the bots or hosted sessions for their stats at once.
+        Returns name -> stats dict for the bots which replied before timeout seconds."""
+        requests = {}  # name -> (request id, AsyncResult)
+        for name in names:
+            request_id = uuid.uuid4().hex
+            requests[name] = request_id, AsyncResult()
+            self.stat_requests[request_id] = requests[name][1]
+            self.transport.send('stat', name, request_id)
+        deadline = time.time() + timeout
+        stats = {}
+        for name, (_, result) in requests.iteritems():
+            try:
+                stats[name] = result.get(timeout=max(deadline - time.time(), 0))
+            except gevent.Timeout:
+                self.logger.debug('No stats from %s in %.1f s', name, timeout)
+        for request_id, _ in requests.itervalues():
+            self.stat_requests.pop(request_id, None)
+        return stats
+
+    def _dispatch(self):
+        while True:
+            try:  # a broken message must not stop the only dispatcher of all the dialogues
+                self._dispatch_one()
+            except Exception as e:
+                self.counts['errors'] += 1
+                self.logger.exception(e)
+
+    def _dispatch_one(self):
+        signal, name, payload = self.transport.recv()
+        if signal == 'stat':
+            result = self.stat_requests.pop(payload.get('request_id'), None)
+            if result is not None:
+                result.set(payload)
+            return
+        connector = self.connectors.get(name)
+        if connector is None:
+            self.counts['unroutable'] += 1
+            self.logger.debug('No connector for %s_%s', signal, name)
+            return
+        self.counts['dispatched'] += 1
+        connector.deliver(signal, payload)
+
+    def stats(self):
+        s = {'connectors': len(self.connectors)}
+        s.update(self.counts)
+        return s
+
+    def close(self):
+        self._dispatcher.kill()
+        self.transport.close()
 
 
 class ChatBotConnector(Greenlet):
-    def __init__(self, response_cb, bot_front_port, bot_back_port,
-                 user_front_port, user_back_port, ctx=None):
+    SIGNALS = [None, 'init_sync', 'ready', 'hibernate', 'restore']
+
+    def __init__(self, response_cb, endpoints, ctx=None, pool=None, ready_timeout=30.0, probe_interval=0.5,
+                 hub=None, idle_timeout=None):
+        """
+        endpoints: transport.PubSubEndpoints or transport.RouterEndpoints
+        ready_timeout: seconds to wait until the ChatBot announces it is ready
+        probe_interval: the longest interval between init_sync probes in case the announcement was lost,
+            the probes start after 10 ms and back off
+        hub: ConnectorHub shared by the connectors of the process, the connector uses its own if None
+        idle_timeout: seconds without messages after which the belief state is checkpointed
+            and the bot released, the next message restores the dialogue on any bot. None keeps the bot.
+        """
         super(ChatBotConnector, self).__init__()
         if ctx is not None:
             self.context = ctx
         else:
             self.context = zmqg.Context()
-        name = str(int(uuid.uuid4()))
-        self.pub2bot = self.context.socket(zmq.PUB)
-        self.pub2bot.sndhwm = 1100000  # set SNDHWM, so we don't drop messages for slow subscribers
-        self.sub2bot = self.context.socket(zmq.SUB)
-        self.sub2bot.setsockopt_string(zmq.SUBSCRIBE, '%s' % name)
-        self.init_sync_signal = self.context.socket(zmq.SUB)
-        self.init_sync_signal.setsockopt_string(zmq.SUBSCRIBE, 'init_sync_%s' % name)
-        self.poller = zmqg.Poller()
-        self.poller.register(self.sub2bot, zmq.POLLIN)
-        self.poller.register(self.init_sync_signal, zmq.POLLIN)
-        self.pub2bot.connect('tcp://127.0.0.1:%d' % bot_front_port)
-        self.sub2bot.connect('tcp://127.0.0.1:%d' % user_back_port)
-        self.init_sync_signal.connect('tcp://127.0.0.1:%d' % user_back_port)
-
         self.logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
-        self.bot = ChatBotProcess(name, bot_back_port, user_front_port)
-        self.bot.start()
-
         self.response = response_cb
-        self.should_run = lambda: True  # change is based on the messages
         self.initialized = AsyncResult()
-
-        if self._init_handshake():
-            self.logger.debug('Connector2bot synchronised with ChatBot.')
+        self.endpoints, self.pool, self._finalized = endpoints, pool, False
+        self.ready_timeout, self.probe_interval, self.idle_timeout = ready_timeout, probe_interval, idle_timeout
+        self._ready, self._done = Event(), Event()
+        self._control = AsyncResult()  # reply of the bot to hibernate or restore
+        self._lock = Semaphore()  # messages are not sent while the bot is being released or restored
+        self.checkpoint = None  # of the hibernated dialogue
+        self.last_active = time.time()
+        self.turns = 0  # messages sent to the current bot
+        # the replies go to the room of the dialogue, the names of the pooled bots are reused by other dialogues
+        self.room = 'dialogue%d' % uuid.uuid4()
+
+        self._own_hub = hub is None
+        self.hub = hub if hub is not None else ConnectorHub(endpoints, self.context)
+        self.bot = None
+        if self._acquire():
             self.initialized.set(True)
         else:
             self.initialized.set(False)
             self.finalize()
 
-    def _init_handshake(self, num_handshakes=10, interval=10):
-        waiting_time = 0
-        for _ in range(num_handshakes):
-            init_msg = 'init_sync_%s probing connection' % self.name
-            self.logger.debug('cbc sending msg: %s', init_msg)
-            self.pub2bot.send_string(init_msg)
-            socks = dict(self.poller.poll(timeout=interval))
-            if self.init_sync_signal in socks and socks[self.init_sync_signal] == zmq.POLLIN:
-                self.init_sync_signal.recv()
-                self.logger.debug('init handshake successful after %d ms', waiting_time)
+    def _acquire(self):
+        """Lease or start a bot and wait until it is ready. Return False if no bot is ready."""
+        if self.pool is not None:
+            # already running and initialized bot with fresh state, None once all are leased for ready_timeout
+            self.bot = self.pool.lease(self.ready_timeout)
+            if self.bot is None:
+                self.logger.warning('No ChatBot available in the pool.')
+                metrics.incr('pool_exhausted')
+                return False
+        else:
+            assert not self.endpoints.in_process, 'In process ChatBots are leased from ChatBotHostPool'
+            self.bot = ChatBotProcess(str(int(uuid.uuid4())), self.endpoints)
+        self._ready.clear()
+        # register before the bot starts so its ready announcement is not missed
+        self.hub.register(self, self.SIGNALS)
+        if self.pool is None:
+            self.bot.start()
+        if self._await_ready():
+            self.logger.debug('Connector2bot synchronised with ChatBot.')
+            self.turns = 0
+            return True
+        self._release()
+        return False
+
+    def _release(self, retire=False):
+        """Return the bot to the pool, if retire the pool terminates the bot instead of reusing it."""
+        self.hub.unregister(self, self.SIGNALS)
+        if self.pool is not None and retire:
+            self.pool.retire(self.bot)
+        elif self.pool is not None:
+            self.pool.release(self.bot)  # the bot is reset and reused
+        else:
+            self.hub.send('die', self.name, 'die')
+            self.bot.terminate()
+        self.bot = None
+
+    def _await_ready(self):
+        """Wait for the ready announcement of the bot or for a reply to init_sync probe.
+        The probes cover announcements lost before the sockets were connected."""
+        start = time.time()
+        deadline, interval = start + self.ready_timeout, 0.01
+        while time.time() < deadline:
+            self.logger.debug('cbc sending init_sync_%s', self.name)
+            self.hub.send('init_sync', self.name, 'probing connection')
+            if self._ready.wait(timeout=min(interval, deadline - time.time())):
+                latency = time.time() - start
+                metrics.observe('handshake_latency_s', latency)
+                self.logger.debug('ChatBot %s ready after %.3f s', self.name, latency)
                 return True
-            waiting_time += interval
-        self.logger.debug('init handshake unsuccessful after %d ms', waiting_time)
+            interval = min(2 * interval, self.probe_interval)
+        metrics.incr('handshake_failed')
+        self.logger.warning('ChatBot %s not ready in %.1f s', self.name, self.ready_timeout)
         return False
 
     @property
     def name(self):
         return self.bot.name
 
+    @property
+    def session(self):
+        return self.bot.session
+
+    @property
+    def hibernated(self):
+        return self.checkpoint is not None
+
+    def hibernate(self, retire=False):
+        """Checkpoint the belief state and release the bot. Return False if the bot has not replied.
+        The caller holds the lock."""
+        self._control = AsyncResult()
+        self.hub.send('hibernate', self.name, self.session)
+        try:
+            checkpoint = self._control.get(timeout=self.ready_timeout)
+        except gevent.Timeout:
+            checkpoint = None
+        if self._finalized:
+            return False
+        if checkpoint is None:
+            self.logger.warning('ChatBot %s has not checkpointed session %s', self.name, self.session)
+            return False
+        self.logger.debug('ChatBot %s hibernated, checkpoint of %d bytes', self.name, len(checkpoint))
+        self.checkpoint = checkpoint
+        self._release(retire)
+        metrics.incr('hibernated')
+        metrics.incr('sessions_hibernated')
+        metrics.observe('checkpoint_bytes', len(checkpoint))
+        return True
+
+    def rehydrate(self):
+        """Continue the hibernated dialogue on a ready bot. Return False if no bot restored it.
+        The caller holds the lock."""
+        start = time.time()
+        if not self._acquire():
+            return False
+        self._control = AsyncResult()
+        self.hub.send('restore', self.name, self.checkpoint)
+        try:
+            self.bot.session = self._control.get(timeout=self.ready_timeout)
+        except gevent.Timeout:
+            self.logger.warning('ChatBot %s has not restored the checkpoint', self.name)
+            self._release()
+            return False
+        self.checkpoint = None
+        metrics.incr('rehydrated')
+        metrics.incr('sessions_hibernated', -1)
+        metrics.observe('rehydrate_latency_s', time.time() - start)
+        self.logger.debug('Session %s restored by ChatBot %s', self.session, self.name)
+        return True
+
+    def reassign(self):
+        """Continue the dialogue of a dead bot, e.g. on a failed node, with another bot.
+        The belief state is lost unless hibernated. Return False if no bot is ready. The caller holds the lock."""
+        self.logger.warning('ChatBot %s is dead, reassigning session %s', self.name, self.session)
+        metrics.incr('reassigned')
+        self._release()
+        return self._acquire()
+
+    def recycle(self):
+        """Move the dialogue to a fresh bot through a checkpoint and terminate the old bot,
+        e.g. if the bot process grew too large. Return False if the dialogue has not moved."""
+        with self._lock:
+            if self._finalized or self.hibernated or not self.hibernate(retire=True):
+                return False
+            return self.rehydrate()  # or on the next message
+
     def send(self, msg):
         assert self.initialized.get()  # May block if not initialized
         assert 'utterance' in msg
-        msg['user'] = 'human'
-        msg['time'] = time.time()
-        msg['session'] = self.name
-        self.logger.debug('send(): %s', msg)
-        self.pub2bot.send_string('%s %s' % (self.name, json.dumps(msg)))
+        with self._lock:
+            if (self.hibernated and not self.rehydrate()) or (not self.bot.is_alive() and not self.reassign()):
+                self.finalize()
+                raise botex.BotSendException()
+            self.last_active = time.time()
+            self.turns += 1
+            msg['user'] = 'human'
+            msg['time'] = time.time()
+            msg['session'] = self.session
+            self.logger.debug('send(): %s', msg)
+            self.hub.send(None, self.name, msg)
+
+    def deliver(self, signal, payload):
+        """Called by the hub dispatcher for messages about this dialogue."""
+        if signal is None:
+            self.logger.debug('deliver(): %s', payload)
+            self.last_active = time.time()
+            self.response(payload, self.room)
+        elif signal in ('ready', 'init_sync'):
+            self._ready.set()
+        elif signal in ('hibernate', 'restore'):
+            self._control.set(payload)
 
     def _run(self):
-        self.logger.debug('%s started listening for ChatBot msgs ' % str(self.__class__.__name__) + self.name)
-        try:
-            while self.should_run():
-                assert self.initialized.get()
-                self.logger.debug('before poll')
-                socks = dict(self.poller.poll())
-                self.logger.debug('after poll')
-                if self.sub2bot in socks and socks[self.sub2bot] == zmq.POLLIN:
-                    _, msg = cblog.topic_msg_to_json(self.sub2bot.recv())
-                    self.logger.debug('_run(): %s', msg)
-                    self.response(msg, self.name)
-        except Exception as e:
-            self.logger.exception(e)
-        finally:
-            self.finalize()
+        # The replies are delivered by the hub dispatcher, the greenlet only lives as long as the dialogue
+        # and wakes up to release the bot of an idle dialogue.
+        timeout = self.idle_timeout
+        while not self._done.wait(timeout=timeout):
+            with self._lock:
+                idle = time.time() - self.last_active
+                if not self.hibernated and idle >= self.idle_timeout:
+                    self.hibernate()
+            timeout = self.idle_timeout - idle if idle < self.idle_timeout else self.idle_timeout
 
     def finalize(self):
         self.logger.debug("Finishing ChatBotConnector")
         self.initialized.set(False)
-        self.should_run = lambda: False
-        self.pub2bot.send_string('die_%s die' % self.name)
-        self.bot.terminate()
+        if self._finalized:
+            return
+        self._finalized = True
+        if self.bot is not None:
+            self._release()
+        if self.hibernated:
+            metrics.incr('sessions_hibernated', -1)
+        if self._own_hub:
+            self.hub.close()
+        self._done.set()
 
     def kill(self, exception=GreenletExit, block=True, timeout=None):
         self.finalize()
@@ -167,84 +417,298 @@ class ChatBotConnector(Greenlet):
 
 
 class ChatBotProcess(multiprocessing.Process):
-    def __init__(self, name, input_port, output_port):
+    def __init__(self, name, endpoints, knowledge_base=None):
         super(self.__class__, self).__init__()
         self.name = str(int(name))
-        assert isinstance(input_port, int) and isinstance(output_port, int)
-        self.input_port, self.output_port = input_port, output_port
+        self.knowledge_base = knowledge_base  # preloaded e.g. by zygote
+        self.session = self.name  # changes if the bot is reset and reused for another dialogue
+        self.endpoints = endpoints
         self.logger = logging.getLogger(str(name))
         self.should_run = lambda: True
 
     def __repr__(self):
         super_info = super(self.__class__).__str__()
         str_repr = '%s: %s' % (str(self.__class__), self.name)
-        str_repr += '\n input - output ports: %d - %d\n' % (self.input_port, self.output_port)
+        str_repr += '\n endpoints: %s\n' % self.endpoints
         str_repr += super_info
         return str_repr
 
+    def next_msg(self):
+        """The messages waiting in the socket are moved to the inbox, so its length is the queue depth."""
+        self.inbox.extend(recv_waiting(self.transport, block=len(self.inbox) == 0))
+        return self.inbox.popleft()
+
+    def stats(self, chatbot):
+        return {'time': time.time(),
+                'session': self.session,
+                'sessions': 1,
+                'history_len': len(chatbot.policy.state.history),
+                'turns': self.turns.count,
+                'turns_per_s': self.turns.rate(),
+                'queue_depth': len(self.inbox),
+                'rss_bytes': rss_bytes(), }
+
     def receive_msg(self, chatbot):
         # TODO use json validation
-        socks = dict(self.poller.poll())
+        signal, _, payload = self.next_msg()
         # Normal conversation
-        if self.isocket in socks and socks[self.isocket] == zmq.POLLIN:
-            _, msg = cblog.topic_msg_to_json(self.isocket.recv())
+        if signal is None:
+            self.turns.mark()
+            msg = payload
             # hack - control signal from user
             if msg['utterance'].lower() == 'your id' or msg['utterance'].lower() == 'your id, please!':
-                self.osocket.send_string('%s %s' % (self.name, json.dumps(cblog.wrap_msg(self.name))))
+                self.send_msg(cblog.wrap_msg(self.name))
             else:
                 if 'name' not in msg and 'user' in msg:
                     msg['name'] = msg['user']  # TODO HACK for backward compatibility
                 chatbot.receive_msg(msg)  # Normal conversation
         # Control signals
-        if self.die_signal in socks and socks[self.die_signal] == zmq.POLLIN:
+        elif signal == 'die':
             self.should_run = lambda: False
-            self.die_signal.recv()
-        if self.init_sync_signal in socks and socks[self.init_sync_signal] == zmq.POLLIN:
-            self.init_sync_signal.recv()
+        elif signal == 'init_sync':
             self.logger.debug('Sync_init msg received. Sending confirmation.')
-            self.osocket.send_string('init_sync_%s sync_confirmation' % self.name)
-        if self.req_stat in socks and socks[self.req_stat] == zmq.POLLIN:
-            _, stat_req = self.req_stat.recv().split()
-            assert stat_req == 'request', 'stat_req %s' % stat_req
-            self.logger.debug('ChatBot %s received stats request', self.name)
-            stats = {'time': time.time(), 'history_len': len(self.policy.state.history)}
-            self.osocket.send_string('stat_%s %s' % (self.name, json.dumps(stats)))
+            self.transport.send('init_sync', self.name, 'sync_confirmation')
+        elif signal == 'reset':
+            self.logger.debug('ChatBot %s reset for session %s', self.name, payload)
+            chatbot.reset(payload)
+            self.session = chatbot.name
+            self.transport.send('reset', self.name, self.session)
+        elif signal == 'stat':
+            self.logger.debug('ChatBot %s received stats request %s', self.name, payload)
+            stats = self.stats(chatbot)
+            stats['request_id'] = payload
+            self.transport.send('stat', self.name, stats)
+        elif signal == 'hibernate':
+            self.logger.debug('ChatBot %s checkpointing session %s', self.name, self.session)
+            self.transport.send('hibernate', self.name, chatbot.checkpoint())
+        elif signal == 'restore':
+            chatbot.restore(payload)
+            self.session = chatbot.name
+            self.logger.debug('ChatBot %s restored session %s', self.name, self.session)
+            self.transport.send('restore', self.name, self.session)
 
     def send_msg(self, msg):
-        self.osocket.send_string('%s %s' % (self.name, json.dumps(msg)))
+        self.transport.send(None, self.name, msg)
 
     def zmq_init(self):
         self.context = zmq.Context()
-        self.isocket = self.context.socket(zmq.SUB)
-        self.isocket.setsockopt_string(zmq.SUBSCRIBE, '%s' % self.name)
-        self.osocket = self.context.socket(zmq.PUB)
-        self.req_stat = self.context.socket(zmq.SUB)
-        self.req_stat.setsockopt_string(zmq.SUBSCRIBE, 'stat_%s' % self.name)
-        self.die_signal = self.context.socket(zmq.SUB)
-        self.die_signal.setsockopt_string(zmq.SUBSCRIBE, 'die_%s' % self.name)
-        self.init_sync_signal = self.context.socket(zmq.SUB)
-        self.init_sync_signal.setsockopt_string(zmq.SUBSCRIBE, 'init_sync_%s' % self.name)
-        self.isocket.connect('tcp://127.0.0.1:%d' % self.input_port)
-        self.req_stat.connect('tcp://127.0.0.1:%d' % self.input_port)
-        self.init_sync_signal.connect('tcp://127.0.0.1:%d' % self.input_port)
-        self.die_signal.connect('tcp://127.0.0.1:%d' % self.input_port)
-        self.osocket.connect('tcp://127.0.0.1:%d' % self.output_port)
-        self.poller = zmq.Poller()
-        self.poller.register(self.isocket, zmq.POLLIN)
-        self.poller.register(self.req_stat, zmq.POLLIN)
-        self.poller.register(self.init_sync_signal, zmq.POLLIN)
-        self.poller.register(self.die_signal, zmq.POLLIN)
+        self.transport = self.endpoints.bot(self.context, self.name)
+        self.transport.subscribe(self.name)
 
     def run(self):
         self.logger = logging.getLogger(str(self.name))  # reinitializing after fork
-        chatbot = ChatBot(self.name, self.send_msg)
+        drop_inherited_log_handlers()
         self.logger.debug('Starting zmq_init synchronisation.')
-        self.zmq_init()
+        self.zmq_init()  # sockets connect while the models load, so the ready announcement is not lost
+        self.inbox, self.turns = deque(), metrics.RateMeter()
+        chatbot = ChatBot(self.name, self.send_msg, self.knowledge_base, log_address=self.endpoints.log_address)
+        self.transport.send('ready', self.name, self.session)
         self.logger.debug(str(self))
         while self.should_run():
             self.receive_msg(chatbot)
 
 
+class ChatBotHost(object):
+    """Hosts many ChatBots, one for each session.
+
+    Sessions are named '<host name>.<session id>' so all of them are received
+    by one subscribing socket and routed by the topic inside the host.
+    The KnowledgeBase and the POS tagger are loaded once and shared,
+    so a new session costs only its belief state.
+
+    If register_interval is set, the host announces itself with its capacity (maximum sessions)
+    every register_interval seconds, so ChatBotFleet can place sessions on it, see cbot.bot.fleet.
+    """
+    def __init__(self, name, endpoints, capacity=1000, register_interval=None):
+        self.name = str(int(name))
+        self.endpoints = endpoints
+        self.capacity, self.register_interval = capacity, register_interval
+        self.logger = logging.getLogger(str(name))
+        self.should_run = lambda: True
+        self.chatbots = {}  # session -> ChatBot
+        self._next_register = 0.0
+
+    def __repr__(self):
+        str_repr = '%s: %s' % (str(self.__class__), self.name)
+        str_repr += '\n endpoints: %s\n' % self.endpoints
+        str_repr += ' sessions: %d\n' % len(self.chatbots)
+        return str_repr
+
+    def session_name(self, session_id=None):
+        if session_id is None:
+            session_id = int(uuid.uuid4())
+        return '%s.%s' % (self.name, session_id)
+
+    def route(self, name):
+        """Return the session, None for the host itself. Raise KeyError for foreign names."""
+        if name == self.name:
+            return None
+        if not name.startswith(self.name + '.'):
+            raise KeyError('%s is not hosted by %s' % (name, self.name))
+        return name
+
+    def get_chatbot(self, session):
+        if session not in self.chatbots:
+            self.logger.debug('Starting session %s', session)
+            send_reply = lambda m, s=session: self.send_msg(s, m)
+            self.chatbots[session] = ChatBot(session, send_reply, self.kb, self.log_handler)
+        return self.chatbots[session]
+
+    def send_msg(self, session, msg):
+        self.transport.send(None, session, msg)
+
+    def next_msg(self):
+        while len(self.inbox) == 0:
+            self.register()
+            timeout = None if self.register_interval is None else 1000 * self.register_interval
+            msg = self.transport.recv(timeout=timeout)
+            if msg is not None:
+                self.inbox.append(msg)
+        self.register()
+        self.inbox.extend(recv_waiting(self.transport, block=False))
+        return self.inbox.popleft()
+
+    def register(self):
+        """Heartbeat with the capacity and load if register_interval elapsed."""
+        now = time.time()
+        if self.register_interval is None or now < self._next_register:
+            return
+        self._next_register = now + self.register_interval
+        self.transport.send('register', self.name, {'capacity': self.capacity,
+                                                    'sessions': len(self.chatbots),
+                                                    'node': socket.gethostname(),
+                                                    'pid': os.getpid(), })
+
+    def stats(self, session=None):
+        """Stats of the session or of the whole host if session is None."""
+        stats = {'time': time.time(),
+                 'sessions': len(self.chatbots),
+                 'turns': self.turns.count,
+                 'turns_per_s': self.turns.rate(),
+                 'queue_depth': len(self.inbox),
+                 'rss_bytes': rss_bytes(), }
+        if session is not None:
+            stats['session'] = session
+            stats['history_len'] = len(self.chatbots[session].policy.state.history) if session in self.chatbots else 0
+        else:
+            stats['history_len'] = sum(len(c.policy.state.history) for c in self.chatbots.itervalues())
+        return stats
+
+    def receive_msg(self):
+        signal, name, payload = self.next_msg()
+        try:
+            session = self.route(name)
+        except KeyError as e:
+            self.logger.debug(e)
+            return
+        if signal is None:
+            self.turns.mark()
+            msg = payload
+            if 'name' not in msg and 'user' in msg:
+                msg['name'] = msg['user']  # TODO HACK for backward compatibility
+            self.converse(self.get_chatbot(session), msg)
+        elif signal == 'init_sync':
+            if session is not None:
+                self.get_chatbot(session)
+            self.transport.send('init_sync', name, 'sync_confirmation')
+        elif signal == 'die':
+            if session is None:
+                self.should_run = lambda: False
+            else:
+                self.logger.debug('Finishing session %s', session)
+                self.chatbots.pop(session, None)
+                self.transport.unsubscribe(session)
+        elif signal == 'stat':
+            stats = self.stats(session)
+            stats['request_id'] = payload
+            self.transport.send('stat', name, stats)
+        elif signal == 'reset':
+            if session is not None and session in self.chatbots:
+                self.chatbots[session].reset(session)
+            self.transport.send('reset', name, name)
+        elif signal == 'hibernate':
+            checkpoint = self.chatbots[session].checkpoint() if session in self.chatbots else None
+            if checkpoint is not None:
+                self.logger.debug('Session %s hibernated', session)
+                del self.chatbots[session]  # only the connector keeps the dialogue
+            self.transport.send('hibernate', name, checkpoint)
+        elif signal == 'restore':
+            chatbot = self.get_chatbot(session)
+            chatbot.restore(payload)
+            self.transport.send('restore', name, chatbot.name)
+
+    def zmq_init(self):
+        self.context = zmq.Context()
+        self.transport = self.endpoints.bot(self.context, self.name)
+        self.transport.subscribe(self.name)  # prefix of all hosted sessions
+
+    def converse(self, chatbot, msg):
+        chatbot.receive_msg(msg)
+
+    def load_models(self):
+        self.kb = kb.KnowledgeBase()
+        self.kb.load_default_models()
+
+    def serve(self):
+        self.zmq_init()
+        self.inbox, self.turns = deque(), metrics.RateMeter()
+        self.load_models()
+        self.log_handler = cblog.connect_logger(__name__ + '.' + ChatBot.__name__, self.name, self.context,
+                                                self.endpoints.log_address)
+        self.transport.send('ready', self.name, self.name)
+        self.logger.debug(str(self))
+        while self.should_run():
+            self.receive_msg()
+
+
+class ChatBotHostProcess(ChatBotHost, multiprocessing.Process):
+    """Single process hosting many ChatBots."""
+    def __init__(self, name, endpoints, capacity=1000, register_interval=None):
+        multiprocessing.Process.__init__(self)
+        ChatBotHost.__init__(self, name, endpoints, capacity, register_interval)
+
+    def run(self):
+        self.logger = logging.getLogger(str(self.name))  # reinitializing after fork
+        drop_inherited_log_handlers()
+        self.serve()
+
+
+class ChatBotHostGreenlet(ChatBotHost, Greenlet):
+    """Hosts the ChatBots inside of the web process, e.g. with transport.InProcEndpoints for single node deployments.
+
+    The models are loaded and the ChatBots answer in a worker thread, so the greenlets of the web app
+    are not blocked meanwhile. One thread keeps the ChatBots and their shared log handler single threaded,
+    and one host per process keeps the ChatBot logger with a single handler.
+    The replies are sent by the host greenlet because the gevent queues of the transport are not thread safe.
+    """
+    def __init__(self, name, endpoints, capacity=1000, register_interval=None):
+        Greenlet.__init__(self)
+        ChatBotHost.__init__(self, name, endpoints, capacity, register_interval)
+        self.threadpool = ThreadPool(1)
+        self.outbox = deque()  # (session, reply) of the last turn
+
+    def send_msg(self, session, msg):
+        self.outbox.append((session, msg))
+
+    def converse(self, chatbot, msg):
+        self.threadpool.apply(chatbot.receive_msg, (msg,))
+        while len(self.outbox) > 0:
+            self.transport.send(None, *self.outbox.popleft())
+
+    def load_models(self):
+        self.threadpool.apply(ChatBotHost.load_models, (self,))
+
+    def _run(self):
+        self.serve()
+
+    def is_alive(self):
+        return not self.dead
+
+    def terminate(self):
+        self.kill(block=False)
+        self.threadpool.kill()
+
+
 if __name__ == '__main__':
     print("""ChatBot demo without zmq and multiprocessing.""")
 
@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Fixtures shared by the tests of the ChatBots and their transports.
+
+Every test case gets the ports of its devices and of its log sink from the OS,
+so the test suites of cbot and app may run at once, and stops all the processes it started.
+"""
+from __future__ import unicode_literals
+from multiprocessing import Process, active_children
+import socket
+import time
+import unittest
+from cbot.bot.log import chatbot2file_log_loop
+from cbot.bot.transport import PubSubEndpoints, RouterEndpoints, InProcEndpoints, stop_devices
+
+
+def free_ports(n):
+    """n distinct ports which were free on the loopback a moment ago."""
+    sockets = []
+    try:
+        for _ in range(n):
+            s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            s.bind(('127.0.0.1', 0))
+            sockets.append(s)
+        return [sock.getsockname()[1] for sock in sockets]
+    finally:
+        for s in sockets:
+            s.close()
+
+
+def make_endpoints(transport):
+    """Endpoints of the transport 'pubsub', 'router' or 'inproc' and of a log sink on free ports."""
+    ports = free_ports(5)
+    log_address = 'tcp://127.0.0.1:%d' % ports[0]
+    if transport == 'pubsub':
+        return PubSubEndpoints(*ports[1:], log_address=log_address)
+    elif transport == 'router':
+        return RouterEndpoints(ports[1], log_address=log_address)
+    elif transport == 'inproc':
+        return InProcEndpoints(log_address=log_address)
+    raise ValueError('Unknown transport %s' % transport)
+
+
+class EndpointsTestCase(unittest.TestCase):
+    """Starts the log sink and the devices of the transport before each test and stops them after it.
+    Subclasses call setUp and tearDown of this class first and last respectively."""
+    transport = 'pubsub'
+    settle = 2.0  # seconds for the devices to bind
+
+    def setUp(self):
+        self.endpoints = make_endpoints(self.transport)
+        self.logger_process = Process(target=chatbot2file_log_loop, args=(self.endpoints.log_address,))
+        self.logger_process.start()
+        self.devices = self.endpoints.start_devices()
+        time.sleep(self.settle)
+
+    def tearDown(self):
+        stop_devices(self.devices)
+        self.logger_process.terminate()
+        self.logger_process.join(10.0)
+        for p in active_children():  # the bots and hosts the test left behind
+            p.terminate()
+            p.join(1.0)
@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Fleet of ChatBotHostProcess hosts spread over several machines.
+
+The hosts connect to the devices of the web node (PubSubEndpoints or RouterEndpoints with its host)
+and announce themselves every register_interval seconds with their capacity and load.
+With RouterEndpoints the broker keeps the registry and the fleet asks it for the registered hosts,
+with PubSubEndpoints the fleet receives the announcements directly.
+
+A new session id is placed on the first host with free capacity in the order of a consistent hash ring,
+so the sessions spread evenly and adding or removing a host moves only the sessions placed on it.
+A host which has not announced itself for host_timeout seconds is dead,
+ChatBotConnector then reassigns its dialogues to other hosts (see ChatBotConnector.reassign).
+
+Start the hosts of one machine, e.g. for the web node 10.0.0.1 (app/cleverobot/run.py --fleet):
+    python -m cbot.bot.fleet --host 10.0.0.1 --transport router --hosts 4
+The dialogues of the machine are logged by its own log collector into all_messages_cbot_msg.log.
+"""
+from __future__ import unicode_literals, division
+import argparse
+import bisect
+import hashlib
+import logging
+import time
+import uuid
+from multiprocessing import Process
+import gevent
+from gevent.event import Event
+import zmq.green as zmqg
+from cbot.bot.connectors import ChatBotHostProcess
+from cbot.bot.log import chatbot2file_log_loop
+from cbot.bot.pool import HostedSession
+from cbot.bot.transport import PubSubEndpoints, RouterEndpoints, BROKER
+import cbot.bot.metrics as metrics
+
+
+class HashRing(object):
+    """Consistent hash ring, every node has replicas points on the ring."""
+    def __init__(self, replicas=100):
+        self.replicas = replicas
+        self.points, self.owners = [], []  # sorted hashes and their nodes
+
+    @staticmethod
+    def hash(key):
+        return int(hashlib.md5(key.encode('utf-8')).hexdigest()[:16], 16)
+
+    def __contains__(self, node):
+        return node in self.owners
+
+    def __len__(self):
+        return len(set(self.owners))
+
+    def add(self, node):
+        for replica in range(self.replicas):
+            point = self.hash('%s#%d' % (node, replica))
+            i = bisect.bisect(self.points, point)
+            self.points.insert(i, point)
+            self.owners.insert(i, node)
+
+    def remove(self, node):
+        kept = [(p, o) for p, o in zip(self.points, self.owners) if o != node]
+        self.points, self.owners = [p for p, _ in kept], [o for _, o in kept]
+
+    def nodes(self, key):
+        """Distinct nodes in the ring order starting at the key, the first one owns the key."""
+        seen, start = set(), bisect.bisect(self.points, self.hash(key))
+        for i in range(len(self.points)):
+            node = self.owners[(start + i) % len(self.points)]
+            if node not in seen:
+                seen.add(node)
+                yield node
+
+    def node(self, key):
+        """Node owning the key, None for an empty ring."""
+        return next(self.nodes(key), None)
+
+
+class RemoteHost(object):
+    """Handle for a registered ChatBotHostProcess of the fleet, possibly on another machine."""
+    def __init__(self, fleet, name):
+        self.fleet, self.name = fleet, name
+
+    def is_alive(self):
+        return self.name in self.fleet.hosts
+
+    def session_name(self, session_id=None):
+        if session_id is None:
+            session_id = int(uuid.uuid4())
+        return '%s.%s' % (self.name, session_id)
+
+
+class ChatBotFleet(object):
+    def __init__(self, endpoints, host_timeout=3.0, poll_interval=1.0, ready_timeout=30.0, replicas=100, ctx=None):
+        """
+        Leases dialogues hosted by the registered ChatBotHostProcesses, see the module docstring.
+        host_timeout: seconds without an announcement after which the host is dead,
+            with RouterEndpoints it should match the expiry of the broker
+        poll_interval: seconds between the requests for the registered hosts (RouterEndpoints)
+        ready_timeout: the longest wait of lease for the first host
+        """
+        assert not endpoints.in_process, 'The fleet hosts are separate processes'
+        self.host_timeout, self.poll_interval, self.ready_timeout = host_timeout, poll_interval, ready_timeout
+        self.logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
+
+        self.context = ctx if ctx is not None else zmqg.Context()
+        self.transport = endpoints.connector(self.context)
+        self.transport.subscribe('', ['register', 'hosts'])
+
+        self.ring = HashRing(replicas)
+        self.hosts = {}  # name -> (last announcement time, advertised info)
+        self.sessions = {}  # host name -> set of leased session names
+        self._host_ready = Event()
+        self.counts = {'leases': 0, 'timeouts': 0, 'full': 0, 'hosts_registered': 0, 'hosts_failed': 0}
+        self._greenlets = [gevent.spawn(self._listen), gevent.spawn(self._maintain)]
+
+    def _announced(self, name, info, now):
+        if name not in self.hosts:
+            self.logger.info('Host %s registered from %s with capacity %d', name, info['node'], info['capacity'])
+            self.ring.add(name)
+            self.sessions.setdefault(name, set())
+            self.counts['hosts_registered'] += 1
+            self._host_ready.set()
+        self.hosts[name] = (now, info)
+
+    def _listen(self):
+        while True:
+            signal, name, payload = self.transport.recv()
+            now = time.time()
+            if signal == 'register':
+                self._announced(name, payload, now)
+            elif signal == 'hosts':
+                for host, info in payload.iteritems():
+                    self._announced(host, info, now)
+
+    def _maintain(self):
+        while True:
+            self.transport.send('hosts', BROKER, None)  # answered by the broker of RouterEndpoints only
+            gevent.sleep(self.poll_interval)
+            now = time.time()
+            for name, (seen, _) in self.hosts.items():
+                if now - seen > self.host_timeout:
+                    self.logger.warning('Host %s has not announced itself for %.1f s', name, now - seen)
+                    del self.hosts[name]
+                    self.ring.remove(name)
+                    self.sessions.pop(name, None)
+                    self.counts['hosts_failed'] += 1
+                    metrics.incr('hosts_failed')
+            if len(self.hosts) == 0:
+                self._host_ready.clear()
+
+    def load(self, name):
+        """Sessions of the host, the own leases count before the host reports them."""
+        return max(len(self.sessions[name]), self.hosts[name][1]['sessions'])
+
+    def lease(self, timeout=None):
+        if not self._host_ready.wait(timeout=timeout if timeout is not None else self.ready_timeout):
+            self.counts['timeouts'] += 1
+            return None
+        session_id = str(int(uuid.uuid4()))
+        for name in self.ring.nodes(session_id):
+            if self.load(name) < self.hosts[name][1]['capacity']:
+                host = RemoteHost(self, name)
+                bot = HostedSession(host, host.session_name(session_id))
+                self.sessions[name].add(bot.name)
+                self.counts['leases'] += 1
+                return bot
+        self.logger.warning('All ChatBot hosts of the fleet are full')
+        self.counts['full'] += 1
+        return None
+
+    def release(self, bot):
+        self.sessions.get(bot.host.name, set()).discard(bot.name)
+        self.transport.send('die', bot.name, 'die')
+
+    def bot_names(self):
+        return self.hosts.keys()
+
+    def stats(self):
+        s = {'hosts': len(self.hosts),
+             'leased': sum(len(v) for v in self.sessions.values()),
+             'max_sessions': sum(info['capacity'] for _, info in self.hosts.values()),
+             'sessions': dict((n, self.load(n)) for n in self.hosts),
+             'nodes': sorted(set(info['node'] for _, info in self.hosts.values())), }
+        s['occupancy'] = s['leased'] / s['max_sessions'] if s['max_sessions'] > 0 else 0.0
+        s.update(self.counts)
+        return s
+
+    def shutdown(self):
+        """Stops leasing, the hosts keep running for other web nodes."""
+        gevent.killall(self._greenlets)
+        self.transport.close()
+
+
+def start_hosts(endpoints, hosts, capacity, register_interval):
+    processes = [ChatBotHostProcess(str(int(uuid.uuid4())), endpoints, capacity, register_interval)
+                 for _ in range(hosts)]
+    for p in processes:
+        p.start()
+    return processes
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1', help='Address of the web node running the devices')
+    parser.add_argument('--transport', choices=['pubsub', 'router'], default='router')
+    parser.add_argument('--ports', type=int, nargs='+', default=[6666, 7777, 8888, 9999],
+                        help='bot_front bot_back user_front user_back for pubsub, the broker port for router')
+    parser.add_argument('-n', '--hosts', type=int, default=1, help='Host processes on this machine')
+    parser.add_argument('-c', '--capacity', type=int, default=1000, help='Maximum sessions of each host')
+    parser.add_argument('--register-interval', type=float, default=1.0)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    if args.transport == 'router':
+        endpoints = RouterEndpoints(args.ports[0], host=args.host)
+    else:
+        endpoints = PubSubEndpoints(*args.ports[:4], host=args.host)
+    log_process = Process(target=chatbot2file_log_loop)
+    log_process.start()
+    for p in start_hosts(endpoints, args.hosts, args.capacity, args.register_interval):
+        p.join()
+    log_process.terminate()
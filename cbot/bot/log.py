@@ -1,46 +1,165 @@
 from __future__ import unicode_literals, division
+from collections import OrderedDict
 import json
 from logging.handlers import TimedRotatingFileHandler
 import time
 import os
 import errno
+import random
+import re
+import multiprocessing
+import signal
+import sys
+import uuid
+import zlib
 from zmq.log.handlers import PUBHandler
 from zmq.utils import jsonapi
 import logging
 from logging.config import dictConfig
 import zmq
-from cbot.bot.alias import LOGGING_ADDRESS, HUMAN, BASIC_JSON_MSG_SCHEMA, CHATBOT_MSG_LOGGER
+from cbot.bot.alias import LOGGING_ADDRESS, HUMAN, BELIEF_STATE, BASIC_JSON_MSG_SCHEMA, CHATBOT_MSG_LOGGER
+import cbot.bot.metrics as metrics
+from cbot.bot.store import SegmentStore, SegmentStoreHandler
 from cbot.dm.actions import BaseAction
 import jsonschema
 from jsonschema.exceptions import ValidationError
 
+SESSION_LOG_SUFFIXES = ['input_output.log', 'dm_logic.log']  # see SessionHandler
+OBJECT_ADDRESS_RE = re.compile(r' object at 0x[0-9a-fA-F]+')
+
+
+def flatten(d):
+    # flat dictionaries
+    if isinstance(d, dict):
+        if len(d) == 0:
+            return "EmptyDict"
+        d = dict(d)  # copy
+        non_str_keys = [k for k in d if not (isinstance(k, str) or isinstance(k, unicode))]
+        for k in non_str_keys:
+            v = d[k]
+            del d[k]
+            d[str(k)] = v
+        for k, v in d.iteritems():
+            d[k] = flatten(v)
+        return d
+    elif isinstance(d, BaseAction):
+        return repr(d)
+    else:
+        return d
 
-class ChatBotJsonEncoder(json.JSONEncoder):
-    def encode(self, obj):
 
-        def flatten(d):
-            # flat dictionaries
-            if isinstance(d, dict):
-                if len(d) == 0:
-                    return "EmptyDict"
-                d = dict(d)  # copy
-                non_str_keys = [k for k in d if not (isinstance(k, str) or isinstance(k, unicode))]
-                for k in non_str_keys:
-                    v = d[k]
-                    del d[k]
-                    d[str(k)] = v
-                for k, v in d.iteritems():
-                    d[k] = flatten(v)
-                return d
-            elif isinstance(d, BaseAction):
-                return repr(d)
-            else:
-                return d
+def strip_addresses(d):
+    """The flattened value with the object addresses removed from the reprs, they differ every turn."""
+    if isinstance(d, dict):
+        return dict((strip_addresses(k), strip_addresses(v)) for k, v in d.iteritems())
+    elif isinstance(d, (list, tuple)):
+        return [strip_addresses(v) for v in d]
+    elif isinstance(d, basestring):
+        return OBJECT_ADDRESS_RE.sub(' object', d)
+    else:
+        return d
+
 
+class ChatBotJsonEncoder(json.JSONEncoder):
+    def encode(self, obj):
         flat_obj = flatten(obj)
         return super(self.__class__, self).encode(flat_obj)
 
 
+REMOVED, PATCH = '__removed__', '__patch__'
+
+
+def state_delta(old, new):
+    """Patch from the old to the new flattened dict: the changed keys with their new values,
+    the changed dicts as {PATCH: patch} and the removed keys listed under REMOVED. See apply_delta."""
+    patch = {}
+    for k, v in new.iteritems():
+        if k not in old:
+            patch[k] = v
+        elif old[k] != v:
+            patch[k] = {PATCH: state_delta(old[k], v)} if isinstance(v, dict) and isinstance(old[k], dict) else v
+    removed = [k for k in old if k not in new]
+    if len(removed) > 0:
+        patch[REMOVED] = removed
+    return patch
+
+
+def apply_delta(old, patch):
+    new = dict(old)
+    for k in patch.get(REMOVED, []):
+        del new[k]
+    for k, v in patch.iteritems():
+        if k != REMOVED:
+            new[k] = apply_delta(old[k], v[PATCH]) if isinstance(v, dict) and PATCH in v else v
+    return new
+
+
+class BeliefStateWriter(object):
+    """Turns the belief state log records of one dialogue into deltas of their attributes
+    with a full snapshot every snapshot_interval turns. If snapshot_interval is None every record is a snapshot.
+    The records are numbered by turn and marked 'snapshot' True or False. The object addresses are removed
+    from the attributes, so the actions created again every turn change the delta only if their content does.
+    Attributes which are not a dict before or after the turn, e.g. the flattened 'EmptyDict', are logged in full."""
+    def __init__(self, snapshot_interval=None):
+        self.snapshot_interval = snapshot_interval
+        self.turn, self.attributes = 0, None
+
+    def record(self, log_record):
+        attributes = strip_addresses(flatten(log_record['attributes']))
+        record = dict(log_record, turn=self.turn, snapshot=True, attributes=attributes)
+        diffable = isinstance(self.attributes, dict) and isinstance(attributes, dict)
+        if self.snapshot_interval is not None and self.turn % self.snapshot_interval != 0 and diffable:
+            record['snapshot'], record['attributes'] = False, state_delta(self.attributes, attributes)
+        self.turn, self.attributes = self.turn + 1, attributes
+        return record
+
+
+class BeliefStateReader(object):
+    """Reconstructs the full belief states of one dialogue from the logged snapshots and deltas."""
+    def __init__(self):
+        self.attributes = None
+
+    def full(self, record):
+        """The record with the full attributes. Raise ValueError for a delta without a preceding snapshot."""
+        if record.get('snapshot', True):
+            self.attributes = record['attributes']
+            return record
+        if self.attributes is None:
+            raise ValueError('Belief state delta of turn %s without a snapshot' % record.get('turn'))
+        if isinstance(record['attributes'], dict):  # an unchanged state is flattened to 'EmptyDict'
+            self.attributes = apply_delta(self.attributes, record['attributes'])
+        return dict(record, snapshot=True, attributes=self.attributes)
+
+
+def read_messages(lines):
+    """Yield the ChatBot messages of the JSON lines, e.g. of a session log file, the belief state deltas expanded.
+    Broken lines are skipped."""
+    belief_states = BeliefStateReader()
+    for line in lines:
+        try:
+            msg = json.loads(line)
+            yield belief_states.full(msg) if msg.get('name') == BELIEF_STATE else msg
+        except ValueError as e:
+            logging.warning('Skipping line %s cannot parse as json (Exception: %s)', line, e)
+
+
+def read_log(path):
+    with open(path, 'rb') as r:
+        for msg in read_messages(r):
+            yield msg
+
+
+def session_logs(root):
+    """{session: (input_output log, dm_logic log)} of the session log files in root, a missing log is None."""
+    logs = {}
+    for name in os.listdir(root):
+        for i, suffix in enumerate(SESSION_LOG_SUFFIXES):
+            if name.endswith(suffix) and len(name) > len(suffix):
+                paths = logs.setdefault(name[:-len(suffix)], [None, None])
+                paths[i] = os.path.join(root, name)
+    return dict((session, tuple(paths)) for session, paths in logs.iteritems())
+
+
 def setup_logging(config_path, default_level=logging.INFO):
     if os.path.exists(config_path):
         with open(config_path, 'r') as f:
@@ -61,34 +180,52 @@ def topic_msg_to_json(topic_msg):
     return topic, msg
 
 
-def log_from_subscriber(sub, logger):
-    level, msg = sub.recv_multipart()
-    level, msg = level.lower(), msg.strip()
-    try:
-        jsonschema.validate(msg, BASIC_JSON_MSG_SCHEMA)
-        d = json.loads(msg)
+def sampled(rate):
+    """True for the rate fraction of the calls, e.g. of the messages to validate."""
+    return rate >= 1.0 or (rate > 0.0 and random.random() < rate)
 
-        adapter = SessionAdapter(logging.getLogger(__name__), d)
-        log_adapter = getattr(adapter, level)
-        log_adapter(msg)
 
-        logger_sess_handler = getattr(logger, level)
-        logger_sess_handler(msg)
+def log_from_subscriber(sub, logger, validate_rate=0.0):
+    """Log the message published by ChatBotPUBHandler."""
+    frames = sub.recv_multipart()
+    log_message(frames[0], frames[1], logger, validate_rate)
 
-    except (ValidationError, ValueError) as e:
-        logging.critical('level: %s; msg: %s', level, str(msg))
-        logging.exception(e)
-        print msg
-        raise e
+
+def log_message(topic, msg, logger, validate_rate=0.0):
+    """The level and the session are read from the topic,
+    the message is parsed only to validate the validate_rate fraction of the messages."""
+    level, _, session = topic.decode('utf-8').partition('.')
+    level = level.lower()
+    if sampled(validate_rate):
+        try:
+            jsonschema.validate(json.loads(msg), BASIC_JSON_MSG_SCHEMA)
+        except (ValidationError, ValueError) as e:
+            logging.critical('Dropping invalid message level: %s; msg: %s', level, str(msg))
+            logging.exception(e)
+            return
+
+    log_adapter = getattr(SessionAdapter(logging.getLogger(__name__), {'session': session}), level)
+    log_adapter(msg)
+
+    logger_sess_handler = getattr(logger, level)
+    logger_sess_handler(msg, extra={'session': session})
 
 
 class SessionAdapter(logging.LoggerAdapter):
     def process(self, msg, kwargs):
-        return '[%s %s]\n%s' % (self.extra['session'], self.extra['name'], msg), kwargs
+        return '[%s]\n%s' % (self.extra['session'], msg), kwargs
 
 
 class SessionHandler(logging.Handler):
-    def __init__(self, dir_name=os.path.dirname(os.path.abspath(__file__))):
+    """Writes the ChatBot messages of a session to <session>dm_logic.log (INFO)
+    and <session>input_output.log (WARNING).
+
+    The lines are buffered and written once flush_bytes are pending or flush_interval seconds
+    passed since the last write. At most max_open files are kept open, the least recently written one
+    is fsynced and closed when another file is needed. close() fsyncs all the open files.
+    """
+    def __init__(self, dir_name=os.path.dirname(os.path.abspath(__file__)), max_open=128, flush_interval=1.0,
+                 flush_bytes=2 ** 16):
         super(self.__class__, self).__init__()
         self.log_dir = os.path.join(dir_name, 'logs')
         try:
@@ -96,63 +233,326 @@ class SessionHandler(logging.Handler):
         except OSError, e:
             if e.errno != errno.EEXIST:
                 raise
+        self.max_open, self.flush_interval, self.flush_bytes = max_open, flush_interval, flush_bytes
+        self.files = OrderedDict()  # log file -> open file, the least recently written first
+        self.pending = OrderedDict()  # log file -> lines not written yet
+        self.pending_bytes, self.last_flush = 0, time.time()
+        self.records, self.flush_latency = metrics.RateMeter(), metrics.Summary()
+        self.counts = {'records': 0, 'flushes': 0, 'bytes': 0, 'opened': 0, 'evicted': 0}
+
+    @staticmethod
+    def log_file(record):
+        session = getattr(record, 'session', None)  # set by log_from_subscriber
+        if session is None:
+            session = json.loads(record.msg)['session']
+        if getattr(logging, record.levelname) == logging.INFO:
+            return session + 'dm_logic.log'
+        elif getattr(logging, record.levelname) == logging.WARNING:
+            return session + 'input_output.log'
+        else:
+            raise ValueError("Unsupported logging level for ChatBot msgs!")
 
     def emit(self, record):
         try:
-            msg = json.loads(record.msg)
-            if getattr(logging, record.levelname) == logging.INFO:
-                log_file = msg['session'] + 'dm_logic.log'
-            elif getattr(logging, record.levelname) == logging.WARNING:
-                log_file = msg['session'] + 'input_output.log'
-            else:
-                raise ValueError("Unsupported logging level for ChatBot msgs!")
-            with open(os.path.join(self.log_dir, log_file), 'a') as w:
-                w.write(record.msg + '\n')
-                w.flush()
+            msg = record.msg if isinstance(record.msg, bytes) else record.msg.encode('utf-8')
+            line = msg + b'\n'
+            self.pending.setdefault(self.log_file(record), []).append(line)
+            self.pending_bytes += len(line)
+            self.records.mark()
+            self.counts['records'] += 1
+            self.maybe_flush()
         except Exception as e:
             logging.exception(e)
 
+    def maybe_flush(self, now=None):
+        now = time.time() if now is None else now
+        if self.pending_bytes >= self.flush_bytes or now - self.last_flush >= self.flush_interval:
+            self.flush()
 
-def chatbot2file_log_loop(address=LOGGING_ADDRESS, log_name='all_messages_cbot_msg.log'):
-    logger = logging.getLogger(__name__ + '.' + CHATBOT_MSG_LOGGER)
+    def _open(self, log_file):
+        f = self.files.pop(log_file, None)
+        if f is None:
+            while len(self.files) >= self.max_open:
+                _, evicted = self.files.popitem(last=False)
+                evicted.flush()
+                os.fsync(evicted.fileno())
+                evicted.close()
+                self.counts['evicted'] += 1
+            f = open(os.path.join(self.log_dir, log_file), 'ab')
+            self.counts['opened'] += 1
+        self.files[log_file] = f  # the most recently written
+        return f
+
+    def flush(self):
+        self.acquire()
+        try:
+            start = time.time()
+            if self.pending_bytes > 0:
+                for log_file, lines in self.pending.iteritems():
+                    f = self._open(log_file)
+                    f.write(b''.join(lines))
+                    f.flush()
+                self.flush_latency.observe(time.time() - start)
+                self.counts['flushes'] += 1
+                self.counts['bytes'] += self.pending_bytes
+            self.pending.clear()
+            self.pending_bytes, self.last_flush = 0, start
+        finally:
+            self.release()
+
+    def stats(self):
+        s = {'records_per_s': self.records.rate(),
+             'flush_latency_s': self.flush_latency.snapshot(),
+             'open_files': len(self.files),
+             'pending_bytes': self.pending_bytes, }
+        s.update(self.counts)
+        return s
+
+    def close(self):
+        self.acquire()
+        try:
+            self.flush()
+            for f in self.files.itervalues():
+                os.fsync(f.fileno())
+                f.close()
+            self.files.clear()
+        finally:
+            self.release()
+        super(self.__class__, self).close()
+
+
+class SyncedTimedRotatingFileHandler(TimedRotatingFileHandler):
+    """Fsyncs the file before it is rotated or closed."""
+    def sync(self):
+        if self.stream is not None:
+            self.stream.flush()
+            os.fsync(self.stream.fileno())
+
+    def doRollover(self):
+        self.sync()
+        TimedRotatingFileHandler.doRollover(self)
+
+    def close(self):
+        self.acquire()
+        try:
+            self.sync()
+        finally:
+            self.release()
+        TimedRotatingFileHandler.close(self)
+
+
+def topic_session(topic):
+    return topic.partition(b'.')[2]
+
+
+class PublisherGaps(object):
+    """Counts the messages PUB sockets dropped from the gaps in the sequence numbers of the publishers.
+    At most max_publishers publishers are tracked, the least recently seen are forgotten."""
+    def __init__(self, max_publishers=10000):
+        self.max_publishers = max_publishers
+        self.last = OrderedDict()  # publisher -> last sequence number
+        self.dropped = 0
+
+    def observe(self, frames):
+        if len(frames) < 3:
+            return  # a publisher without sequence numbers
+        publisher, seq = frames[2].split(b' ')
+        seq = int(seq)
+        last = self.last.pop(publisher, None)
+        if last is not None and seq > last + 1:
+            self.dropped += seq - last - 1
+        self.last[publisher] = seq
+        if len(self.last) > self.max_publishers:
+            self.last.popitem(last=False)
+
+
+class LogSink(object):
+    """Writes the ChatBot messages received by the socket to log_name and to the session log files
+    or, if store_dir is given, to the SegmentStore in store_dir.
+
+    gaps: PublisherGaps if the socket receives directly from the publishers
+    processed: shared counter of the logged messages read by the dispatcher of the sharded sinks
+    """
+    def __init__(self, socket, log_name='all_messages_cbot_msg.log', flush_interval=1.0, stats_interval=60.0,
+                 validate_rate=0.0, store_dir=None, segment_bytes=2 ** 26, gaps=None, processed=None):
+        self.socket, self.flush_interval, self.stats_interval = socket, flush_interval, stats_interval
+        self.validate_rate, self.gaps, self.processed = validate_rate, gaps, processed
+        self.logger = logging.getLogger(__name__ + '.' + CHATBOT_MSG_LOGGER)
+        self.fh = SyncedTimedRotatingFileHandler(log_name, when='W0', interval=1)
+        if store_dir is None:
+            self.session_handler = SessionHandler(flush_interval=flush_interval)
+        else:
+            self.session_handler = SegmentStoreHandler(SegmentStore(store_dir, segment_bytes),
+                                                       flush_interval=flush_interval)
+        self.logger.addHandler(self.fh)
+        self.logger.addHandler(self.session_handler)
+        self.logger.setLevel(logging.DEBUG)
+        self.stats_logger = logging.getLogger(__name__ + '.' + self.session_handler.__class__.__name__)
+
+    def stats(self):
+        s = self.session_handler.stats()
+        if self.gaps is not None:
+            s['upstream_dropped'] = self.gaps.dropped
+        return s
+
+    def run(self):
+        """Log the messages until an empty message, which the dispatcher sends to stop the sink."""
+        next_stats = time.time() + self.stats_interval
+        while True:
+            if self.socket.poll(timeout=1000 * self.flush_interval):
+                frames = self.socket.recv_multipart()
+                if frames == [b'']:
+                    break
+                if self.gaps is not None:
+                    self.gaps.observe(frames)
+                log_message(frames[0], frames[1], self.logger, self.validate_rate)
+                if self.processed is not None:
+                    self.processed.value += 1
+            self.session_handler.maybe_flush()
+            if time.time() >= next_stats:
+                self.stats_logger.info('stats %s', json.dumps(self.stats(), sort_keys=True))
+                next_stats = time.time() + self.stats_interval
+
+    def close(self):
+        for handler in [self.fh, self.session_handler]:
+            self.logger.removeHandler(handler)
+            handler.close()
+
+
+def chatbot2file_log_loop(address=LOGGING_ADDRESS, workers=1, queue_size=10000, **sink_kwargs):
+    """Logs the ChatBot messages published to the address, see LogSink for sink_kwargs.
+    With several workers the sessions are sharded among worker processes by sharded_log_loop."""
+    if workers > 1:
+        return sharded_log_loop(address, workers, queue_size, **sink_kwargs)
+    ctx = zmq.Context()
+    sub = ctx.socket(zmq.SUB)
+    sub.setsockopt(zmq.RCVHWM, queue_size)
+    sub.bind(address)
+    sub.setsockopt_string(zmq.SUBSCRIBE, '')
+    sink = LogSink(sub, gaps=PublisherGaps(), **sink_kwargs)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))  # terminate() flushes the buffered messages
+    try:
+        sink.run()
+    finally:
+        sink.close()
+
+
+def shard_kwargs(shard, log_name='all_messages_cbot_msg.log', store_dir=None, **sink_kwargs):
+    """Each shard writes its own log_name and store, the session log files are disjoint."""
+    base, ext = os.path.splitext(log_name)
+    sink_kwargs['log_name'] = '%s-%d%s' % (base, shard, ext)
+    sink_kwargs['store_dir'] = None if store_dir is None else os.path.join(store_dir, 'shard-%d' % shard)
+    return sink_kwargs
+
+
+def log_sink_worker(address, processed, **sink_kwargs):
+    ctx = zmq.Context()
+    pull = ctx.socket(zmq.PULL)
+    pull.connect(address)
+    sink = LogSink(pull, processed=processed, **sink_kwargs)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        sink.run()
+    finally:
+        sink.close()
+
+
+def sharded_log_loop(address=LOGGING_ADDRESS, workers=2, queue_size=10000, stats_interval=60.0, **sink_kwargs):
+    """Receives the published ChatBot messages and forwards each to the worker process of its session,
+    crc32(session) % workers, so the messages of a session are logged in order by one worker.
+
+    The dispatcher does not parse the messages. A worker whose queue_size messages are waiting
+    gets no more messages until it catches up, the dropped messages are counted.
+    The stats report the queue depth and dropped messages of each worker.
+    """
+    logger = logging.getLogger(__name__ + '.' + sharded_log_loop.__name__)
     ctx = zmq.Context()
     sub = ctx.socket(zmq.SUB)
+    sub.setsockopt(zmq.RCVHWM, queue_size)
     sub.bind(address)
     sub.setsockopt_string(zmq.SUBSCRIBE, '')
+    pushes, processes, processed = [], [], []
+    for shard in range(workers):
+        push = ctx.socket(zmq.PUSH)
+        push.setsockopt(zmq.SNDHWM, queue_size)
+        port = push.bind_to_random_port('tcp://127.0.0.1')
+        counter = multiprocessing.RawValue(b'L', 0)  # written by the worker only
+        kwargs = shard_kwargs(shard, stats_interval=stats_interval, **sink_kwargs)
+        p = multiprocessing.Process(target=log_sink_worker, args=('tcp://127.0.0.1:%d' % port, counter), kwargs=kwargs,
+                                    name='LogSink-%d' % shard)
+        p.start()
+        pushes.append(push)
+        processes.append(p)
+        processed.append(counter)
+    sent, dropped, gaps = [0] * workers, [0] * workers, PublisherGaps()
 
-    fh = TimedRotatingFileHandler(log_name, when='W0', interval=1)
-    logger.addHandler(fh)
-    logger.addHandler(SessionHandler())
-    logger.setLevel(logging.DEBUG)
+    def stats():
+        return {'upstream_dropped': gaps.dropped,
+                'workers': [{'sent': sent[i], 'dropped': dropped[i], 'queue_depth': sent[i] - processed[i].value,
+                             'alive': processes[i].is_alive()} for i in range(workers)], }
 
-    while True:
-        log_from_subscriber(sub, logger)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    next_stats = time.time() + stats_interval
+    try:
+        while True:
+            if sub.poll(timeout=1000):
+                frames = sub.recv_multipart()
+                gaps.observe(frames)
+                shard = (zlib.crc32(topic_session(frames[0])) & 0xffffffff) % workers
+                try:
+                    pushes[shard].send_multipart(frames, zmq.NOBLOCK)
+                    sent[shard] += 1
+                except zmq.Again:
+                    dropped[shard] += 1
+                    metrics.incr('log_dropped')
+            if time.time() >= next_stats:
+                logger.info('stats %s', json.dumps(stats(), sort_keys=True))
+                next_stats = time.time() + stats_interval
+    finally:
+        for shard, push in enumerate(pushes):
+            push.setsockopt(zmq.SNDTIMEO, 5000)
+            push.setsockopt(zmq.LINGER, 5000)
+            try:
+                push.send_multipart([b''])  # the worker stops after the messages sent before
+            except zmq.Again:
+                logger.error('LogSink-%d is not receiving', shard)
+        for p in processes:
+            p.join(5.0)
+            if p.is_alive():
+                p.terminate()
+        logger.info('stats %s', json.dumps(stats(), sort_keys=True))
 
 
 class ChatBotPUBHandler(PUBHandler):
-    def __init__(self, publish_socket, session):
+    """Publishes the ChatBot messages as [<LEVEL>.<session>, compact JSON, <publisher> <sequence number>].
+
+    The messages are logged as dicts (JSON text is accepted too) and serialized once,
+    the serialized message replaces record.msg for the other handlers.
+    The validate_rate fraction of the messages is validated against BASIC_JSON_MSG_SCHEMA.
+    """
+    def __init__(self, publish_socket, session, validate_rate=0.0):
         super(self.__class__, self).__init__(publish_socket)
-        self.session = session
+        self.session, self.validate_rate = session, validate_rate
+        self.publisher, self.seq = uuid.uuid4().hex[:16].encode('ascii'), 0
 
     def emit(self, record):
-        jsonschema.validate(record.msg, BASIC_JSON_MSG_SCHEMA)
-        msg = json.loads(record.msg)
+        msg = record.msg if isinstance(record.msg, dict) else json.loads(record.msg)
         if 'session' not in msg:
-            msg['session'] = self.session
-        record.msg = json.dumps(msg, sort_keys=True, indent=4, separators=(',', ': '))
-        super(self.__class__, self).emit(record)
+            msg = dict(msg, session=self.session)  # the logged dict may be delivered elsewhere too, e.g. inproc
+        if sampled(self.validate_rate):
+            jsonschema.validate(msg, BASIC_JSON_MSG_SCHEMA)
+        record.msg = json.dumps(msg, cls=ChatBotJsonEncoder, sort_keys=True, separators=(',', ':'))
+        topic = '%s.%s' % (record.levelname, msg['session'])
+        self.seq += 1
+        self.socket.send_multipart([topic.encode('utf-8'), record.msg.encode('utf-8'), b'%s %d' % (self.publisher, self.seq)])
 
 
-def connect_logger(logger_name, session_name, context, address=LOGGING_ADDRESS):
+def connect_logger(logger_name, session_name, context, address=LOGGING_ADDRESS, validate_rate=0.0):
     logger = logging.getLogger(logger_name)
     pub = context.socket(zmq.PUB)
     pub.connect(address)
-    handler = ChatBotPUBHandler(pub, session_name)
-    f = logging.Formatter("%(message)s\n")
-    # special logic for ChatBot TODO define my own logging levels
-    PUBHandler.formatters[logging.DEBUG] = f
-    PUBHandler.formatters[logging.WARNING] = f
-    PUBHandler.formatters[logging.INFO] = f
+    handler = ChatBotPUBHandler(pub, session_name, validate_rate)
     logger.addHandler(handler)
 
     logger.setLevel(logging.DEBUG)  # filtering will be done at the listener side
+    return handler
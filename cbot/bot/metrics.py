@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Process wide counters and latency summaries, e.g. of the ChatBotConnectors in the web app.
+
+    metrics.incr('handshake_failed')
+    metrics.observe('handshake_latency_s', 0.25)
+    metrics.snapshot()
+"""
+from __future__ import unicode_literals, division
+from collections import defaultdict, deque
+import time
+
+
+class Summary(object):
+    """Count, mean, min, max and percentiles of the last window observed values."""
+    def __init__(self, window=1000):
+        self.count, self.total = 0, 0.0
+        self.min, self.max = None, None
+        self.recent = deque(maxlen=window)
+
+    def observe(self, value):
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        self.recent.append(value)
+
+    def percentile(self, p):
+        if len(self.recent) == 0:
+            return None
+        values = sorted(self.recent)
+        return values[min(len(values) - 1, int(p / 100 * len(values)))]
+
+    def snapshot(self):
+        return {'count': self.count,
+                'mean': self.total / self.count if self.count > 0 else None,
+                'min': self.min,
+                'max': self.max,
+                'p50': self.percentile(50),
+                'p95': self.percentile(95),
+                'p99': self.percentile(99), }
+
+
+class RateMeter(object):
+    """Events per second in the last window seconds, counted per second so at most window counts are kept."""
+    def __init__(self, window=60.0):
+        self.window = window
+        self.seconds = deque()  # [second, events in it], the oldest first
+        self.count = 0
+
+    def _trim(self, now):
+        while len(self.seconds) > 0 and self.seconds[0][0] < now - self.window:
+            self.seconds.popleft()
+
+    def mark(self, now=None):
+        now = time.time() if now is None else now
+        self.count += 1
+        second = int(now)
+        if len(self.seconds) > 0 and self.seconds[-1][0] == second:
+            self.seconds[-1][1] += 1
+        else:
+            self.seconds.append([second, 1])
+        self._trim(now)
+
+    def rate(self, now=None):
+        now = time.time() if now is None else now
+        self._trim(now)
+        return sum(n for _, n in self.seconds) / self.window
+
+
+counters = defaultdict(int)
+summaries = defaultdict(Summary)
+
+
+def incr(name, n=1):
+    counters[name] += n
+
+
+def observe(name, value):
+    summaries[name].observe(value)
+
+
+def snapshot():
+    s = dict(counters)
+    s.update((name, summary.snapshot()) for name, summary in summaries.iteritems())
+    return s
+
+
+def aggregate_stats(stats):
+    """Fleet totals of the stats replied by ChatBotProcess or ChatBotHostProcess, stats is name -> stats."""
+    s = {'bots': len(stats), 'rss_bytes_per_bot': dict((name, b.get('rss_bytes')) for name, b in stats.iteritems())}
+    for key in ['sessions', 'history_len', 'turns', 'turns_per_s', 'queue_depth', 'rss_bytes']:
+        s[key] = sum(b.get(key, 0) for b in stats.itervalues())
+    s['queue_depth_max'] = max([b.get('queue_depth', 0) for b in stats.itervalues()] + [0])
+    return s
+
+
+def reset():
+    counters.clear()
+    summaries.clear()
@@ -0,0 +1,299 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Pool of pre-started ChatBot processes.
+
+Starting a ChatBotProcess means importing the whole stack, loading the POS tagger
+and building the KnowledgeBase. The pool keeps warm, already initialized bots,
+so a new dialogue only leases one of them instead of waiting for a cold start.
+A returned bot is reset to a fresh belief state under a new session id and reused.
+
+ChatBotHostPool leases dialogues hosted inside of few ChatBotHostProcess processes
+instead of whole processes, or inside of ChatBotHostGreenlet in the web process
+if the endpoints are in process (transport.InProcEndpoints).
+"""
+from __future__ import unicode_literals, division
+from collections import deque
+import logging
+import time
+import uuid
+import gevent
+from gevent.event import Event
+import zmq.green as zmqg
+from cbot.bot.connectors import ChatBotProcess, ChatBotHostProcess, ChatBotHostGreenlet
+import cbot.bot.metrics as metrics
+
+
+class ChatBotPool(object):
+    def __init__(self, endpoints, min_size=2, max_size=20, spare=1, ready_timeout=30.0, idle_retire=60.0,
+                 probe_interval=0.1, spawn=None, ctx=None):
+        """
+        min_size, max_size bound the number of bot processes (idle, leased and starting).
+        spare is the number of idle bots the pool tries to keep warm on top of the demand,
+        where demand is the number of leased bots plus the number of waiting lease requests.
+        Idle bots above the demand are terminated after idle_retire seconds.
+        spawn(name, endpoints) starts a bot process, ChatBotProcess by default.
+        """
+        assert 0 < min_size <= max_size
+        assert not endpoints.in_process, 'In process ChatBots are hosted by ChatBotHostPool'
+        self.min_size, self.max_size, self.spare = min_size, max_size, spare
+        self.ready_timeout, self.idle_retire, self.probe_interval = ready_timeout, idle_retire, probe_interval
+        self.endpoints = endpoints
+        self._spawn = spawn if spawn is not None else self._spawn_process
+        self.logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
+
+        self.context = ctx if ctx is not None else zmqg.Context()
+        self.transport = endpoints.connector(self.context)
+        self.transport.subscribe('', ['init_sync', 'ready', 'reset'])  # of all bots
+
+        self.idle = deque()  # (bot, idle since) ready to be leased, the oldest on the left
+        self.leased = {}  # name -> bot
+        self.starting = {}  # name -> (bot, deadline) waiting for the init handshake
+        self.resetting = {}  # name -> (bot, session, deadline) waiting for the reset confirmation
+        self.waiting = 0  # number of lease requests blocked on the empty pool
+        self._bot_ready = Event()
+        self.counts = {'spawned': 0, 'retired': 0, 'failed': 0, 'leases': 0, 'timeouts': 0}
+
+        self._greenlets = [gevent.spawn(self._listen), gevent.spawn(self._maintain)]
+
+    @property
+    def size(self):
+        return len(self.idle) + len(self.leased) + len(self.starting) + len(self.resetting)
+
+    def _spawn_process(self, name, endpoints):
+        bot = ChatBotProcess(name, endpoints)
+        bot.start()
+        return bot
+
+    def _start_bot(self):
+        name = str(int(uuid.uuid4()))
+        bot = self._spawn(name, self.endpoints)
+        self.starting[name] = (bot, time.time() + self.ready_timeout)
+        self.counts['spawned'] += 1
+        self.logger.debug('Starting bot %s', name)
+
+    def _retire(self, bot):
+        self.logger.debug('Retiring bot %s', bot.name)
+        self.transport.send('die', bot.name, 'die')
+        bot.terminate()
+        self.counts['retired'] += 1
+
+    def _make_idle(self, bot):
+        self.idle.append((bot, time.time()))
+        self._bot_ready.set()
+
+    def lease(self, timeout=None):
+        """Return initialized bot with fresh belief state or None if no bot is ready before timeout."""
+        deadline = None if timeout is None else time.time() + timeout
+        self.waiting += 1
+        try:
+            while True:
+                while len(self.idle) > 0:
+                    bot, _ = self.idle.popleft()
+                    if bot.is_alive():
+                        self.leased[bot.name] = bot
+                        self.counts['leases'] += 1
+                        return bot
+                    self.counts['failed'] += 1
+                self._bot_ready.clear()
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    self.counts['timeouts'] += 1
+                    return None
+                self._bot_ready.wait(timeout=remaining)
+        finally:
+            self.waiting -= 1
+
+    def release(self, bot):
+        """Return the leased bot. It is reset to a fresh state before the next lease."""
+        if self.leased.pop(bot.name, None) is None:
+            self.logger.warning('Bot %s was not leased from the pool', bot.name)
+            return
+        if not bot.is_alive():
+            self.counts['failed'] += 1
+            return
+        session = str(int(uuid.uuid4()))
+        self.resetting[bot.name] = (bot, session, time.time() + self.ready_timeout)
+        self.transport.send('reset', bot.name, session)
+
+    def retire(self, bot):
+        """Return the leased bot and terminate it, e.g. if it grew too large to be reused."""
+        if self.leased.pop(bot.name, None) is None:
+            self.logger.warning('Bot %s was not leased from the pool', bot.name)
+            return
+        self._retire(bot)
+
+    def bot_names(self):
+        """Names of the running initialized bots"""
+        return [b.name for b, _ in self.idle] + self.leased.keys() + self.resetting.keys()
+
+    def owns(self, name):
+        """True for the bots of the pool including the starting ones."""
+        return name in self.starting or name in self.bot_names()
+
+    def _listen(self):
+        while True:
+            signal, name, payload = self.transport.recv()
+            if signal in ('init_sync', 'ready'):
+                if name in self.starting:
+                    bot, deadline = self.starting.pop(name)
+                    start_latency = time.time() - (deadline - self.ready_timeout)
+                    metrics.observe('pool_start_latency_s', start_latency)
+                    self.logger.debug('Bot %s is ready after %.3f s', name, start_latency)
+                    self._make_idle(bot)
+            elif signal == 'reset':
+                if name in self.resetting:
+                    bot, session, _ = self.resetting.pop(name)
+                    if payload != session:  # a stale or duplicated reply, the state of the bot is unknown
+                        self.logger.warning('Bot %s reset to %s instead of %s, retiring it', name, payload, session)
+                        self._retire(bot)
+                        self.counts['failed'] += 1
+                        continue
+                    bot.session = session
+                    self._make_idle(bot)
+
+    def _maintain(self):
+        while True:
+            now = time.time()
+            for name, (bot, deadline) in self.starting.items():
+                if deadline < now or not bot.is_alive():
+                    self.logger.warning('Bot %s has not started in %.1f s', name, self.ready_timeout)
+                    del self.starting[name]
+                    self._retire(bot)
+                    self.counts['failed'] += 1
+                else:
+                    self.transport.send('init_sync', name, 'probing connection')
+            for name, (bot, _, deadline) in self.resetting.items():
+                if deadline < now or not bot.is_alive():
+                    self.logger.warning('Bot %s has not been reset in %.1f s', name, self.ready_timeout)
+                    del self.resetting[name]
+                    self._retire(bot)
+                    self.counts['failed'] += 1
+            self._scale(now)
+            gevent.sleep(self.probe_interval)
+
+    def _scale(self, now):
+        demand = len(self.leased) + self.waiting + self.spare
+        desired = max(self.min_size, min(self.max_size, demand))
+        for _ in range(desired - self.size):
+            self._start_bot()
+        if self.size > desired and len(self.idle) > 0:
+            bot, since = self.idle[0]
+            if now - since >= self.idle_retire:
+                self.idle.popleft()
+                self._retire(bot)
+
+    def stats(self):
+        s = {'size': self.size,
+             'min_size': self.min_size,
+             'max_size': self.max_size,
+             'idle': len(self.idle),
+             'leased': len(self.leased),
+             'starting': len(self.starting),
+             'resetting': len(self.resetting),
+             'waiting': self.waiting,
+             'occupancy': len(self.leased) / self.max_size, }
+        s.update(self.counts)
+        return s
+
+    def shutdown(self):
+        gevent.killall(self._greenlets)
+        bots = [b for b, _ in self.idle] + self.leased.values()
+        bots += [b for b, _ in self.starting.values()] + [b for b, _, _ in self.resetting.values()]
+        for bot in bots:
+            self._retire(bot)
+        self.idle.clear()
+        self.leased, self.starting, self.resetting = {}, {}, {}
+        self.transport.close()
+
+
+class HostedSession(object):
+    """Handle for a dialogue running inside of ChatBotHostProcess."""
+    def __init__(self, host, session):
+        self.host, self.name, self.session = host, session, session
+
+    def is_alive(self):
+        return self.host.is_alive()
+
+
+class ChatBotHostPool(object):
+    def __init__(self, endpoints, hosts=1, max_sessions=1000, ready_timeout=30.0, probe_interval=0.1, ctx=None):
+        """
+        Starts hosts ChatBotHostProcess processes (or ChatBotHostGreenlets for in process endpoints)
+        each running up to max_sessions dialogues.
+        Dialogues are placed on the least loaded ready host.
+        """
+        assert hosts > 0 and max_sessions > 0
+        self.max_sessions, self.ready_timeout, self.probe_interval = max_sessions, ready_timeout, probe_interval
+        self.logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
+
+        self.context = ctx if ctx is not None else zmqg.Context()
+        self.transport = endpoints.connector(self.context)
+        self.transport.subscribe('', ['init_sync', 'ready'])
+
+        self.hosts = {}  # name -> ChatBotHostProcess
+        self.sessions = {}  # host name -> set of session names
+        self.ready = set()
+        self._host_ready = Event()
+        self.counts = {'leases': 0, 'timeouts': 0}
+        host_type = ChatBotHostGreenlet if endpoints.in_process else ChatBotHostProcess
+        for _ in range(hosts):
+            host = host_type(str(int(uuid.uuid4())), endpoints)
+            host.start()
+            self.hosts[host.name], self.sessions[host.name] = host, set()
+        self._greenlets = [gevent.spawn(self._listen), gevent.spawn(self._probe)]
+
+    def _listen(self):
+        while True:
+            signal, name, _ = self.transport.recv()
+            if signal in ('init_sync', 'ready') and name in self.hosts and name not in self.ready:
+                self.logger.debug('Host %s is ready', name)
+                self.ready.add(name)
+                self._host_ready.set()
+
+    def bot_names(self):
+        return list(self.ready)
+
+    def _probe(self):
+        deadline = time.time() + self.ready_timeout
+        while len(self.ready) < len(self.hosts) and time.time() < deadline:
+            for name in self.hosts:
+                if name not in self.ready:
+                    self.transport.send('init_sync', name, 'probing connection')
+            gevent.sleep(self.probe_interval)
+
+    def lease(self, timeout=None):
+        if not self._host_ready.wait(timeout=timeout if timeout is not None else self.ready_timeout):
+            self.counts['timeouts'] += 1
+            return None
+        candidates = [n for n in self.ready if self.hosts[n].is_alive() and len(self.sessions[n]) < self.max_sessions]
+        if len(candidates) == 0:
+            self.logger.warning('All ChatBot hosts are full or dead')
+            return None
+        name = min(candidates, key=lambda n: len(self.sessions[n]))
+        host = self.hosts[name]
+        bot = HostedSession(host, host.session_name())
+        self.sessions[name].add(bot.name)
+        self.counts['leases'] += 1
+        return bot
+
+    def release(self, bot):
+        self.sessions[bot.host.name].discard(bot.name)
+        self.transport.send('die', bot.name, 'die')
+
+    def stats(self):
+        s = {'hosts': len(self.hosts),
+             'ready': len(self.ready),
+             'leased': sum(len(v) for v in self.sessions.values()),
+             'max_sessions': self.max_sessions * len(self.hosts),
+             'sessions': dict((n, len(v)) for n, v in self.sessions.iteritems()), }
+        s['occupancy'] = s['leased'] / s['max_sessions']
+        s.update(self.counts)
+        return s
+
+    def shutdown(self):
+        gevent.killall(self._greenlets)
+        for name, host in self.hosts.iteritems():
+            self.transport.send('die', name, 'die')
+            host.terminate()
+        self.transport.close()
@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""Memory and liveness of (bot) processes read from /proc. Linux only."""
+from __future__ import unicode_literals
+import errno
+import os
+
+
+def _proc_path(pid, name):
+    return os.path.join('/proc', 'self' if pid is None else str(pid), name)
+
+
+def is_running(pid):
+    """True if the process exists and it is not a zombie."""
+    try:
+        with open(_proc_path(pid, 'stat'), 'r') as r:
+            state = r.read().rsplit(')', 1)[1].split()[0]
+    except IOError as e:
+        if e.errno == errno.ENOENT:
+            return False
+        raise
+    return state not in ('Z', 'X')
+
+
+def rss_bytes(pid=None):
+    """Resident set size of the process including pages shared with other processes."""
+    with open(_proc_path(pid, 'statm'), 'r') as r:
+        resident = int(r.read().split()[1])
+    return resident * os.sysconf(str('SC_PAGE_SIZE'))
+
+
+def uss_bytes(pid=None):
+    """Unique set size: memory which would be freed if the process exits.
+    Pages shared copy-on-write e.g. with a zygote are not counted."""
+    uss = 0
+    with open(_proc_path(pid, 'smaps'), 'r') as r:
+        for line in r:
+            if line.startswith('Private_Clean:') or line.startswith('Private_Dirty:'):
+                uss += int(line.split()[1]) * 1024
+    return uss
+
+
+def cpu_seconds(pid=None):
+    """User and system CPU time the process has consumed so far."""
+    with open(_proc_path(pid, 'stat'), 'r') as r:
+        fields = r.read().rsplit(')', 1)[1].split()
+    utime, stime = int(fields[11]), int(fields[12])
+    return (utime + stime) / float(os.sysconf(str('SC_CLK_TCK')))
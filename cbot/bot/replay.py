@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Deterministic offline replay of recorded dialogues on an in-process ChatBot.
+
+The recorded human utterances are sent to the ChatBot synchronously, its replies and belief states
+are captured from its log records. The random generators are seeded at the start of each dialogue,
+so a replay of the same code is repeatable and differences come from the code or the models.
+
+    python -m cbot.bot.replay cbot/bot/logs/<session>dm_logic.log
+"""
+from __future__ import unicode_literals, division
+import argparse
+import json
+import logging
+import itertools
+import random
+import time
+import numpy as np
+from cbot.bot.alias import HUMAN, SYSTEM, BELIEF_STATE
+from cbot.bot.connectors import ChatBot
+from cbot.bot.log import ChatBotJsonEncoder, OBJECT_ADDRESS_RE, read_log, wrap_msg
+import cbot.kb as kb
+
+REGRESSION_FIELDS = ['replayed', 'user_action', 'user_mentions']  # compared with a baseline replay
+
+
+def normalize(attributes):
+    """Flattened belief state attributes comparable across processes: JSON types, no object addresses."""
+    normalized = json.loads(OBJECT_ADDRESS_RE.sub(' object', json.dumps(attributes, cls=ChatBotJsonEncoder)))
+    return normalized if isinstance(normalized, dict) else {}  # flatten encodes {} as 'EmptyDict'
+
+
+def plain(obj):
+    return json.loads(json.dumps(obj, cls=ChatBotJsonEncoder))
+
+
+def read_session(io_path, dm_path):
+    """Yield the recorded messages of a session from its session log files, see cbot.bot.log.SessionHandler.
+    The belief states of dm_logic follow the human messages of input_output in turn.
+    A dm_logic log with the human messages (the former layout) is read alone."""
+    states = read_log(dm_path) if dm_path is not None else iter([])
+    first_state = next(states, None)
+    if first_state is not None and first_state.get('name', first_state.get('user')) != BELIEF_STATE:
+        yield first_state
+        for m in states:
+            yield m
+        return
+    states = itertools.chain([first_state] if first_state is not None else [], states)
+    for m in read_log(io_path) if io_path is not None else []:
+        yield m
+        if m.get('name', m.get('user')) == HUMAN:
+            state = next(states, None)
+            if state is not None:
+                yield state
+
+
+def changes(turn, baseline_turn):
+    """REGRESSION_FIELDS of the replayed turn which differ from the baseline replay of the turn."""
+    return [f for f in REGRESSION_FIELDS if baseline_turn is None or turn[f] != baseline_turn.get(f)]
+
+
+def recorded_turns(msgs):
+    """Yield (human message, belief states, replies) of the recorded messages,
+    the messages before the first human message have None for the human message."""
+    human, states, replies = None, [], []
+    for m in msgs:
+        name = m.get('name', m.get('user'))
+        if name == HUMAN:
+            if human is not None or len(states) + len(replies) > 0:
+                yield human, states, replies
+            human, states, replies = m, [], []
+        elif name == BELIEF_STATE:
+            states.append(m)
+        elif name == SYSTEM:
+            replies.append(m)
+    if human is not None or len(states) + len(replies) > 0:
+        yield human, states, replies
+
+
+class CaptureHandler(logging.Handler):
+    """Keeps the messages the ChatBot logs, the ChatBot sets the session."""
+    def __init__(self):
+        super(self.__class__, self).__init__()
+        self.session, self.msgs = None, []
+
+    def emit(self, record):
+        self.msgs.append(record.msg)
+
+
+class ReplayEngine(object):
+    """Replays dialogues on its own ChatBot, the knowledge base may be shared by several engines."""
+    def __init__(self, knowledge_base=None, seed=0):
+        self.seed = seed
+        if knowledge_base is None:
+            knowledge_base = kb.KnowledgeBase()
+            knowledge_base.load_default_models()
+        self.capture, self.replies, self.user_action = CaptureHandler(), [], None
+        self.chatbot = ChatBot('replay', self.replies.append, knowledge_base, log_handler=self.capture,
+                               state_snapshot_interval=None)
+        # the records of the replayed dialogues are captured, not published, by a logger outside of the hierarchy
+        self.chatbot.logger = logging.Logger(__name__ + '.' + self.__class__.__name__)
+        self.chatbot.logger.addHandler(self.capture)
+        self.chatbot.logger.setLevel(logging.INFO)
+
+    def start(self, session='replay'):
+        """Start a new dialogue with the random generators seeded."""
+        random.seed(self.seed)
+        np.random.seed(self.seed)
+        self.chatbot.reset(session)
+
+    def turn(self, utterance):
+        """Return the replies and the full belief state attributes of the ChatBot for the utterance.
+        The user action the ChatBot understood is kept in user_action."""
+        del self.replies[:]
+        del self.capture.msgs[:]
+        before = dict(self.chatbot.policy.state.user_actions)
+        self.chatbot.receive_msg(wrap_msg(utterance))
+        state = self.chatbot.policy.state
+        updated = [a for t, a in state.user_actions.iteritems() if before.get(t) is not a]
+        self.user_action = None if len(updated) == 0 else {'name': type(updated[-1]).__name__,
+                                                           'args': plain(updated[-1].args)}
+        states = [m['attributes'] for m in self.capture.msgs if m.get('name') == BELIEF_STATE]
+        return [m['utterance'] for m in self.replies], states
+
+    def user_mentions(self):
+        """The user mentions and their probabilities sorted."""
+        return sorted([plain(triplet), round(p, 9)] for triplet, p in self.chatbot.policy.state.user_mentions.items())
+
+    def replay(self, msgs, session='replay'):
+        """Yield the divergence of the replayed dialogue from the recorded messages turn by turn:
+        the recorded and replayed replies, the changed belief state attributes, the time of the turn
+        and the understood user action and the user mentions to compare with other replays."""
+        self.start(session)
+        for i, (human, states, replies) in enumerate(recorded_turns(msgs)):
+            if human is None:
+                continue
+            start = time.time()
+            replayed, replayed_states = self.turn(human['utterance'])
+            elapsed = time.time() - start
+            recorded = [r['utterance'] for r in replies]
+            recorded_state = normalize(states[-1]['attributes']) if len(states) > 0 else {}
+            replayed_state = normalize(replayed_states[-1]) if len(replayed_states) > 0 else {}
+            yield {'turn': i,
+                   'human': human['utterance'],
+                   'recorded': recorded,
+                   'replayed': replayed,
+                   'reply_diverged': recorded != replayed,
+                   'state_diverged': sorted(k for k in set(recorded_state) | set(replayed_state)
+                                            if recorded_state.get(k) != replayed_state.get(k)),
+                   'user_action': self.user_action,
+                   'user_mentions': self.user_mentions(),
+                   'time_s': elapsed, }
+
+
+def summarize(turns):
+    """Summary of the divergence of the turns of one or more dialogues."""
+    s = {'turns': 0, 'replies_diverged': 0, 'states_diverged': 0, 'first_divergence': None, 'time_s': 0.0}
+    for t in turns:
+        s['turns'] += 1
+        s['replies_diverged'] += t['reply_diverged']
+        s['states_diverged'] += len(t['state_diverged']) > 0
+        s['time_s'] += t['time_s']
+        if s['first_divergence'] is None and t['reply_diverged']:
+            s['first_divergence'] = t['turn']
+    return s
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('log', help='Session log with the human messages, replies and belief states')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    turns = []
+    for t in ReplayEngine(seed=args.seed).replay(read_log(args.log)):
+        print json.dumps(t, sort_keys=True)
+        turns.append(t)
+    print json.dumps(summarize(turns), sort_keys=True)
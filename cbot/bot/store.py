@@ -0,0 +1,372 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Append-only segmented store of the ChatBot messages, an alternative to the session log files.
+
+    segment-000007.log  the active segment, lines '<LEVEL>\\t<session>\\t<msg>\\n' in the order of arrival
+    segment-000006.z    a sealed segment, one zlib stream of the lines of each of its sessions
+    index.jsonl         a line per session and sealed segment:
+                        {"session", "segment", "offset", "length", "start", "end", "turns"}
+
+The active segment is sealed once it grows over segment_bytes. A session is read from the sealed
+segments at the indexed offsets, only the active segment is scanned. Bulk export is a copy of the
+sealed segments and the index.
+
+    python -m cbot.bot.store cbot/bot/logs/store ls
+    python -m cbot.bot.store cbot/bot/logs/store cat <session>
+"""
+from __future__ import unicode_literals, division
+import argparse
+import errno
+import json
+import logging
+import os
+import re
+import time
+import zlib
+from cbot.bot.alias import HUMAN
+import cbot.bot.metrics as metrics
+
+SEGMENT_RE = re.compile(r'^segment-(\d+)\.(log|z)$')
+INDEX_NAME = 'index.jsonl'
+
+
+def encode_line(level, session, msg):
+    return b'\t'.join([level.encode('utf-8'), session.encode('utf-8'), msg]) + b'\n'
+
+
+def decode_line(line):
+    """Return (level, session, msg), msg is the JSON text of the message."""
+    level, session, msg = line.rstrip(b'\n').split(b'\t', 2)
+    return level.decode('utf-8'), session.decode('utf-8'), msg
+
+
+def session_meta(lines):
+    """Start and end time and number of human turns of the lines of a session.
+    Only the input_output (WARNING) messages are parsed, the belief states carry no time."""
+    start, end, turns = None, None, 0
+    for line in lines:
+        level, _, msg = decode_line(line)
+        if level != 'WARNING':
+            continue
+        msg = json.loads(msg)
+        t = msg.get('time')
+        if t is not None:
+            start = t if start is None else min(start, t)
+            end = t if end is None else max(end, t)
+        turns += msg.get('name') == HUMAN
+    return {'start': start, 'end': end, 'turns': turns}
+
+
+class SegmentStore(object):
+    """One process appends, any number of processes read. See the module documentation."""
+    def __init__(self, dir_name, segment_bytes=2 ** 26, compress_level=6):
+        self.dir_name, self.segment_bytes, self.compress_level = dir_name, segment_bytes, compress_level
+        self.logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
+        try:
+            os.makedirs(dir_name)
+        except OSError, e:
+            if e.errno != errno.EEXIST:
+                raise
+        self.index = {}  # session -> index entries in the order of the segments
+        self.sealed = set()  # numbers of the indexed segments
+        self._index_pos = 0
+        self.active, self.active_segment = None, None  # file and number of the appended segment
+        self.counts = {'appended_bytes': 0, 'sealed': 0, 'sealed_bytes': 0}
+        self.reload()
+
+    def path(self, segment, ext):
+        return os.path.join(self.dir_name, 'segment-%06d.%s' % (segment, ext))
+
+    def segments(self):
+        """{number: set of extensions} of the segment files in the directory"""
+        found = {}
+        for name in os.listdir(self.dir_name):
+            m = SEGMENT_RE.match(name)
+            if m is not None:
+                found.setdefault(int(m.group(1)), set()).add(m.group(2))
+        return found
+
+    def reload(self):
+        """Read the index entries appended since the last reload, e.g. by the writing process."""
+        try:
+            with open(os.path.join(self.dir_name, INDEX_NAME), 'rb') as r:
+                r.seek(self._index_pos)
+                for line in r:
+                    if not line.endswith(b'\n'):
+                        break  # being written
+                    self._index_pos += len(line)
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        self.logger.warning('Skipping broken index line %r', line)
+                        continue
+                    self.index.setdefault(entry['session'], []).append(entry)
+                    self.sealed.add(entry['segment'])
+        except IOError, e:
+            if e.errno != errno.ENOENT:
+                raise
+
+    def _open_active(self):
+        """Open the last unsealed segment for appending, finish its interrupted sealing or start a new one."""
+        segments = self.segments()
+        last = max(segments) if len(segments) > 0 else 0
+        self.active_segment = last + 1
+        if 'log' in segments.get(last, set()):
+            with open(self.path(last, 'log'), 'r+b') as f:  # cut a line torn by a crash
+                data = f.read()
+                f.truncate(data.rfind(b'\n') + 1)
+            if 'z' in segments[last] or last in self.sealed:
+                self._drop_index_entries(last)  # the sealing was interrupted, seal it again
+                self.active_segment = last
+                self.seal()
+                self.active_segment = last + 1
+            else:
+                self.active_segment = last
+        self.active = open(self.path(self.active_segment, 'log'), 'ab')
+
+    def _drop_index_entries(self, segment):
+        if segment not in self.sealed:
+            return
+        self.logger.warning('Dropping the index entries of the partially sealed segment %d', segment)
+        entries = [e for es in self.index.itervalues() for e in es if e['segment'] != segment]
+        entries.sort(key=lambda e: (e['segment'], e['offset']))
+        tmp = os.path.join(self.dir_name, INDEX_NAME + '.tmp')
+        with open(tmp, 'wb') as w:
+            w.write(b''.join(json.dumps(e, sort_keys=True).encode('utf-8') + b'\n' for e in entries))
+            w.flush()
+            os.fsync(w.fileno())
+        os.rename(tmp, os.path.join(self.dir_name, INDEX_NAME))
+        self.index, self.sealed, self._index_pos = {}, set(), 0
+        self.reload()
+
+    def append(self, data):
+        """Append encoded lines, see encode_line. The active segment is sealed once it is full."""
+        if self.active is None:
+            self._open_active()
+        self.active.write(data)
+        self.active.flush()
+        self.counts['appended_bytes'] += len(data)
+        if self.active.tell() >= self.segment_bytes:
+            self.seal()
+
+    def seal(self):
+        """Compress the active segment session by session, index it and start a new segment."""
+        if self.active_segment is None:
+            return
+        if self.active is not None:
+            os.fsync(self.active.fileno())
+            self.active.close()
+            self.active = None
+        plain = self.path(self.active_segment, 'log')
+        start = time.time()
+        with open(plain, 'rb') as r:
+            sessions = {}
+            order = []
+            for line in r:
+                session = decode_line(line)[1]
+                if session not in sessions:
+                    sessions[session] = []
+                    order.append(session)
+                sessions[session].append(line)
+        if len(order) == 0:
+            return  # nothing appended, keep appending to the segment
+
+        entries, tmp = [], self.path(self.active_segment, 'z.tmp')
+        with open(tmp, 'wb') as w:
+            for session in order:
+                lines = sessions[session]
+                blob = zlib.compress(b''.join(lines), self.compress_level)
+                entry = {'session': session, 'segment': self.active_segment, 'offset': w.tell(), 'length': len(blob)}
+                entry.update(session_meta(lines))
+                entries.append(entry)
+                w.write(blob)
+            w.flush()
+            os.fsync(w.fileno())
+            sealed_bytes = w.tell()
+        os.rename(tmp, self.path(self.active_segment, 'z'))
+        with open(os.path.join(self.dir_name, INDEX_NAME), 'ab') as w:
+            w.write(b''.join(json.dumps(e, sort_keys=True).encode('utf-8') + b'\n' for e in entries))
+            w.flush()
+            os.fsync(w.fileno())
+        os.remove(plain)
+        self.reload()
+        self.counts['sealed'] += 1
+        self.counts['sealed_bytes'] += sealed_bytes
+        metrics.observe('segment_seal_s', time.time() - start)
+        self.logger.info('Sealed segment %d: %d sessions, %d bytes', self.active_segment, len(order), sealed_bytes)
+        self.active_segment += 1
+
+    def _active_lines(self):
+        """Lines of the segments not sealed yet."""
+        for segment, exts in sorted(self.segments().iteritems()):
+            if 'log' not in exts or segment in self.sealed:
+                continue
+            try:
+                with open(self.path(segment, 'log'), 'rb') as r:
+                    for line in r:
+                        if line.endswith(b'\n'):
+                            yield line
+            except IOError, e:
+                if e.errno != errno.ENOENT:
+                    raise  # otherwise sealed meanwhile and read by the next reload
+
+    def read_entry(self, entry):
+        """Yield (level, msg) of the session of the index entry in its sealed segment."""
+        with open(self.path(entry['segment'], 'z'), 'rb') as r:
+            r.seek(entry['offset'])
+            data = zlib.decompress(r.read(entry['length']))
+        for line in data.splitlines(True):
+            level, _, msg = decode_line(line)
+            yield level, msg
+
+    def read_active(self):
+        """{session: [(level, msg)]} of the segments not sealed yet, reloading the index first."""
+        self.reload()
+        active = {}
+        for line in self._active_lines():
+            level, session, msg = decode_line(line)
+            active.setdefault(session, []).append((level, msg))
+        return active
+
+    def read(self, session, active=None):
+        """Yield (level, msg) of the session in the order of arrival, msg is the JSON text of the message.
+        Many sessions are read with the active segment scanned once by passing its read_active()."""
+        if active is None:
+            self.reload()
+        for entry in list(self.index.get(session, [])):
+            for level, msg in self.read_entry(entry):
+                yield level, msg
+        if active is not None:
+            for level, msg in active.get(session, ()):
+                yield level, msg
+            return
+        for line in self._active_lines():
+            level, s, msg = decode_line(line)
+            if s == session:
+                yield level, msg
+
+    def sessions(self):
+        """{session: {'start', 'end', 'turns', 'segments'}} of the sealed and the active segments,
+        None stands for the active segment in 'segments'."""
+        self.reload()
+        summary = {}
+
+        def merge(session, meta, segment):
+            s = summary.setdefault(session, {'start': None, 'end': None, 'turns': 0, 'segments': []})
+            for k, pick in [('start', min), ('end', max)]:
+                if meta[k] is not None:
+                    s[k] = meta[k] if s[k] is None else pick(s[k], meta[k])
+            s['turns'] += meta['turns']
+            if segment not in s['segments']:
+                s['segments'].append(segment)
+
+        for session, entries in self.index.iteritems():
+            for e in entries:
+                merge(session, e, e['segment'])
+        active = {}
+        for line in self._active_lines():
+            active.setdefault(decode_line(line)[1], []).append(line)
+        for session, lines in active.iteritems():
+            merge(session, session_meta(lines), None)
+        return summary
+
+    def stats(self):
+        s = {'sessions': len(self.index), 'sealed_segments': len(self.sealed), 'active_segment': self.active_segment,
+             'active_bytes': self.active.tell() if self.active is not None else 0}
+        s.update(self.counts)
+        return s
+
+    def close(self):
+        if self.active is not None:
+            self.active.flush()
+            os.fsync(self.active.fileno())
+            self.active.close()
+            self.active = None
+
+
+class SegmentStoreHandler(logging.Handler):
+    """Appends the ChatBot messages of all sessions to a SegmentStore.
+
+    The lines are buffered and appended once flush_bytes are pending or flush_interval seconds
+    passed since the last append, as by SessionHandler.
+    """
+    def __init__(self, store, flush_interval=1.0, flush_bytes=2 ** 16):
+        super(self.__class__, self).__init__()
+        self.store, self.flush_interval, self.flush_bytes = store, flush_interval, flush_bytes
+        self.pending, self.pending_bytes, self.last_flush = [], 0, time.time()
+        self.records, self.flush_latency = metrics.RateMeter(), metrics.Summary()
+        self.counts = {'records': 0, 'flushes': 0, 'bytes': 0}
+
+    def emit(self, record):
+        try:
+            session = getattr(record, 'session', None)  # set by log_from_subscriber
+            if session is None:
+                session = json.loads(record.msg)['session']
+            if record.levelno not in (logging.INFO, logging.WARNING):
+                raise ValueError("Unsupported logging level for ChatBot msgs!")
+            msg = record.msg if isinstance(record.msg, bytes) else record.msg.encode('utf-8')
+            line = encode_line(record.levelname, session, msg)
+            self.pending.append(line)
+            self.pending_bytes += len(line)
+            self.records.mark()
+            self.counts['records'] += 1
+            self.maybe_flush()
+        except Exception as e:
+            logging.exception(e)
+
+    def maybe_flush(self, now=None):
+        now = time.time() if now is None else now
+        if self.pending_bytes >= self.flush_bytes or now - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        self.acquire()
+        try:
+            start = time.time()
+            if self.pending_bytes > 0:
+                self.store.append(b''.join(self.pending))
+                self.flush_latency.observe(time.time() - start)
+                self.counts['flushes'] += 1
+                self.counts['bytes'] += self.pending_bytes
+            self.pending = []
+            self.pending_bytes, self.last_flush = 0, start
+        finally:
+            self.release()
+
+    def stats(self):
+        s = {'records_per_s': self.records.rate(),
+             'flush_latency_s': self.flush_latency.snapshot(),
+             'pending_bytes': self.pending_bytes,
+             'store': self.store.stats(), }
+        s.update(self.counts)
+        return s
+
+    def close(self):
+        self.acquire()
+        try:
+            self.flush()
+            self.store.close()
+        finally:
+            self.release()
+        super(self.__class__, self).close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('dir_name')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.add_parser('ls', help='Sessions with their start, end and number of turns')
+    cat = subparsers.add_parser('cat', help='Messages of a session as JSON lines')
+    cat.add_argument('session')
+    cat.add_argument('-l', '--level', choices=['INFO', 'WARNING'], help='Only dm_logic or input_output messages')
+    args = parser.parse_args()
+
+    store = SegmentStore(args.dir_name)
+    if args.command == 'ls':
+        for session, s in sorted(store.sessions().iteritems(), key=lambda (k, v): (v['start'], k)):
+            print json.dumps(dict(s, session=session), sort_keys=True)
+    else:
+        for level, msg in store.read(args.session):
+            if args.level is None or level == args.level:
+                print msg
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Supervisor of the ChatBotProcess children of the web process.
+
+Every interval seconds it
+    finalizes connectors whose greenlet died without finalize, so their bots are released,
+    reaps the exited children (multiprocessing.active_children joins them),
+    terminates live bots which belong to no connector and to no pool (orphans) at two checks in a row,
+    recycles bots over the RSS or turn limits: the dialogue moves through a checkpoint to a fresh bot
+    and the old process is terminated, so the memory a long dialogue leaves behind is returned.
+
+Sessions of ChatBotHostProcess hosts are not recycled, their memory is bounded by the host capacity.
+Bots forked by ChatBotZygote are children of the zygote, which reaps them.
+"""
+from __future__ import unicode_literals
+import logging
+import multiprocessing
+import gevent
+from cbot.bot.connectors import ChatBotProcess
+from cbot.bot.pool import ChatBotPool
+from cbot.bot.proc import rss_bytes
+import cbot.bot.metrics as metrics
+
+
+class ChatBotSupervisor(object):
+    def __init__(self, hub, pool=None, max_rss_bytes=None, max_turns=None, interval=5.0):
+        """
+        hub: ConnectorHub of the dialogues
+        pool: ChatBotPool whose idle, starting and resetting bots are not orphans
+        max_rss_bytes, max_turns: limits of a bot process, None for no limit
+        """
+        self.hub, self.max_rss_bytes, self.max_turns, self.interval = hub, max_rss_bytes, max_turns, interval
+        self.pool_owns = pool.owns if isinstance(pool, ChatBotPool) else lambda name: False
+        self.logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
+        self.children = set()  # names of the children alive at the last check
+        self.suspects = set()  # names of the orphans of the last check
+        self.recycling = set()  # names of the bots being recycled
+        self.live = 0
+        self.counts = {'zombies_reaped': 0, 'orphans_killed': 0, 'dead_connectors': 0,
+                       'recycled': 0, 'recycle_failed': 0}
+        self._greenlets = [gevent.spawn(self._supervise)]
+
+    def _supervise(self):
+        while True:
+            gevent.sleep(self.interval)
+            try:
+                self.check()
+            except Exception as e:
+                self.logger.exception(e)
+
+    def over_limit(self, connector):
+        """Return the name of the exceeded limit or None."""
+        pid = getattr(connector.bot, 'pid', None)
+        if pid is None:
+            return None  # hosted session or not started yet
+        if self.max_turns is not None and connector.turns >= self.max_turns:
+            return 'turns'
+        if self.max_rss_bytes is not None:
+            try:
+                if rss_bytes(pid) > self.max_rss_bytes:
+                    return 'rss'
+            except IOError:
+                pass  # exited meanwhile, reaped by the next check
+        return None
+
+    def check(self):
+        for name, c in self.hub.connectors.items():
+            if c.ready():  # the greenlet died, finalize unregisters the connectors which ended normally
+                self.logger.warning('Connector of %s died without finalize', name)
+                self.counts['dead_connectors'] += 1
+                c.finalize()
+
+        children = dict((p.name, p) for p in multiprocessing.active_children() if isinstance(p, ChatBotProcess))
+        reaped = len(self.children - set(children))
+        self.counts['zombies_reaped'] += reaped
+        metrics.incr('zombies_reaped', reaped)
+        self.children = set(children)
+
+        # a connector is not registered for a moment between the release and the termination of its bot
+        orphans = set(n for n in children if n not in self.hub.connectors and not self.pool_owns(n))
+        for name in orphans & self.suspects:
+            self.logger.warning('Terminating ChatBot %s without a dialogue', name)
+            self.hub.send('die', name, 'die')
+            children[name].terminate()
+            self.counts['orphans_killed'] += 1
+            metrics.incr('orphans_killed')
+        self.suspects = orphans - self.suspects
+        self.live = len(children) - len(orphans)
+
+        for name, c in self.hub.connectors.items():
+            if name in self.recycling:
+                continue
+            limit = self.over_limit(c)
+            if limit is not None:
+                self.logger.info('Recycling ChatBot %s over the %s limit', name, limit)
+                self.recycling.add(name)
+                gevent.spawn(self._recycle, c, name)
+
+    def _recycle(self, connector, name):
+        try:
+            if connector.recycle():
+                self.counts['recycled'] += 1
+                metrics.incr('recycled')
+            else:
+                self.counts['recycle_failed'] += 1
+        finally:
+            self.recycling.discard(name)
+
+    def stats(self):
+        s = {'live': self.live,
+             'orphans': len(self.suspects),
+             'recycling': len(self.recycling),
+             'max_rss_bytes': self.max_rss_bytes,
+             'max_turns': self.max_turns, }
+        s.update(self.counts)
+        return s
+
+    def shutdown(self):
+        gevent.killall(self._greenlets)
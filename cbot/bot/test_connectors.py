@@ -9,8 +9,10 @@ import time
 import random
 import gevent
 from cbot.bot.alias import HUMAN
-from cbot.bot.connectors import ChatBotProcess, ChatBotConnector, forwarder_device_start, ChatBot
+from cbot.bot.connectors import ChatBotProcess, ChatBotConnector, ChatBot, ConnectorHub
+from cbot.bot.fixtures import EndpointsTestCase, free_ports
 from cbot.bot.log import connect_logger, wrap_msg, chatbot2file_log_loop
+from cbot.bot.transport import InProcEndpoints
 import datetime
 import sys
 import zmq
@@ -18,13 +20,14 @@ import zmq
 
 class LoggerTest(unittest.TestCase):
     def test_process_zmq_logger(self):
-        log_process = Process(target=chatbot2file_log_loop)
+        address = 'tcp://127.0.0.1:%d' % free_ports(1)[0]
+        log_process = Process(target=chatbot2file_log_loop, args=(address,))
         log_process.start()
 
         ctx = zmq.Context()
         unique_name_for_msg_logger = self.__class__.__name__ + '1234'
         session_id = '1234'
-        connect_logger(unique_name_for_msg_logger, session_id, ctx)
+        connect_logger(unique_name_for_msg_logger, session_id, ctx, address)
         logger = logging.getLogger(unique_name_for_msg_logger)
         time.sleep(0.2)
         logger.info(json.dumps(wrap_msg('Info test')))
@@ -32,33 +35,23 @@ class LoggerTest(unittest.TestCase):
         logger.warning('{"name": "test"}')
         # self.assertRaises(ValueError, logger.debug, json.dumps(wrap_msg('debug')))  # FIXME test that exception raised in another process
 
-        log_process.join(0.1)  # TODO send message to exit the logger
         log_process.terminate()
+        log_process.join(10.0)
 
 
-class ChatBotConnectorTest(unittest.TestCase):
+class ChatBotConnectorTest(EndpointsTestCase):
     def setUp(self):
-        self.logger_process = Process(target=chatbot2file_log_loop)
-        self.logger_process.start()
+        super(ChatBotConnectorTest, self).setUp()
         self.msg = None
 
         def receive(m, name):
             self.msg = m
 
         self.callback = receive
-        self.bot_front, self.bot_back, self.user_front, self.user_back = 10001, 10002, 10003, 10004
-        self.user_device = forwarder_device_start(self.user_front, self.user_back)
-        self.bot_device = forwarder_device_start(self.bot_front, self.bot_back)
-        time.sleep(2.0)
-
-    def tearDown(self):
-        self.user_device.join(0.1)
-        self.bot_device.join(0.1)
-        self.logger_process.terminate()
 
     def test_chatbot_loop(self, interval=0.01, attempts=10):
         log = logging.getLogger(__name__ + '.' + self.__class__.__name__)
-        c = ChatBotConnector(self.callback, self.bot_front, self.bot_back, self.user_front, self.user_back)
+        c = ChatBotConnector(self.callback, self.endpoints)
         c.start()
         log.debug('sending msg')
         self.assertIsNone(self.msg)
@@ -74,6 +67,27 @@ class ChatBotConnectorTest(unittest.TestCase):
         c.kill()
 
 
+
+class ConnectorHubTest(unittest.TestCase):
+    def test_broken_message(self):
+        endpoints = InProcEndpoints()
+        hub, bot = ConnectorHub(endpoints), endpoints.bot(None, 'bot')
+        delivered = []
+
+        class Connector(object):
+            name = 'bot'
+
+            def deliver(self, signal, payload):
+                delivered.append(payload)
+
+        hub.register(Connector())
+        bot.send('stat', 'bot', 'not a dict')
+        bot.send(None, 'bot', wrap_msg('hi'))
+        gevent.sleep(0.1)
+        self.assertEqual([m['utterance'] for m in delivered], ['hi'])  # the dispatcher survived
+        self.assertEqual((hub.stats()['errors'], hub.stats()['dispatched']), (1, 1))
+        hub.close()
+
 class ChatBotOneAnswerTest(unittest.TestCase):
     def setUp(self):
         self.logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# encoding: utf-8
+from __future__ import unicode_literals, division
+import unittest
+import gevent
+from cbot.bot.connectors import ChatBotConnector
+from cbot.bot.fixtures import EndpointsTestCase
+from cbot.bot.fleet import HashRing, ChatBotFleet, start_hosts
+from cbot.bot.log import wrap_msg
+import cbot.bot.metrics as metrics
+
+
+class HashRingTest(unittest.TestCase):
+    def test_placement(self):
+        ring = HashRing()
+        self.assertIsNone(ring.node('1'))
+        for n in ['a', 'b', 'c']:
+            ring.add(n)
+        self.assertEqual(len(ring), 3)
+        self.assertEqual(sorted(ring.nodes('1')), ['a', 'b', 'c'])
+        self.assertEqual(ring.node('1'), next(ring.nodes('1')))
+        placed = [ring.node(str(k)) for k in range(3000)]
+        self.assertTrue(all(placed.count(n) > 600 for n in ['a', 'b', 'c']))
+
+    def test_minimal_movement(self):
+        ring = HashRing()
+        for n in ['a', 'b', 'c']:
+            ring.add(n)
+        before = dict((k, ring.node(str(k))) for k in range(1000))
+        ring.remove('c')
+        self.assertNotIn('c', ring)
+        moved = [k for k in before if ring.node(str(k)) != before[k]]
+        self.assertTrue(all(before[k] == 'c' for k in moved))
+        ring.add('c')
+        self.assertEqual(before, dict((k, ring.node(str(k))) for k in range(1000)))
+
+
+class ChatBotFleetTest(EndpointsTestCase):
+    def setUp(self):
+        super(ChatBotFleetTest, self).setUp()
+        # two local host processes stand in for two machines
+        self.hosts = start_hosts(self.endpoints, 2, capacity=2, register_interval=0.2)
+        self.fleet = ChatBotFleet(self.endpoints, host_timeout=1.0, poll_interval=0.2)
+        for _ in range(300):
+            if self.fleet.stats()['hosts'] == 2:
+                break
+            gevent.sleep(0.1)
+
+    def tearDown(self):
+        self.fleet.shutdown()
+        for h in self.hosts:
+            h.terminate()
+            h.join(1.0)
+        super(ChatBotFleetTest, self).tearDown()
+
+    def test_hash_placement(self):
+        self.assertEqual(sorted(self.fleet.bot_names()), sorted(h.name for h in self.hosts))
+        bot = self.fleet.lease()
+        self.assertEqual(bot.host.name, self.fleet.ring.node(bot.name.split('.', 1)[1]))
+        bots = [self.fleet.lease() for _ in range(3)]
+        self.assertTrue(all(b is not None for b in bots))
+        self.assertEqual(sorted(self.fleet.stats()['sessions'].values()), [2, 2])
+        self.assertIsNone(self.fleet.lease())  # capacity of both hosts used
+        self.fleet.release(bot)
+        self.assertIsNotNone(self.fleet.lease())
+
+    def test_reassign_on_host_failure(self):
+        replies = []
+        c = ChatBotConnector(lambda m, room: replies.append((room, m)), self.endpoints, pool=self.fleet)
+        c.start()
+        self.assertTrue(c.initialized.get())
+        c.send(wrap_msg('hi'))
+        host, session, room = c.bot.host.name, c.session, c.room
+        for _ in range(500):
+            if len(replies) == 1:
+                break
+            gevent.sleep(0.01)
+        [h.terminate() for h in self.hosts if h.name == host]
+        for _ in range(50):
+            if host not in self.fleet.bot_names():
+                break
+            gevent.sleep(0.1)
+        reassigned = metrics.counters['reassigned']
+        c.send(wrap_msg('hi again'))
+        self.assertEqual(metrics.counters['reassigned'], reassigned + 1)
+        self.assertNotEqual(c.bot.host.name, host)
+        for _ in range(500):
+            if len(replies) == 2:
+                break
+            gevent.sleep(0.01)
+        self.assertEqual([r for r, _ in replies], [room, room])
+        self.assertEqual([m['session'] for _, m in replies], [session, c.session])
+        c.kill()
+
+
+class ChatBotFleetRouterTest(ChatBotFleetTest):
+    transport = 'router'
+
+
+if __name__ == '__main__':
+    unittest.main()
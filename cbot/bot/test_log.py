@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+# encoding: utf-8
+from __future__ import unicode_literals
+from multiprocessing import Process
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+import unittest
+import zmq
+from cbot.bot.fixtures import free_ports
+from cbot.bot.log import SessionHandler, ChatBotPUBHandler, log_from_subscriber, ChatBotJsonEncoder
+from cbot.bot.log import BeliefStateWriter, BeliefStateReader, state_delta, apply_delta
+from cbot.bot.log import PublisherGaps, chatbot2file_log_loop
+from cbot.bot.store import SegmentStore
+from cbot.dm.actions import Hello
+
+
+def record(session, utterance, level=logging.WARNING):
+    msg = json.dumps({'session': session, 'name': 'human', 'utterance': utterance, 'time': 0.0})
+    return logging.LogRecord('test', level, __file__, 0, msg, (), None)
+
+
+class SessionHandlerTest(unittest.TestCase):
+    def setUp(self):
+        self.dir_name = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir_name)
+
+    def lines(self, log_file):
+        path = os.path.join(self.dir_name, 'logs', log_file)
+        if not os.path.exists(path):
+            return []
+        with open(path, 'rb') as r:
+            return [json.loads(line)['utterance'] for line in r]
+
+    def test_buffered_until_threshold(self):
+        handler = SessionHandler(self.dir_name, flush_interval=3600, flush_bytes=1000)
+        handler.handle(record('1', 'hi'))
+        handler.handle(record('1', 'ahoj', logging.INFO))
+        self.assertEqual(self.lines('1input_output.log'), [])
+        handler.maybe_flush()
+        self.assertEqual(self.lines('1input_output.log'), [])
+        handler.maybe_flush(now=handler.last_flush + 3600)
+        self.assertEqual(self.lines('1input_output.log'), ['hi'])
+        self.assertEqual(self.lines('1dm_logic.log'), ['ahoj'])
+        for i in range(20):
+            handler.handle(record('1', 'x' * 50))
+        written = len(self.lines('1input_output.log')) - 1
+        self.assertTrue(0 < written < 20)  # written once 1000 bytes were pending
+        self.assertLess(handler.pending_bytes, 1000)
+        handler.close()
+        self.assertEqual(len(self.lines('1input_output.log')), 1 + 20)
+        self.assertEqual(handler.stats()['records'], 22)
+
+    def test_lru_of_open_files(self):
+        handler = SessionHandler(self.dir_name, max_open=2, flush_bytes=0)
+        synced, fsync = [], os.fsync
+        os.fsync = lambda fd: synced.append(fd) or fsync(fd)
+        try:
+            for turn in range(3):
+                for session in ['1', '2', '3']:
+                    handler.handle(record(session, 'turn %d' % turn))
+        finally:
+            os.fsync = fsync
+        self.assertEqual(len(synced), 7)  # every evicted file
+        self.assertEqual(handler.stats()['open_files'], 2)
+        self.assertEqual(list(handler.files), ['2input_output.log', '3input_output.log'])
+        self.assertEqual(handler.counts['evicted'], 7)
+        handler.close()
+        self.assertEqual(handler.stats()['open_files'], 0)
+        for session in ['1', '2', '3']:
+            self.assertEqual(self.lines(session + 'input_output.log'), ['turn 0', 'turn 1', 'turn 2'])
+
+    def test_unsupported_level(self):
+        handler = SessionHandler(self.dir_name)
+        logging.disable(logging.CRITICAL)  # the handler logs the exception
+        handler.handle(record('1', 'hi', logging.ERROR))
+        logging.disable(logging.NOTSET)
+        handler.close()
+        self.assertEqual(handler.counts['flushes'], 0)
+
+
+class ChatBotPUBHandlerTest(unittest.TestCase):
+    def setUp(self):
+        self.dir_name = tempfile.mkdtemp()
+        ctx = zmq.Context.instance()
+        self.pub, self.sub = ctx.socket(zmq.PAIR), ctx.socket(zmq.PAIR)
+        self.sub.bind('inproc://test_log')
+        self.pub.connect('inproc://test_log')
+        self.bot_logger = logging.getLogger('test_log.bot')
+        self.sink_logger = logging.getLogger('test_log.sink')
+        for logger in [self.bot_logger, self.sink_logger]:
+            logger.propagate, logger.handlers = False, []
+            logger.setLevel(logging.DEBUG)
+        self.handler = SessionHandler(self.dir_name, flush_bytes=0)
+        self.sink_logger.addHandler(self.handler)
+        logging.getLogger('cbot.bot.log').disabled = True  # the console echo of the sink
+
+    def tearDown(self):
+        logging.getLogger('cbot.bot.log').disabled = False
+        self.handler.close()
+        self.pub.close()
+        self.sub.close()
+        shutil.rmtree(self.dir_name)
+
+    def lines(self, log_file):
+        with open(os.path.join(self.dir_name, 'logs', log_file), 'rb') as r:
+            return r.read().splitlines()
+
+    def test_dicts_serialized_once(self):
+        self.bot_logger.addHandler(ChatBotPUBHandler(self.pub, '7'))
+        human = {'name': 'human', 'utterance': 'hi'}
+        self.bot_logger.warning(human)
+        self.assertNotIn('session', human)  # the logged dict is not changed
+        self.bot_logger.info({'name': 'belief_state', 'attributes': {'system_actions': {Hello: Hello('chat_bot')}}})
+        self.bot_logger.warning('{"name": "chat_bot", "utterance": "Hi!"}')  # JSON text is accepted too
+        for _ in range(3):
+            log_from_subscriber(self.sub, self.sink_logger)
+        io = self.lines('7input_output.log')
+        self.assertEqual(io[0], '{"name":"human","session":"7","utterance":"hi"}')
+        self.assertEqual(json.loads(io[1])['utterance'], 'Hi!')
+        state = json.loads(self.lines('7dm_logic.log')[0])
+        self.assertEqual(list(state['attributes']['system_actions']), ["<class 'cbot.dm.actions.Hello'>"])
+
+    def test_validation(self):
+        self.bot_logger.addHandler(ChatBotPUBHandler(self.pub, '7', validate_rate=1.0))
+        self.assertRaises(Exception, self.bot_logger.warning, {'utterance': 'no name'})
+        self.pub.send_multipart([b'WARNING.7', b'{"utterance": "no name", "session": "7"}'])
+        logging.disable(logging.CRITICAL)  # the dropped message is logged
+        log_from_subscriber(self.sub, self.sink_logger, validate_rate=1.0)
+        logging.disable(logging.NOTSET)
+        self.assertEqual(self.handler.counts['records'], 0)
+
+
+class ShardedLogTest(unittest.TestCase):
+    def setUp(self):
+        self.dir_name = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir_name)
+
+    def test_publisher_gaps(self):
+        gaps = PublisherGaps(max_publishers=2)
+        for publisher, seq in [(b'a', 1), (b'a', 2), (b'b', 5), (b'a', 5), (b'c', 1), (b'b', 9)]:
+            gaps.observe([b'WARNING.1', b'{}', b'%s %d' % (publisher, seq)])
+        gaps.observe([b'WARNING.1', b'{}'])
+        self.assertEqual(gaps.dropped, 2)  # b was forgotten
+        self.assertEqual(list(gaps.last), [b'c', b'b'])
+
+    def test_sessions_in_order_per_shard(self):
+        store_dir = os.path.join(self.dir_name, 'store')
+        address = 'tcp://127.0.0.1:%d' % free_ports(1)[0]
+        sink = Process(target=chatbot2file_log_loop,
+                       kwargs={'address': address, 'workers': 3, 'store_dir': store_dir, 'flush_interval': 0.1,
+                               'log_name': os.path.join(self.dir_name, 'all.log')})
+        sink.start()
+        pub = zmq.Context.instance().socket(zmq.PUB)
+        pub.connect(address)
+        time.sleep(1.0)
+        handler = ChatBotPUBHandler(pub, None)
+        logger = logging.getLogger('test_log.sharded')
+        logger.propagate, logger.handlers = False, [handler]
+        logger.setLevel(logging.DEBUG)
+        sessions = ['s%d' % i for i in range(12)]
+        for turn in range(20):
+            for session in sessions:
+                handler.session = session
+                logger.warning({'name': 'human', 'utterance': '%d' % turn, 'time': turn})
+        time.sleep(1.0)
+        sink.terminate()
+        sink.join(10.0)
+        pub.close()
+
+        shards = sorted(os.listdir(store_dir))
+        self.assertEqual(shards, ['shard-0', 'shard-1', 'shard-2'])
+        found = {}
+        for shard in shards:
+            store = SegmentStore(os.path.join(store_dir, shard))
+            for session, summary in store.sessions().iteritems():
+                self.assertNotIn(session, found)
+                found[session] = [json.loads(msg)['utterance'] for _, msg in store.read(session)]
+                self.assertEqual(summary['turns'], 20)
+        self.assertEqual(sorted(found), sorted(sessions))
+        self.assertTrue(all(u == ['%d' % t for t in range(20)] for u in found.values()))
+        self.assertEqual(len([f for f in os.listdir(self.dir_name) if f.startswith('all-')]), 3)
+
+
+class BeliefStateDeltaTest(unittest.TestCase):
+    def states(self):
+        actions = {}
+        for i in range(25):
+            actions[Hello] = Hello('chat_bot', args={'turn': i // 3})
+            if i == 20:
+                del actions[Hello]
+            yield {'name': 'belief_state',
+                   'attributes': {'current_user_utterance': 'turn %d' % (i // 2), 'system_actions': dict(actions),
+                                  'mentions': {'Richard': i // 5, 'Prague': 1}}}
+
+    def test_delta(self):
+        old = {'a': 1, 'b': {'c': [1, 2], 'd': None}, 'e': 'x'}
+        new = {'a': 1, 'b': {'c': [1, 2, 3]}, 'f': {'g': 1}}
+        patch = state_delta(old, new)
+        self.assertNotIn('a', patch)
+        self.assertEqual(apply_delta(old, patch), new)
+        self.assertEqual(apply_delta(old, json.loads(json.dumps(patch))), new)
+        self.assertEqual(state_delta(new, new), {})
+
+    def test_reconstruct_every_turn(self):
+        writer, reader, full = BeliefStateWriter(snapshot_interval=10), BeliefStateReader(), BeliefStateWriter()
+        logged = []
+        for state in self.states():
+            logged_record = json.loads(json.dumps(writer.record(state), cls=ChatBotJsonEncoder))
+            expected = json.loads(json.dumps(full.record(state), cls=ChatBotJsonEncoder))
+            logged.append(logged_record)
+            self.assertEqual(reader.full(logged_record)['attributes'], expected['attributes'])
+        self.assertEqual([r['turn'] for r in logged if r['snapshot']], [0, 10, 20])
+        self.assertLess(len(json.dumps(logged[5])), len(json.dumps(logged[10])))
+        self.assertEqual(logged[1]['attributes'], 'EmptyDict')  # a new Hello object with the same args
+        self.assertIn('system_actions', logged[3]['attributes'])
+        self.assertRaises(ValueError, BeliefStateReader().full, logged[5])  # a delta without its snapshot
+
+    def test_empty_attributes(self):
+        writer, reader = BeliefStateWriter(snapshot_interval=10), BeliefStateReader()
+        for attributes in [{}, {}, {'a': 1}, {}, {'a': 1}]:
+            record = writer.record({'name': 'belief_state', 'attributes': attributes})
+            logged = json.loads(json.dumps(record, cls=ChatBotJsonEncoder))
+            self.assertEqual(reader.full(logged)['attributes'], attributes or 'EmptyDict')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+# encoding: utf-8
+from __future__ import unicode_literals
+import unittest
+import cbot.bot.metrics as metrics
+
+
+class MetricsTest(unittest.TestCase):
+    def setUp(self):
+        metrics.reset()
+
+    def test_counters(self):
+        metrics.incr('failed')
+        metrics.incr('failed', 2)
+        self.assertEqual(metrics.snapshot()['failed'], 3)
+
+    def test_summary(self):
+        for i in range(1, 101):
+            metrics.observe('latency', i / 100.0)
+        s = metrics.snapshot()['latency']
+        self.assertEqual(s['count'], 100)
+        self.assertEqual(s['min'], 0.01)
+        self.assertEqual(s['max'], 1.0)
+        self.assertAlmostEqual(s['mean'], 0.505)
+        self.assertEqual(s['p50'], 0.51)
+        self.assertEqual(s['p99'], 1.0)
+
+    def test_window(self):
+        summary = metrics.Summary(window=2)
+        for v in [10, 1, 2]:
+            summary.observe(v)
+        self.assertEqual(summary.snapshot()['max'], 10)
+        self.assertEqual(summary.percentile(99), 2)
+
+    def test_rate(self):
+        meter = metrics.RateMeter(window=10.0)
+        for t in range(20):
+            meter.mark(now=t)
+        self.assertEqual(meter.count, 20)
+        self.assertAlmostEqual(meter.rate(now=19.5), 1.0)  # 10 - 19 in the window
+        self.assertEqual(meter.rate(now=100), 0.0)
+
+    def test_rate_memory(self):
+        meter = metrics.RateMeter(window=10.0)
+        for i in range(10000):
+            meter.mark(now=i / 100.0)
+        self.assertLessEqual(len(meter.seconds), 11)  # trimmed without asking for the rate
+        self.assertAlmostEqual(meter.rate(now=100.0), 10 * 100 / 10.0)
+
+    def test_aggregate_stats(self):
+        s = metrics.aggregate_stats({'1': {'sessions': 1, 'history_len': 4, 'queue_depth': 0, 'rss_bytes': 10},
+                                     '2': {'sessions': 3, 'history_len': 2, 'queue_depth': 5, 'rss_bytes': 20}})
+        self.assertEqual(s['bots'], 2)
+        self.assertEqual(s['sessions'], 4)
+        self.assertEqual(s['history_len'], 6)
+        self.assertEqual(s['queue_depth_max'], 5)
+        self.assertEqual(s['rss_bytes'], 30)
+        self.assertEqual(s['rss_bytes_per_bot'], {'1': 10, '2': 20})
+        self.assertEqual(metrics.aggregate_stats({})['sessions'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,239 @@
+#!/usr/bin/env python
+# encoding: utf-8
+from __future__ import unicode_literals, division
+import unittest
+import time
+import gevent
+from cbot.bot.connectors import ChatBotConnector, ConnectorHub
+from cbot.bot.fixtures import EndpointsTestCase
+from cbot.bot.log import wrap_msg
+import cbot.bot.metrics as metrics
+from cbot.bot.pool import ChatBotPool, ChatBotHostPool
+
+
+class ChatBotPoolTest(EndpointsTestCase):
+    def setUp(self):
+        super(ChatBotPoolTest, self).setUp()
+        self.pool = ChatBotPool(self.endpoints, min_size=1, max_size=2, spare=0)
+
+    def tearDown(self):
+        self.pool.shutdown()
+        super(ChatBotPoolTest, self).tearDown()
+
+    def test_lease_release(self):
+        bot = self.pool.lease(timeout=30.0)
+        self.assertIsNotNone(bot)
+        self.assertEqual(self.pool.stats()['leased'], 1)
+        first_session = bot.session
+        self.pool.release(bot)
+        bot2 = self.pool.lease(timeout=30.0)
+        self.assertEqual(bot.name, bot2.name)  # the only bot was reused
+        self.assertNotEqual(first_session, bot2.session)
+        self.pool.release(bot2)
+
+    def test_max_size(self):
+        bots = [self.pool.lease(timeout=30.0) for _ in range(2)]
+        self.assertTrue(all(b is not None for b in bots))
+        self.assertIsNone(self.pool.lease(timeout=0.5))
+        self.assertEqual(self.pool.stats()['timeouts'], 1)
+        for b in bots:
+            self.pool.release(b)
+
+    def test_stale_reset_reply(self):
+        bot = self.pool.lease(timeout=30.0)
+        del self.pool.leased[bot.name]
+        self.pool.resetting[bot.name] = (bot, 'expected', time.time() + 30.0)
+        self.pool.transport.send('reset', bot.name, 'stale')  # the reply is another session than the pool waits for
+        for _ in range(100):
+            if self.pool.stats()['failed'] == 1:
+                break
+            gevent.sleep(0.05)
+        self.assertEqual(self.pool.stats()['retired'], 1)
+        self.assertIsNotNone(self.pool.lease(timeout=30.0))  # the listener survived
+
+    def test_connector_pool_exhausted(self):
+        metrics.reset()
+        bots = [self.pool.lease(timeout=30.0) for _ in range(2)]
+        start = time.time()
+        c = ChatBotConnector(lambda m, room: None, self.endpoints, pool=self.pool, ready_timeout=0.5)
+        self.assertFalse(c.initialized.get())
+        self.assertLess(time.time() - start, 5.0)
+        self.assertEqual(metrics.snapshot()['pool_exhausted'], 1)
+        for b in bots:
+            self.pool.release(b)
+
+    def test_connector_from_pool(self):
+        metrics.reset()
+        replies = []
+        c = ChatBotConnector(lambda m, name: replies.append(m), self.endpoints, pool=self.pool)
+        c.start()
+        self.assertTrue(c.initialized.get())
+        c.send(wrap_msg('hi'))
+        for _ in range(100):
+            if len(replies) > 0:
+                break
+            gevent.sleep(0.01)
+        self.assertTrue(len(replies) > 0)
+        self.assertEqual(replies[0]['session'], c.session)
+        c.kill()
+        self.assertEqual(self.pool.stats()['leased'], 0)
+        self.assertEqual(metrics.snapshot()['handshake_latency_s']['count'], 1)
+
+    def test_room_per_dialogue(self):
+        first = ChatBotConnector(lambda m, room: None, self.endpoints, pool=self.pool)
+        self.assertTrue(first.initialized.get())
+        name, room = first.name, first.room
+        first.kill()
+        second = ChatBotConnector(lambda m, room: None, self.endpoints, pool=self.pool)
+        self.assertTrue(second.initialized.get())
+        self.assertEqual(second.name, name)  # the reset bot is reused
+        self.assertNotEqual(second.room, room)
+        second.kill()
+
+    def test_shared_hub(self):
+        hub = ConnectorHub(self.endpoints)
+        replies = {}
+        connectors = [ChatBotConnector(lambda m, room: replies.setdefault(room, []).append(m), self.endpoints,
+                                       pool=self.pool, hub=hub) for _ in range(2)]
+        self.assertEqual(hub.stats()['connectors'], 2)
+        for i, c in enumerate(connectors):
+            c.start()
+            self.assertTrue(c.initialized.get())
+            c.send(wrap_msg('hi %d' % i))
+        for _ in range(100):
+            if len(replies) == 2:
+                break
+            gevent.sleep(0.01)
+        self.assertEqual(sorted(replies), sorted(c.room for c in connectors))
+        self.assertNotEqual(connectors[0].session, connectors[1].session)
+        for c in connectors:  # each connector got the replies of its own bot only
+            self.assertEqual(set(r['session'] for r in replies[c.room]), {c.session})
+            c.kill()
+        self.assertEqual(hub.stats()['connectors'], 0)
+        hub.close()
+
+    def test_request_stats(self):
+        hub = ConnectorHub(self.endpoints)
+        c = ChatBotConnector(lambda m, name: None, self.endpoints, pool=self.pool, hub=hub)
+        c.start()
+        self.assertTrue(c.initialized.get())
+        stats = hub.request_stats(self.pool.bot_names())
+        self.assertEqual(stats[c.name]['session'], c.session)
+        self.assertGreater(stats[c.name]['rss_bytes'], 0)
+        self.assertEqual(hub.request_stats(['123'], timeout=0.2), {})
+        self.assertEqual(hub.stat_requests, {})
+        c.kill()
+        hub.close()
+
+    def test_hibernate(self):
+        metrics.reset()
+        replies = []
+        c = ChatBotConnector(lambda m, room: replies.append((room, m)), self.endpoints, pool=self.pool,
+                             idle_timeout=0.5)
+        c.start()
+        self.assertTrue(c.initialized.get())
+        session, room = c.session, c.room
+        gevent.sleep(1.5)
+        self.assertTrue(c.hibernated)
+        self.assertEqual(self.pool.stats()['leased'], 0)
+        c.send(wrap_msg('hi'))
+        self.assertFalse(c.hibernated)
+        for _ in range(100):
+            if len(replies) > 0:
+                break
+            gevent.sleep(0.01)
+        self.assertEqual(replies[0][0], room)
+        self.assertEqual(replies[0][1]['session'], session)
+        m = metrics.snapshot()
+        self.assertEqual((m['hibernated'], m['rehydrated'], m['sessions_hibernated']), (1, 1, 0))
+        self.assertGreater(m['checkpoint_bytes']['min'], 0)
+        c.kill()
+        self.assertEqual(self.pool.stats()['leased'], 0)
+
+    def test_start_latency(self):
+        self.assertIsNotNone(self.pool.lease(timeout=30.0))
+        self.assertGreater(metrics.snapshot()['pool_start_latency_s']['count'], 0)
+
+
+class ChatBotHostPoolTest(EndpointsTestCase):
+    def setUp(self):
+        super(ChatBotHostPoolTest, self).setUp()
+        self.pool = ChatBotHostPool(self.endpoints, hosts=2, max_sessions=2)
+
+    def tearDown(self):
+        self.pool.shutdown()
+        super(ChatBotHostPoolTest, self).tearDown()
+
+    def test_sessions_spread_over_hosts(self):
+        self.pool.lease(timeout=30.0)
+        gevent.sleep(1.0)  # let the other host start too
+        bots = [self.pool.lease() for _ in range(3)]
+        self.assertTrue(all(b is not None for b in bots))
+        self.assertEqual(sorted(self.pool.stats()['sessions'].values()), [2, 2])
+        self.assertIsNone(self.pool.lease())
+
+    def test_request_stats(self):
+        hub = ConnectorHub(self.endpoints)
+        bots = [self.pool.lease(timeout=30.0) for _ in range(2)]
+        stats = hub.request_stats(self.pool.bot_names())
+        self.assertEqual(sum(s['sessions'] for s in stats.values()), 0)  # no message sent yet
+        stats = hub.request_stats([b.name for b in bots])
+        self.assertEqual(sorted(stats.keys()), sorted(b.name for b in bots))
+        self.assertEqual(stats[bots[0].name]['session'], bots[0].name)
+        hub.close()
+
+    def test_connectors_share_host(self):
+        replies = {}
+        connectors = []
+        for _ in range(2):
+            c = ChatBotConnector(lambda m, room: replies.setdefault(room, []).append(m), self.endpoints,
+                                 pool=self.pool)
+            c.start()
+            self.assertTrue(c.initialized.get())
+            connectors.append(c)
+        for c in connectors:
+            c.send(wrap_msg('hi'))
+        for _ in range(100):
+            if len(replies) == 2:
+                break
+            gevent.sleep(0.01)
+        for c in connectors:
+            self.assertEqual(replies[c.room][0]['session'], c.session)
+            c.kill()
+        self.assertEqual(self.pool.stats()['leased'], 0)
+
+    def test_hibernate(self):
+        hub, replies = ConnectorHub(self.endpoints), []
+        c = ChatBotConnector(lambda m, room: replies.append(m), self.endpoints, pool=self.pool, hub=hub,
+                             idle_timeout=0.5)
+        c.start()
+        self.assertTrue(c.initialized.get())
+        c.send(wrap_msg('hi'))
+        host, session = c.bot.host.name, c.session
+        gevent.sleep(1.5)
+        self.assertTrue(c.hibernated)
+        self.assertEqual(hub.request_stats([host])[host]['sessions'], 0)  # the host dropped the dialogue
+        c.send(wrap_msg('hi again'))
+        for _ in range(100):
+            if len(replies) == 2:
+                break
+            gevent.sleep(0.01)
+        self.assertEqual([r['session'] for r in replies], [session, session])
+        c.kill()
+        hub.close()
+
+
+class ChatBotPoolRouterTest(ChatBotPoolTest):
+    transport = 'router'
+
+
+class ChatBotHostPoolRouterTest(ChatBotHostPoolTest):
+    transport = 'router'
+
+
+class ChatBotHostPoolInProcTest(ChatBotHostPoolTest):
+    transport = 'inproc'
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,26 @@
+#!/usr/bin/env python
+# encoding: utf-8
+from __future__ import unicode_literals
+import os
+import unittest
+from multiprocessing import Process
+from cbot.bot.proc import is_running, rss_bytes, uss_bytes, cpu_seconds
+
+
+class ProcTest(unittest.TestCase):
+    def test_self(self):
+        self.assertTrue(is_running(os.getpid()))
+        self.assertGreater(rss_bytes(), 0)
+        self.assertGreater(uss_bytes(), 0)
+        self.assertGreaterEqual(rss_bytes(), uss_bytes())
+        self.assertGreaterEqual(cpu_seconds(), 0.0)
+
+    def test_exited(self):
+        p = Process(target=lambda: None)
+        p.start()
+        p.join()
+        self.assertFalse(is_running(p.pid))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# encoding: utf-8
+from __future__ import unicode_literals
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from cbot.bot.alias import HUMAN, SYSTEM, BELIEF_STATE
+from cbot.bot.log import session_logs, wrap_msg
+from cbot.bot.replay import ReplayEngine, recorded_turns, normalize, summarize, read_session, changes
+
+
+class ReplayEngineTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.engine = ReplayEngine()
+
+    def record(self, utterances):
+        msgs = []
+        self.engine.start('recorded')
+        for u in utterances:
+            replies, states = self.engine.turn(u)
+            msgs.append(wrap_msg(u))
+            msgs.extend({'name': BELIEF_STATE, 'attributes': s} for s in states)
+            msgs.extend(wrap_msg(r, SYSTEM) for r in replies)
+        return msgs
+
+    def test_recorded_turns(self):
+        msgs = [wrap_msg('Hi!', SYSTEM), wrap_msg('Hello'), {'name': BELIEF_STATE, 'attributes': {}},
+                wrap_msg('Hi!', SYSTEM), wrap_msg('Bye'), {'user': HUMAN, 'utterance': 'Bye'}]
+        turns = list(recorded_turns(msgs))
+        self.assertEqual([(h and h['utterance'], len(s), len(r)) for h, s, r in turns],
+                         [(None, 0, 1), ('Hello', 1, 1), ('Bye', 0, 0), ('Bye', 0, 0)])
+
+    def test_session_logs(self):
+        root = tempfile.mkdtemp()
+        try:
+            msgs = [wrap_msg('Hello'), {'name': BELIEF_STATE, 'attributes': {'a': 1}}, wrap_msg('Hi!', SYSTEM),
+                    wrap_msg('Bye'), {'name': BELIEF_STATE, 'attributes': {'a': 2}}, wrap_msg('Bye!', SYSTEM)]
+            for name, ms in [('1input_output.log', [m for m in msgs if m['name'] != BELIEF_STATE]),
+                             ('1dm_logic.log', [m for m in msgs if m['name'] == BELIEF_STATE]),
+                             ('2dm_logic.log', msgs), ('all_messages_cbot_msg.log', msgs)]:
+                with open(os.path.join(root, name), 'w') as w:
+                    w.writelines(json.dumps(m) + '\n' for m in ms)
+            logs = session_logs(root)
+            self.assertEqual(sorted(logs), ['1', '2'])
+            self.assertIsNone(logs['2'][0])
+            for session in ['1', '2']:
+                self.assertEqual(list(read_session(*logs[session])), msgs)
+        finally:
+            shutil.rmtree(root)
+
+    def test_changes(self):
+        turn = {'replayed': ['Hi!'], 'user_action': {'name': 'Hello', 'args': {}}, 'user_mentions': []}
+        self.assertEqual(changes(turn, dict(turn)), [])
+        self.assertEqual(changes(turn, dict(turn, user_mentions=[[['a', 'b', 'c'], 1.0]])), ['user_mentions'])
+        self.assertEqual(changes(turn, None), ['replayed', 'user_action', 'user_mentions'])
+
+    def test_normalize(self):
+        self.assertEqual(normalize({'a': "{'debug_info': '<cbot.dm.actions.Hello object at 0x10ec25190>'}"}),
+                         {'a': "{'debug_info': '<cbot.dm.actions.Hello object>'}"})
+
+    def test_deterministic(self):
+        utterances = ['Hello', 'I know Little Richard', 'Who is Little Richard?', 'Bye']
+        msgs = self.record(utterances)
+        turns = list(self.engine.replay(msgs))
+        self.assertEqual([t['human'] for t in turns], utterances)
+        self.assertEqual([changes(t, b) for t, b in zip(self.engine.replay(msgs), turns)], [[]] * len(turns))
+        summary = summarize(turns)
+        self.assertEqual((summary['replies_diverged'], summary['states_diverged']), (0, 0))
+
+        changed = [dict(m, utterance='Something else') if m['name'] == SYSTEM else m for m in msgs]
+        turns = list(self.engine.replay(changed))
+        self.assertTrue(all(t['reply_diverged'] for t in turns))
+        self.assertEqual(summarize(turns)['first_divergence'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
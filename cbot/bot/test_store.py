@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# encoding: utf-8
+from __future__ import unicode_literals
+import json
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+from cbot.bot.store import SegmentStore, SegmentStoreHandler, encode_line
+
+
+def line(session, name, utterance, t, level='WARNING'):
+    msg = json.dumps({'session': session, 'name': name, 'utterance': utterance, 'time': t})
+    return encode_line(level, session, msg.encode('utf-8'))
+
+
+class SegmentStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.dir_name = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir_name)
+
+    def utterances(self, store, session):
+        return [json.loads(msg)['utterance'] for _, msg in store.read(session)]
+
+    def fill(self, store, turns=10):
+        for t in range(turns):
+            for session in ['1', '2']:
+                store.append(line(session, 'human', '%s hi %d' % (session, t), 100 + t) +
+                             line(session, 'belief_state', 'state', None, 'INFO') +
+                             line(session, 'chat_bot', '%s hello %d' % (session, t), 100.5 + t))
+
+    def test_sealed_and_active(self):
+        store = SegmentStore(self.dir_name, segment_bytes=1500)
+        self.fill(store)
+        files = os.listdir(self.dir_name)
+        self.assertIn('segment-000001.z', files)
+        self.assertGreater(store.stats()['sealed'], 1)
+        self.assertEqual(len([f for f in files if f.endswith('.log')]), 1)  # the active segment only
+        expected = []
+        for t in range(10):
+            expected += ['1 hi %d' % t, 'state', '1 hello %d' % t]
+        self.assertEqual(self.utterances(store, '1'), expected)
+        sessions = store.sessions()
+        self.assertEqual(sessions['2']['turns'], 10)
+        self.assertEqual((sessions['2']['start'], sessions['2']['end']), (100, 109.5))
+        self.assertEqual(sessions['2']['segments'][-1], None)
+        store.close()
+
+        reader = SegmentStore(self.dir_name)  # e.g. the log viewer
+        self.assertEqual(self.utterances(reader, '1'), expected)
+        self.assertEqual(list(reader.read('3')), [])
+        active = reader.read_active()  # e.g. the replay regression reading every session
+        self.assertEqual(sorted(active), ['1', '2'])
+        self.assertEqual([json.loads(msg)['utterance'] for _, msg in reader.read('1', active)], expected)
+        with open(os.path.join(self.dir_name, 'index.jsonl')) as r:
+            entry = json.loads(next(r))
+        with open(os.path.join(self.dir_name, 'segment-%06d.z' % entry['segment']), 'rb') as r:
+            r.seek(entry['offset'])
+            self.assertEqual(len(r.read(entry['length'])), entry['length'])
+
+    def test_reopen_and_interrupted_seal(self):
+        plain = os.path.join(self.dir_name, 'segment-000001.log')
+        store = SegmentStore(self.dir_name, segment_bytes=10 ** 6)
+        self.fill(store, 2)
+        store.close()
+        with open(plain, 'ab') as w:
+            w.write(b'WARNING\t1\t{"torn')  # by a crash
+        store = SegmentStore(self.dir_name, segment_bytes=10 ** 6)
+        self.fill(store, 1)
+        store.close()
+        shutil.copy(plain, plain + '.bak')
+        store.seal()
+        self.assertEqual(len(self.utterances(store, '1')), 9)
+        # the crash came after the segment was compressed and indexed but before the plain segment was removed
+        os.rename(plain + '.bak', plain)
+        store = SegmentStore(self.dir_name, segment_bytes=10 ** 6)
+        store.append(line('1', 'human', 'new', 300))
+        self.assertEqual(len(self.utterances(store, '1')), 10)
+        self.assertEqual(store.sessions()['1']['turns'], 4)
+        self.assertEqual(store.sessions()['1']['segments'], [1, None])
+        with open(os.path.join(self.dir_name, 'index.jsonl')) as r:
+            self.assertEqual(len(r.readlines()), 2)
+        store.close()
+
+
+class SegmentStoreHandlerTest(unittest.TestCase):
+    def setUp(self):
+        self.dir_name = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir_name)
+
+    def test_buffered_appends(self):
+        store = SegmentStore(self.dir_name)
+        handler = SegmentStoreHandler(store, flush_interval=3600)
+        for level, name in [(logging.WARNING, 'human'), (logging.INFO, 'belief_state')]:
+            record = logging.LogRecord('test', level, __file__, 0, json.dumps({'name': name}), (), None)
+            record.session = '7'
+            handler.handle(record)
+        self.assertEqual(list(store.read('7')), [])
+        handler.close()
+        self.assertEqual([(level, json.loads(msg)['name']) for level, msg in store.read('7')],
+                         [('WARNING', 'human'), ('INFO', 'belief_state')])
+        self.assertEqual(handler.stats()['records'], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
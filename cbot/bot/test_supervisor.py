@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# encoding: utf-8
+from __future__ import unicode_literals
+import unittest
+import gevent
+from gevent import Greenlet
+from cbot.bot.connectors import ChatBotConnector, ChatBotProcess, ConnectorHub
+from cbot.bot.fixtures import EndpointsTestCase
+from cbot.bot.log import wrap_msg
+from cbot.bot.supervisor import ChatBotSupervisor
+
+
+class ChatBotSupervisorTest(EndpointsTestCase):
+    def setUp(self):
+        super(ChatBotSupervisorTest, self).setUp()
+        self.hub = ConnectorHub(self.endpoints)
+        self.supervisor = ChatBotSupervisor(self.hub, max_turns=2, interval=3600)  # checked by the tests
+
+    def tearDown(self):
+        self.supervisor.shutdown()
+        self.hub.close()
+        super(ChatBotSupervisorTest, self).tearDown()
+
+    def connector(self, replies):
+        c = ChatBotConnector(lambda m, room: replies.append(m), self.endpoints, hub=self.hub)
+        c.start()
+        self.assertTrue(c.initialized.get())
+        return c
+
+    def test_orphan_killed_and_reaped(self):
+        bot = ChatBotProcess('1', self.endpoints)
+        bot.start()
+        self.supervisor.check()
+        self.assertEqual(self.supervisor.stats()['orphans'], 1)
+        self.assertTrue(bot.is_alive())
+        self.supervisor.check()
+        self.assertEqual(self.supervisor.counts['orphans_killed'], 1)
+        bot.join(5.0)
+        self.supervisor.check()
+        self.assertEqual(self.supervisor.counts['zombies_reaped'], 1)
+        self.assertEqual(self.supervisor.stats()['live'], 0)
+
+    def test_dead_connector(self):
+        c = self.connector([])
+        bot = c.bot
+        Greenlet.kill(c)  # the greenlet dies without finalize
+        self.supervisor.check()
+        self.assertEqual(self.supervisor.counts['dead_connectors'], 1)
+        self.assertNotIn(bot.name, self.hub.connectors)
+        bot.join(5.0)
+        self.assertFalse(bot.is_alive())
+
+    def test_recycle_over_turn_limit(self):
+        replies = []
+        c = self.connector(replies)
+        self.supervisor.check()
+        self.assertEqual(self.supervisor.stats()['live'], 1)
+        old, session = c.bot, c.session
+        for i in range(2):
+            c.send(wrap_msg('hi %d' % i))
+        self.supervisor.check()
+        for _ in range(300):
+            if self.supervisor.counts['recycled'] == 1:
+                break
+            gevent.sleep(0.1)
+        self.assertNotEqual(c.bot.name, old.name)
+        self.assertEqual(c.session, session)
+        self.assertEqual(c.turns, 0)
+        old.join(5.0)
+        self.assertFalse(old.is_alive())
+        c.send(wrap_msg('hi again'))
+        for _ in range(100):
+            if len(replies) == 3:
+                break
+            gevent.sleep(0.05)
+        self.assertEqual([r['session'] for r in replies], [session] * 3)
+        c.kill()
+
+
+if __name__ == '__main__':
+    unittest.main()
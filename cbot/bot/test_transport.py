@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# encoding: utf-8
+from __future__ import unicode_literals
+import time
+import unittest
+import zmq
+from cbot.bot import wire
+from cbot.bot.fixtures import EndpointsTestCase
+from cbot.bot.transport import PubSubTransport, recipient_of
+
+
+class TopicTest(unittest.TestCase):
+    def test_topic(self):
+        self.assertEqual(PubSubTransport.topic(None, '12'), '12')
+        self.assertEqual(PubSubTransport.topic('init_sync', '12'), 'init_sync_12')
+        self.assertEqual(PubSubTransport.parse_topic('init_sync_12'), ('init_sync', '12'))
+        self.assertEqual(PubSubTransport.parse_topic('12.34'), (None, '12.34'))
+
+    def test_recipient(self):
+        self.assertEqual(recipient_of('12'), '12')
+        self.assertEqual(recipient_of('12.34'), '12')
+
+
+class PubSubTransportTest(EndpointsTestCase):
+    settle = 1.0
+
+    def setUp(self):
+        super(PubSubTransportTest, self).setUp()
+        self.ctx = zmq.Context()
+
+    def test_round_trip(self):
+        bot = self.endpoints.bot(self.ctx, '1')
+        bot.subscribe('1')
+        connector = self.endpoints.connector(self.ctx)
+        connector.subscribe('1')
+        time.sleep(0.5)  # slow joiner
+        connector.send('init_sync', '1', 'probing connection')
+        self.assertEqual(bot.recv(timeout=2000), ('init_sync', '1', 'probing connection'))
+        bot.send(None, '1', {'utterance': 'hi', 'time': 1.5})
+        self.assertEqual(connector.recv(timeout=2000), (None, '1', {'utterance': 'hi', 'time': 1.5}))
+        for t in [bot, connector]:
+            t.close()
+
+    def test_hosted_session(self):
+        host = self.endpoints.bot(self.ctx, '2')
+        host.subscribe('2')
+        connector = self.endpoints.connector(self.ctx)
+        connector.subscribe('2.7')
+        time.sleep(0.5)
+        connector.send(None, '2.7', 'hello')
+        self.assertEqual(host.recv(timeout=2000), (None, '2.7', 'hello'))
+        host.send('stat', '2.7', {'sessions': 1})
+        self.assertEqual(connector.recv(timeout=2000), ('stat', '2.7', {'sessions': 1}))
+        for t in [host, connector]:
+            t.close()
+
+
+class RouterTransportTest(PubSubTransportTest):
+    transport = 'router'
+
+    def test_addressed(self):
+        first, second = self.endpoints.bot(self.ctx, '3'), self.endpoints.bot(self.ctx, '4')
+        connector = self.endpoints.connector(self.ctx)
+        time.sleep(0.5)
+        connector.send(None, '3', 'only for 3')
+        self.assertEqual(first.recv(timeout=2000), (None, '3', 'only for 3'))
+        self.assertIsNone(second.recv(timeout=200))
+        first.send(None, '3', 'reply')  # to the last peer which wrote about '3'
+        self.assertEqual(connector.recv(timeout=2000), (None, '3', 'reply'))
+        for t in [first, second, connector]:
+            t.close()
+
+    def test_broker_registry(self):
+        host, connector = self.endpoints.bot(self.ctx, '3'), self.endpoints.connector(self.ctx)
+        raw = self.ctx.socket(zmq.DEALER)
+        raw.connect(self.endpoints.address(self.endpoints.broker_port))
+        time.sleep(0.5)
+        host.send('register', '3', {'capacity': 10})
+        raw.send_multipart([b'', b'register', b'4', wire.encode({'capacity': 10})])  # marshal is not decoded
+        raw.send_multipart([b'', b'register', b'5', wire.JSON + b'{broken'])
+        time.sleep(0.2)
+        connector.send('hosts', '', None)
+        self.assertEqual(connector.recv(timeout=2000), ('hosts', '', {'3': {'capacity': 10}}))
+        raw.close()
+        for t in [host, connector]:
+            t.close()
+
+
+class InProcTransportTest(PubSubTransportTest):
+    transport = 'inproc'
+
+    def test_filtered(self):
+        bot = self.endpoints.bot(self.ctx, '5')
+        bot.subscribe('5', [None])
+        connector = self.endpoints.connector(self.ctx)
+        connector.send('init_sync', '5', 'not subscribed')
+        connector.send(None, '6', 'other bot')
+        self.assertIsNone(bot.recv(timeout=0))
+        connector.close()
+        bot.send(None, '5', 'nobody listens')
+        self.assertEqual(self.endpoints.connectors, [])
+        bot.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+# encoding: utf-8
+from __future__ import unicode_literals
+from collections import OrderedDict
+import unittest
+from cbot.bot import wire
+
+
+class WireTest(unittest.TestCase):
+    def test_round_trip(self):
+        for obj in ['probing connection', {'utterance': 'Ahoj, jak se máš?', 'time': 1.5, 'user': 'human'},
+                    {'history': [{'turn': i} for i in range(10)], 'sessions': 1, 'rss_bytes': 2 ** 40}]:
+            body = wire.encode(obj)
+            self.assertEqual(body[:1], wire.MARSHAL)
+            self.assertEqual(wire.decode(body), obj)
+
+    def test_json_fallback(self):
+        body = wire.encode(OrderedDict([('utterance', 'hi')]))  # dict subclasses are not marshalled
+        self.assertEqual(body[:1], wire.JSON)
+        self.assertEqual(wire.decode(body), {'utterance': 'hi'})
+
+    def test_compress(self):
+        obj = {'user_mentions': [(('I', 'like', 'Richard'), 0.7)] * 100, 'history': {}}
+        body = wire.encode(obj, compress=True)
+        self.assertEqual(body[:1], wire.ZLIB)
+        self.assertLess(len(body), len(wire.encode(obj)))
+        self.assertEqual(wire.decode(body), obj)  # tuples are kept
+        self.assertRaises(ValueError, wire.encode, OrderedDict(), compress=True)
+
+    def test_portable(self):
+        obj = {'capacity': 1000, 'node': 'host'}
+        body = wire.encode(obj, portable=True)
+        self.assertEqual(body[:1], wire.JSON)
+        self.assertEqual(wire.decode(body, wire.PORTABLE), obj)
+        self.assertRaises(ValueError, wire.decode, wire.encode(obj), wire.PORTABLE)
+        self.assertRaises(ValueError, wire.decode, wire.encode(obj, compress=True), wire.PORTABLE)
+
+    def test_broken(self):
+        self.assertRaises(ValueError, wire.decode, b'\x07abc')  # unknown version
+        for body in [wire.encode({'utterance': 'hi'})[:-3], wire.ZLIB + b'not zlib', wire.JSON + b'{',
+                     wire.JSON + b'\xff']:
+            self.assertRaises(ValueError, wire.decode, body)
+
+    def test_copy(self):
+        self.assertTrue(wire.copy(b'x' * 10))
+        self.assertFalse(wire.copy(b'x' * (wire.COPY_THRESHOLD + 1)))
+
+
+if __name__ == '__main__':
+    unittest.main()
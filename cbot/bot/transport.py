@@ -0,0 +1,351 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Transports between ChatBotConnectors (web app) and ChatBots.
+
+Every message is a triple (signal, name, payload):
+    signal  None for dialogue messages or one of the control SIGNALS,
+    name    name of the bot or session the message is about,
+    payload dict message, stats or short control string.
+
+The payload is the last frame encoded by cbot.bot.wire, the other parts travel in their own frames.
+
+PubSubEndpoints use two forwarder devices. Connectors publish to the bot forwarder,
+bots publish to the user forwarder and the messages [topic, body] are filtered by topic prefixes,
+so every message reaches all subscribers of the forwarder.
+
+RouterEndpoints use one ROUTER broker. Every bot, host and connector is a DEALER
+with its own identity and the broker passes each message only to its recipient.
+
+The devices listen on the bind interface of the endpoints, the loopback by default,
+see cbot.bot.wire before exposing them to other machines. The bots publish their messages
+to the log sink at the log_address of the endpoints.
+
+InProcEndpoints pass the messages as objects through gevent queues inside one process,
+for single node deployments where ChatBotHostGreenlet hosts the dialogues in the web process.
+"""
+from __future__ import unicode_literals
+import logging
+import multiprocessing
+import time
+import uuid
+import zmq
+from zmq.devices import ProcessDevice
+from gevent.queue import Queue, Empty
+from cbot.bot import wire
+from cbot.bot.alias import LOGGING_ADDRESS
+
+SIGNALS = ['init_sync', 'ready', 'die', 'stat', 'reset', 'hibernate', 'restore', 'register', 'hosts']
+BROKER, BROKER_SIGNALS = '', ['register', 'hosts']  # recipient and signals handled by ChatBotBroker itself
+
+
+def forwarder_device_start(frontend_port, backend_port, bind='127.0.0.1'):
+    forwarder = ProcessDevice(zmq.FORWARDER, zmq.SUB, zmq.PUB)
+    forwarder.setsockopt_in(zmq.SUBSCRIBE, b'')
+
+    logger = logging.getLogger(__name__)
+    logger.debug('forwarder binding in to tcp://%s:%d', bind, frontend_port)
+    logger.debug('forwarder binding out to tcp://%s:%d', bind, backend_port)
+    forwarder.bind_in("tcp://%s:%d" % (bind, frontend_port))
+    forwarder.bind_out("tcp://%s:%d" % (bind, backend_port))
+
+    forwarder.start()
+    return forwarder
+
+
+class ChatBotBroker(multiprocessing.Process):
+    """ROUTER device passing [recipient, signal, name, payload] from any peer
+    as [sender, signal, name, payload] to the recipient only.
+
+    Messages for the BROKER recipient form the registry of ChatBot hosts:
+    'register' heartbeats of the hosts advertise their capacity and load,
+    'hosts' requests are answered with the hosts registered in the last expiry seconds.
+    The heartbeats are decoded only from the wire.PORTABLE formats, the broken ones are dropped.
+    """
+    def __init__(self, port, expiry=3.0, bind='127.0.0.1'):
+        super(ChatBotBroker, self).__init__()
+        self.port, self.expiry, self.bind = port, expiry, bind
+        self.daemon = True
+        self.registry = {}  # host name -> (last heartbeat time, advertised info)
+        self.logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
+
+    def registered(self, now=None):
+        now = time.time() if now is None else now
+        for name, (seen, _) in self.registry.items():
+            if now - seen > self.expiry:
+                del self.registry[name]
+        return dict((name, info) for name, (_, info) in self.registry.iteritems())
+
+    def handle(self, router, sender, signal, name, body):
+        if signal == b'register':
+            try:
+                self.registry[name.decode('utf-8')] = (time.time(), wire.decode(body, wire.PORTABLE))
+            except ValueError as e:
+                self.logger.warning('Dropping registration of %r: %s', name, e)
+        elif signal == b'hosts':
+            router.send_multipart([sender, b'', b'hosts', b'', wire.encode(self.registered(), portable=True)], flags=zmq.NOBLOCK)
+
+    def run(self):
+        logger = self.logger
+        context = zmq.Context()
+        router = context.socket(zmq.ROUTER)
+        router.setsockopt(zmq.ROUTER_MANDATORY, 1)  # raise instead of silently dropping
+        router.bind('tcp://%s:%d' % (self.bind, self.port))
+        logger.debug('broker bound to tcp://%s:%d', self.bind, self.port)
+        dropped = 0
+        while True:
+            frames = router.recv_multipart()
+            sender, recipient = frames[0], frames[1]
+            try:
+                if recipient == BROKER.encode('utf-8'):
+                    self.handle(router, sender, *frames[2:])
+                    continue
+                # never block on a peer which does not read, it would stall everybody else
+                router.send_multipart([recipient, sender] + frames[2:], flags=zmq.NOBLOCK)
+            except zmq.ZMQError as e:
+                if e.errno not in (zmq.EHOSTUNREACH, zmq.EAGAIN):
+                    raise
+                dropped += 1
+                logger.debug('Dropping message for unknown or full recipient %s (dropped %d)', recipient, dropped)
+
+
+def broker_device_start(port, expiry=3.0, bind='127.0.0.1'):
+    broker = ChatBotBroker(port, expiry, bind)
+    broker.start()
+    return broker
+
+
+def stop_devices(devices, timeout=1.0):
+    """Terminate and join the forwarder and broker processes started by start_devices."""
+    for device in devices:
+        process = getattr(device, 'launcher', device)  # a ProcessDevice runs in its launcher process
+        if process.is_alive():
+            process.terminate()
+        process.join(timeout)
+
+
+def recv_waiting(transport, block=True):
+    """Return the messages already waiting in the socket, if block wait for at least one."""
+    msgs = [transport.recv()] if block else []
+    received = transport.recv(timeout=0)
+    while received is not None:
+        msgs.append(received)
+        received = transport.recv(timeout=0)
+    return msgs
+
+
+def recipient_of(name):
+    """Dialogues of ChatBotHostProcess are named '<host>.<session>' and are received by the host."""
+    return name.split('.', 1)[0]
+
+
+class PubSubTransport(object):
+    def __init__(self, context, in_address, out_address):
+        self.isocket = context.socket(zmq.SUB)
+        self.osocket = context.socket(zmq.PUB)
+        self.osocket.sndhwm = 1100000  # set SNDHWM, so we don't drop messages for slow subscribers
+        self.isocket.connect(in_address)
+        self.osocket.connect(out_address)
+
+    @staticmethod
+    def topic(signal, name):
+        return '%s' % name if signal is None else '%s_%s' % (signal, name)
+
+    @staticmethod
+    def parse_topic(topic):
+        for signal in SIGNALS:
+            if topic.startswith(signal + '_'):
+                return signal, topic[len(signal) + 1:]
+        return None, topic
+
+    def subscribe(self, name, signals=None):
+        """Receive dialogue messages and given signals (all by default) about name. Name is a prefix."""
+        for signal in signals if signals is not None else [None] + SIGNALS:
+            self.isocket.setsockopt_string(zmq.SUBSCRIBE, self.topic(signal, name))
+
+    def unsubscribe(self, name, signals=None):
+        for signal in signals if signals is not None else [None] + SIGNALS:
+            self.isocket.setsockopt_string(zmq.UNSUBSCRIBE, self.topic(signal, name))
+
+    def send(self, signal, name, payload):
+        body = wire.encode(payload)
+        self.osocket.send(self.topic(signal, name).encode('utf-8'), zmq.SNDMORE)
+        self.osocket.send(body, copy=wire.copy(body))
+
+    def recv(self, timeout=None):
+        """Return (signal, name, payload) or None if nothing arrived in timeout ms."""
+        if timeout is not None and not self.isocket.poll(timeout=timeout):
+            return None
+        topic, body = self.isocket.recv_multipart()
+        signal, name = self.parse_topic(topic.decode('utf-8'))
+        return signal, name, wire.decode(body)
+
+    def close(self):
+        self.isocket.close()
+        self.osocket.close()
+
+
+class DealerTransport(object):
+    """Connector side of RouterEndpoints. Messages about a dialogue are sent to the bot hosting it."""
+    def __init__(self, context, address, identity):
+        self.identity = str(identity)
+        self.socket = context.socket(zmq.DEALER)
+        self.socket.setsockopt(zmq.IDENTITY, self.identity.encode('utf-8'))
+        self.socket.sndhwm = 1100000
+        self.socket.connect(address)
+        self.logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
+
+    def recipient(self, name):
+        return recipient_of(name)
+
+    def subscribe(self, name, signals=None):
+        pass  # messages are addressed
+
+    def unsubscribe(self, name, signals=None):
+        pass
+
+    def send(self, signal, name, payload):
+        recipient = BROKER if signal in BROKER_SIGNALS else self.recipient(name)
+        if recipient is None:
+            self.logger.warning('Nobody to send %s about %s to', signal, name)
+            return
+        body = wire.encode(payload, portable=recipient == BROKER)
+        self.socket.send_multipart([recipient.encode('utf-8'), (signal or '').encode('utf-8'), name.encode('utf-8'),
+                                    body], copy=wire.copy(body))
+
+    def _recv(self, timeout):
+        if timeout is not None and not self.socket.poll(timeout=timeout):
+            return None, None
+        sender, signal, name, body = self.socket.recv_multipart()
+        return sender.decode('utf-8'), (signal.decode('utf-8') or None, name.decode('utf-8'), wire.decode(body))
+
+    def recv(self, timeout=None):
+        return self._recv(timeout)[1]
+
+    def close(self):
+        self.socket.close()
+
+
+class DealerBotTransport(DealerTransport):
+    """Bot side of RouterEndpoints. Bots reply to the peer (connector, pool) which has written about the dialogue last."""
+    def __init__(self, context, address, identity):
+        super(DealerBotTransport, self).__init__(context, address, identity)
+        self.reply_to = {}  # name -> identity
+
+    def recipient(self, name):
+        return self.reply_to.get(name)
+
+    def unsubscribe(self, name, signals=None):
+        self.reply_to.pop(name, None)
+
+    def send(self, signal, name, payload):
+        if signal == 'ready' and name not in self.reply_to:
+            return  # nobody to announce to yet, the connector finds out with its next init_sync probe
+        super(DealerBotTransport, self).send(signal, name, payload)
+
+    def recv(self, timeout=None):
+        sender, msg = self._recv(timeout)
+        if msg is not None:
+            self.reply_to[msg[1]] = sender
+        return msg
+
+
+class InProcTransport(object):
+    """Transport of InProcEndpoints. Filters by topic prefixes like PubSubTransport,
+    but the payloads are neither encoded nor copied."""
+    def __init__(self, side, peers):
+        self.side, self.peers = side, peers  # transports of the same and the other side
+        self.side.append(self)
+        self.topics = set()
+        self.queue = Queue()
+
+    def subscribe(self, name, signals=None):
+        for signal in signals if signals is not None else [None] + SIGNALS:
+            self.topics.add(PubSubTransport.topic(signal, name))
+
+    def unsubscribe(self, name, signals=None):
+        for signal in signals if signals is not None else [None] + SIGNALS:
+            self.topics.discard(PubSubTransport.topic(signal, name))
+
+    def subscribed(self, topic):
+        return any(topic[:i] in self.topics for i in range(len(topic) + 1))
+
+    def send(self, signal, name, payload):
+        topic = PubSubTransport.topic(signal, name)
+        for peer in self.peers:
+            if peer.subscribed(topic):
+                peer.queue.put((signal, name, payload))
+
+    def recv(self, timeout=None):
+        """Return (signal, name, payload) or None if nothing arrived in timeout ms"""
+        try:
+            if timeout == 0:
+                return self.queue.get_nowait()
+            return self.queue.get(timeout=timeout / 1000.0 if timeout is not None else None)
+        except Empty:
+            return None
+
+    def close(self):
+        if self in self.side:
+            self.side.remove(self)
+
+
+class PubSubEndpoints(object):
+    in_process = False
+
+    def __init__(self, bot_front, bot_back, user_front, user_back, host='127.0.0.1', bind='127.0.0.1',
+                 log_address=LOGGING_ADDRESS):
+        self.bot_front, self.bot_back, self.user_front, self.user_back = bot_front, bot_back, user_front, user_back
+        self.host, self.bind = host, bind  # the address the peers connect to and the interface the devices bind
+        self.log_address = log_address
+
+    def address(self, port):
+        return 'tcp://%s:%d' % (self.host, port)
+
+    def connector(self, context):
+        return PubSubTransport(context, self.address(self.user_back), self.address(self.bot_front))
+
+    def bot(self, context, identity):
+        return PubSubTransport(context, self.address(self.bot_back), self.address(self.user_front))
+
+    def start_devices(self):
+        return [forwarder_device_start(self.bot_front, self.bot_back, self.bind),
+                forwarder_device_start(self.user_front, self.user_back, self.bind)]
+
+
+class RouterEndpoints(object):
+    in_process = False
+
+    def __init__(self, broker_port, host='127.0.0.1', bind='127.0.0.1', log_address=LOGGING_ADDRESS):
+        self.broker_port, self.host, self.bind = broker_port, host, bind
+        self.log_address = log_address
+
+    def address(self, port):
+        return 'tcp://%s:%d' % (self.host, port)
+
+    def connector(self, context):
+        return DealerTransport(context, self.address(self.broker_port), 'connector%d' % uuid.uuid4())
+
+    def bot(self, context, identity):
+        return DealerBotTransport(context, self.address(self.broker_port), identity)
+
+    def start_devices(self):
+        return [broker_device_start(self.broker_port, bind=self.bind)]
+
+
+class InProcEndpoints(object):
+    """Connectors and bots of one process, the bots are hosted by ChatBotHostGreenlet."""
+    in_process = True
+
+    def __init__(self, log_address=LOGGING_ADDRESS):
+        self.connectors, self.bots = [], []
+        self.log_address = log_address
+
+    def connector(self, context):
+        return InProcTransport(self.connectors, self.bots)
+
+    def bot(self, context, identity):
+        return InProcTransport(self.bots, self.connectors)
+
+    def start_devices(self):
+        return []  # nothing between the connectors and the bots
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Wire format of the message bodies passed by the transports.
+
+The topic (or recipient, signal and name) travels in separate ZMQ frames,
+so the body is only the payload: one version byte followed by the encoded object.
+
+    MARSHAL  compact binary encoding of plain dicts, lists, strings and numbers,
+             several times faster than JSON in both directions
+    JSON     fallback for objects marshal cannot encode
+    ZLIB     zlib compressed marshal for large bodies sent rarely, e.g. checkpoints,
+             without the JSON fallback which would turn tuples into lists
+
+MARSHAL and ZLIB bodies are exchanged only among the processes of one deployment, which run the same Python.
+The marshal format is pinned to MARSHAL_FORMAT, but marshal is neither safe against malicious data
+nor stable among Python versions. The devices therefore listen on the loopback interface unless
+configured otherwise, and ChatBotBroker, which talks to every peer, decodes only the PORTABLE formats.
+"""
+from __future__ import unicode_literals
+import json
+import marshal
+import zlib
+
+JSON, MARSHAL, ZLIB = b'\x00', b'\x01', b'\x02'
+MARSHAL_FORMAT = 2
+PORTABLE = (JSON,)  # safe to decode from any peer and the same for every Python
+COPY_THRESHOLD = 64 * 1024  # bodies larger than this are sent with copy=False
+
+
+def encode(obj, compress=False, portable=False):
+    """Raise ValueError if compress and marshal cannot encode obj. Portable bodies are JSON."""
+    if portable:
+        return JSON + json.dumps(obj).encode('utf-8')
+    if compress:
+        return ZLIB + zlib.compress(marshal.dumps(obj, MARSHAL_FORMAT))
+    try:
+        return MARSHAL + marshal.dumps(obj, MARSHAL_FORMAT)
+    except ValueError:
+        return JSON + json.dumps(obj).encode('utf-8')
+
+
+def decode(body, formats=None):
+    """Raise ValueError if the body is broken, its version byte unknown or not one of the formats."""
+    version, data = body[:1], body[1:]
+    if formats is not None and version not in formats:
+        raise ValueError('Wire format version %r not accepted' % version)
+    try:
+        if version == MARSHAL:
+            return marshal.loads(data)
+        elif version == JSON:
+            return json.loads(data.decode('utf-8'))
+        elif version == ZLIB:
+            return marshal.loads(zlib.decompress(data))
+    except (EOFError, TypeError, zlib.error) as e:
+        raise ValueError('Broken wire body: %s' % e)
+    raise ValueError('Unknown wire format version %r' % version)
+
+
+def copy(body):
+    """Zero-copy send pays off only for large bodies."""
+    return len(body) < COPY_THRESHOLD
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Zygote process which forks ChatBots after the models are loaded.
+
+The zygote imports numpy, scipy, the POS tagger with its perceptron weights
+and builds the KnowledgeBase once. Every ChatBotProcess is forked from it,
+so the read-only model pages are shared copy-on-write among the bots
+and the bot is ready without loading anything.
+"""
+from __future__ import unicode_literals
+import gc
+import logging
+import multiprocessing
+import os
+import signal
+import time
+import gevent.socket
+from gevent.lock import Semaphore
+from cbot.bot.proc import is_running
+
+
+def preload():
+    """Load everything read-only the ChatBots need. Returns the shared KnowledgeBase."""
+    import numpy
+    import scipy.stats
+    import cbot.lu.pos
+    import cbot.kb.kb_data
+    import cbot.dm.state  # loads the POS tagger weights
+    from cbot.kb import KnowledgeBase
+    knowledge_base = KnowledgeBase()
+    knowledge_base.load_default_models()
+    gc.collect()  # do not let the collector touch (and copy) the shared pages in every bot
+    return knowledge_base
+
+
+class ZygoteChild(object):
+    """Handle for a ChatBotProcess forked by ChatBotZygote.
+    It mimics the multiprocessing.Process methods used for bots."""
+    def __init__(self, name, pid):
+        self.name, self.session, self.pid = name, name, pid
+
+    def is_alive(self):
+        return is_running(self.pid)
+
+    def terminate(self):
+        try:
+            os.kill(self.pid, signal.SIGTERM)
+        except OSError:
+            pass
+
+    def join(self, timeout=None):
+        deadline = None if timeout is None else time.time() + timeout
+        while self.is_alive() and (deadline is None or time.time() < deadline):
+            gevent.sleep(0.01)
+
+
+class ChatBotZygote(multiprocessing.Process):
+    def __init__(self):
+        super(ChatBotZygote, self).__init__()
+        self.requests, self._child_requests = multiprocessing.Pipe()
+        self._lock = Semaphore()
+        self.logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)
+
+    def run(self):
+        from cbot.bot.connectors import ChatBotProcess, drop_inherited_log_handlers
+        self.logger = logging.getLogger(__name__ + '.' + self.__class__.__name__)  # reinitializing after fork
+        drop_inherited_log_handlers()
+        self.requests.close()
+        start = time.time()
+        knowledge_base = preload()
+        self.logger.info('Zygote preloaded models in %.2f s', time.time() - start)
+        signal.signal(signal.SIGCHLD, signal.SIG_IGN)  # the kernel reaps the exited bots
+        while True:
+            request = self._child_requests.recv()
+            if request is None:
+                break
+            name, endpoints = request
+            pid = os.fork()
+            if pid == 0:
+                signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+                self._child_requests.close()
+                drop_inherited_log_handlers()
+                code = 0
+                try:
+                    ChatBotProcess(name, endpoints, knowledge_base).run()
+                except Exception as e:
+                    self.logger.exception(e)
+                    code = 1
+                finally:
+                    os._exit(code)
+            self._child_requests.send(pid)
+
+    def spawn(self, name, endpoints):
+        """Fork ready ChatBotProcess from the zygote. Does not block other greenlets."""
+        with self._lock:
+            self.requests.send((name, endpoints))
+            gevent.socket.wait_read(self.requests.fileno())
+            pid = self.requests.recv()
+        self.logger.debug('Zygote forked bot %s with pid %d', name, pid)
+        return ZygoteChild(name, pid)
+
+    def shutdown(self):
+        with self._lock:
+            self.requests.send(None)
+        self.join(timeout=1.0)
+        self.terminate()
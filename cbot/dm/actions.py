@@ -18,6 +18,7 @@ from __future__ import division, unicode_literals
 from scipy import stats
 import abc
 from copy import deepcopy
+import itertools
 
 
 # TODO add reasons for the NLU and DM outputs
@@ -57,7 +58,7 @@ class BaseAction(object):
 
     @classmethod
     @abc.abstractmethod
-    def reaction_factory(cls, state, n=10, probability_threshold=0.0):
+    def reaction_factory(cls, state, n=10, probability_threshold=0.0, kb=None):
         """Return list of instances of the class which can be generated from the arguments
         Dialogue state update part: proposing actions. Act method
         """
@@ -90,6 +91,22 @@ class BaseAction(object):
                      "debug_info": super(BaseAction, self).__repr__(), }
         return str(dict_repr)
 
+    def checkpoint(self):
+        """Plain (marshallable) copy of the action, see from_checkpoint"""
+        return dict(vars(self))
+
+    @staticmethod
+    def from_checkpoint(attributes):
+        action_type = BaseAction.action_type(attributes['name'])
+        action = action_type.__new__(action_type)
+        action.__dict__.update(attributes)
+        return action
+
+    @staticmethod
+    def action_type(name):
+        """Action class (DAT) of the name, raise KeyError for unknown names"""
+        return dict((t.__name__, t) for t in BaseAction.__subclasses__())[name]
+
 
 class NoOp(BaseAction):
     @classmethod
@@ -100,7 +117,7 @@ class NoOp(BaseAction):
             return []
 
     @classmethod
-    def reaction_factory(cls, state, n=10, probability_threshold=0.0):
+    def reaction_factory(cls, state, n=10, probability_threshold=0.0, kb=None):
         return [NoOp(SYSTEM)]
 
     def act(self):
@@ -146,13 +163,18 @@ class Inform(BaseAction):
         return informs
 
     @classmethod
-    def reaction_factory(cls, state, n=10, probability_threshold=0.0):
+    def reaction_factory(cls, state, n=10, probability_threshold=0.0, kb=None):
         informs = []
         for triplet in state.user_mentions:
-            # FIXME TODO use knowledge base end extract missing operands for triplets
-            # for example (sacramento, is_capital, ?) -> (sacramento, is_capital, California)
-            if not all((c is None for c in triplet)):
-                args = dict(zip(('entity', 'relation', 'value'), triplet))
+            if all((c is None for c in triplet)):
+                continue
+            completed = []
+            if None in triplet and kb is not None:
+                # the missing operands from the knowledge base
+                # for example (sacramento, is_capital, ?) -> (sacramento, is_capital, California)
+                completed = list(itertools.islice(kb.match(*triplet), n))
+            for t in completed or [triplet]:
+                args = dict(zip(('entity', 'relation', 'value'), t))
                 informs.append(Inform(SYSTEM, args=args))
         return informs
 
@@ -181,9 +203,13 @@ class WhatAsk(BaseAction):
         return questions
 
     @classmethod
-    def reaction_factory(cls, state, n=10, probability_threshold=0.0):
+    def reaction_factory(cls, state, n=10, probability_threshold=0.0, kb=None):
         questions = []
         incomplete_mentions = [(m, prob) for m, prob in state.user_mentions.iteritems() if None in m]
+        if kb is not None:  # the mentions the knowledge base completes are informed about, see Inform
+            # the estimate of a match is only its upper bound, so look for a completion
+            incomplete_mentions = [(m, prob) for m, prob in incomplete_mentions
+                                   if next(iter(kb.match(*m)), None) is None]
         # TODO determine if how, where, what, who is the best
         for m, prob in incomplete_mentions:
             args = dict(zip(('entity', 'relation', 'value'), m))
@@ -222,7 +248,7 @@ class YesNoAsk(BaseAction):
         return questions
 
     @classmethod
-    def reaction_factory(cls, state, n=10, probability_threshold=0.0):
+    def reaction_factory(cls, state, n=10, probability_threshold=0.0, kb=None):
         # TODO
         # have you said? // problem with understanding
         # is it correct to say // problem with nlg
@@ -261,8 +287,8 @@ class Confirm(BaseAction):
         return confirms
 
     @classmethod
-    def reaction_factory(cls, state, n=10, probability_threshold=0.0):
-        informs = Inform.reaction_factory(state)
+    def reaction_factory(cls, state, n=10, probability_threshold=0.0, kb=None):
+        informs = Inform.reaction_factory(state, kb=kb)
         confirms = []
         for i in informs:
             # TODO check this hack
@@ -298,8 +324,8 @@ class Reject(BaseAction):
         return rejects
 
     @classmethod
-    def reaction_factory(cls, state, n=10, probability_threshold=0.0):
-        informs = Inform.reaction_factory(state)
+    def reaction_factory(cls, state, n=10, probability_threshold=0.0, kb=None):
+        informs = Inform.reaction_factory(state, kb=kb)
         rejects = []
         for i in informs:
             # TODO check this hack
@@ -333,7 +359,7 @@ class Deny(BaseAction):
         return negations
 
     @classmethod
-    def reaction_factory(cls, state, n=10, probability_threshold=0.0):
+    def reaction_factory(cls, state, n=10, probability_threshold=0.0, kb=None):
         # TODO we do not check facts for consistency so we cannot deny facts
         return []
 
@@ -355,7 +381,7 @@ class Hello(BaseAction):
         return greetings
 
     @classmethod
-    def reaction_factory(cls, state, n=1, probability_threshold=0.0):
+    def reaction_factory(cls, state, n=1, probability_threshold=0.0, kb=None):
         greetings = []
         if len(state.user_actions) < 5:
             greetings.append(Hello(SYSTEM))
@@ -385,7 +411,7 @@ class GoodBye(BaseAction):
         return goodbyes
 
     @classmethod
-    def reaction_factory(cls, state, n=10, probability_threshold=0.0):
+    def reaction_factory(cls, state, n=10, probability_threshold=0.0, kb=None):
         goodbyes = []
         if GoodBye.__class__ in state.user_actions:
             goodbyes.append(GoodBye(SYSTEM))
@@ -33,12 +33,12 @@ class RuleBasedPolicy(object):
         # TODO no RL: implements rewards and distribute the rewards to the action
         actions = []
         for action_type in BaseAction.__subclasses__():
-            actions.extend(action_type.reaction_factory(self.state))
+            actions.extend(action_type.reaction_factory(self.state, kb=self.kb))
         # filtering out no_noop
         actions = [a for a in actions if not isinstance(a, NoOp)]
         if len(actions) == 0:
             self.logger.debug("No actions except NoOp suggested")
-            actions = NoOp.reaction_factory(self.state)
+            actions = NoOp.reaction_factory(self.state, kb=self.kb)
 
         probabilities = [a.value for a in actions]
         norm = sum(probabilities)
@@ -12,8 +12,7 @@ epsilon = 0.00000001
 
 
 class Utterance(str):
-    pos_tagger = PerceptronTagger()
-    pos_tagger.load()
+    pos_tagger = PerceptronTagger()  # loads the model
 
     def __init__(self, raw_utt):
         super(Utterance, self).__init__(raw_utt)
@@ -79,13 +78,47 @@ class SimpleTurnState(object):
 
         self._backup_attributes = ['current_user_utterance', 'user_actions', 'system_actions']
 
+    def log_record(self):
+        """Belief state message for the ChatBot log, serialized by ChatBotJsonEncoder."""
+        return {'debug_info': super(SimpleTurnState, self).__repr__(),
+                'name': BELIEF_STATE,
+                'attributes': dict([(str(att), self.__getattribute__(att)) for att in self._backup_attributes]),
+                }
+
     def __repr__(self):
-        bsd = {'name': self.__class__.__name__,
-               'debug_info': super(SimpleTurnState, self).__repr__(),
-               'name': BELIEF_STATE,
-               'attributes': dict([(str(att), self.__getattribute__(att)) for att in self._backup_attributes]),
-               }
-        return ChatBotJsonEncoder().encode(bsd)
+        return ChatBotJsonEncoder().encode(self.log_record())
+
+    def checkpoint(self):
+        """Plain (marshallable) copy of the dialogue state without the shared models, see from_checkpoint.
+        The action classes (DATs) are stored by their names."""
+        return {'history': self.history,
+                'current_user_utterance': str(self.current_user_utterance),
+                'trans_prob_mentions': self._trans_prob_mentions,
+                'user_vs_system_history': self.user_vs_system_history,
+                'system_actions': [a.checkpoint() for a in self.system_actions.itervalues()],
+                'user_actions': [a.checkpoint() for a in self.user_actions.itervalues()],
+                'user_dat': [(t.__name__, p) for t, p in self.user_dat.iteritems()],
+                'user_mentions': self.user_mentions.items(),
+                'system_mentions': self.system_mentions,
+                'dat_ngrams': [[(t.__name__, p) for t, p in d.iteritems()] for d in self._dat_ngrams], }
+
+    @classmethod
+    def from_checkpoint(cls, checkpoint, dat_trans_prob):
+        state = cls(dat_trans_prob)
+        state.history = dict(checkpoint['history'])
+        state.current_user_utterance = checkpoint['current_user_utterance']
+        state._trans_prob_mentions = checkpoint['trans_prob_mentions']
+        state.user_vs_system_history = list(checkpoint['user_vs_system_history'])
+        for actions, checkpoints in [(state.system_actions, checkpoint['system_actions']),
+                                     (state.user_actions, checkpoint['user_actions'])]:
+            for a in checkpoints:
+                a = BaseAction.from_checkpoint(a)
+                actions[type(a)] = a
+        state.user_dat.update((BaseAction.action_type(n), p) for n, p in checkpoint['user_dat'])
+        state.user_mentions.update(checkpoint['user_mentions'])
+        state.system_mentions = list(checkpoint['system_mentions'])
+        state._dat_ngrams = [dict((BaseAction.action_type(n), p) for n, p in d) for d in checkpoint['dat_ngrams']]
+        return state
 
     def dat_lm(self, ngram_tuple):
         # TODO LM modeling of tuples using self.dat_trans_prob
@@ -0,0 +1,40 @@
+#!/usr/bin/env python
+# encoding: utf-8
+from __future__ import unicode_literals
+import unittest
+from collections import OrderedDict
+from cbot.dm.actions import Inform, WhatAsk
+from cbot.kb.kb import KnowledgeBase
+
+
+class MentionsState(object):
+    def __init__(self, *mentions):
+        self.user_mentions = OrderedDict((m, 0.7) for m in mentions)
+
+
+class CompleteMentionsTest(unittest.TestCase):
+    def setUp(self):
+        self.kb = KnowledgeBase()
+        self.kb.add_triplets([('Sacramento', 'is_capital', 'California'), ('Prague', 'is_capital', 'Czech Republic')])
+
+    def test_inform_completes(self):
+        state = MentionsState(('Sacramento', 'is_capital', None), ('Paris', 'is_capital', None))
+        informs = Inform.reaction_factory(state, kb=self.kb)
+        self.assertEqual([i.args['value'] for i in informs], ['California', None])
+        self.assertEqual(len(Inform.reaction_factory(MentionsState((None, 'is_capital', None)), n=1, kb=self.kb)), 1)
+        self.assertEqual([i.args['value'] for i in Inform.reaction_factory(state)], [None, None])
+
+    def test_what_ask_incomplete(self):
+        state = MentionsState(('Sacramento', 'is_capital', None), ('Paris', 'is_capital', None))
+        incomplete = [q.args for q in WhatAsk.reaction_factory(state, kb=self.kb) if q.value != 1.0]
+        self.assertEqual(incomplete, [{'entity': 'Paris', 'relation': 'is_capital', 'value': None}])
+
+    def test_what_ask_estimated(self):
+        state = MentionsState(('Prague', None, 'California'))  # estimated to match one triple, matches none
+        self.assertFalse(self.kb.match('Prague', None, 'California').exact)
+        incomplete = [q.args for q in WhatAsk.reaction_factory(state, kb=self.kb) if q.value != 1.0]
+        self.assertEqual(incomplete, [{'entity': 'Prague', 'relation': None, 'value': 'California'}])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,7 @@
 import json
 import unittest
+from cbot.bot import wire
+from cbot.dm.actions import Hello, NoOp
 from cbot.dm.state import SimpleTurnState
 
 
@@ -17,6 +19,20 @@ class TestLogging(unittest.TestCase):
             self.assertIsInstance(d, dict,
                                   msg="Current representation:%s\nfor utterance %s\nis not dict:%s" % (rep, utt, d))
 
+    def test_checkpoint(self):
+        s = SimpleTurnState(None)
+        for utt in self.utterances:
+            s.current_user_utterance = utt
+            s.update_mentions()
+        s.update_system_action(Hello('system', args={'greeting': ('I', 'like', 'Richard')}))
+        restored = SimpleTurnState.from_checkpoint(wire.decode(wire.encode(s.checkpoint(), compress=True)), None)
+        self.assertEqual(restored.current_user_utterance, s.current_user_utterance)
+        self.assertEqual(dict(restored.user_mentions), dict(s.user_mentions))
+        self.assertEqual(restored.system_mentions, [('I', 'like', 'Richard')])
+        self.assertEqual(restored.system_actions.keys(), [Hello])
+        self.assertEqual(restored.system_actions[Hello].args, s.system_actions[Hello].args)
+        self.assertEqual(restored._dat_ngrams, [{NoOp: 1.0}] * s.dat_ngrams_n)
+
 
 if __name__ == '__main__':
     unittest.main()
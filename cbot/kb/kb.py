@@ -4,51 +4,42 @@ from __future__ import unicode_literals
 
 import pickle
 from cbot.kb.kb_data import data
-from collections import defaultdict
+from cbot.kb.triples import TripleStore
 
 
 class KnowledgeBase(object):
     def __init__(self):
-        self._trip = defaultdict(set)  # set of triples (a, r, c)
-        self._rtrip = defaultdict(set)  # the same triples reverse (c, r, a)
+        self._triples = TripleStore()  # interned (a, r, c) triples looked up by a or by c
 
     def load_default_models(self):
         self.add_triplets(data)
 
     def get_nodes(self):
-        return self._trip.keys()
+        return self._triples.heads()
 
     def get_neighbours(self, node, reverse=False):
-        if reverse:
-            return self._rtrip[node]
-        else:
-            return self._trip[node]
+        """The set of triples (node, r, c), or (a, r, node) if reverse."""
+        return self._triples.neighbours(node, reverse)
 
     def is_head(self, f):
-        if len(self.get_neighbours(f)) > 0:
-            return True
-        else:
-            return False
+        return self._triples.has(f)
 
     def is_tail(self, f):
-        if len(self.get_neighbours(f, reverse=True)) > 0:
-            return True
-        else:
-            return False
+        return self._triples.has(f, reverse=True)
+
+    def match(self, entA=None, rel=None, entB=None):
+        """Lazy triples matching the pattern with their estimated number, None matches anything.
+        See cbot.kb.triples.TripleStore.match"""
+        return self._triples.match(entA, rel, entB)
 
     def add_triplet(self, entA, rel, entB):
-        self._trip[entA].add((entA, rel, entB))
-        self._rtrip[entB].add((entA, rel, entB))
+        self._triples.add(entA, rel, entB)
 
     def add_triplets(self, triplets):
-        for a, r, b in triplets:
-            self.add_triplet(a, r, b)
+        self._triples.add_many(triplets)
 
     def extract_triples(self):
-        triples = set([])
-        for trips in self._trip.itervalues():
-            triples = triples | trips
-        return triples
+        return self._triples.all_triples()
 
     def dump(self, file_name):
         triples = self.extract_triples()
@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Triples of interned names in sorted integer arrays, the storage of cbot.kb.kb.KnowledgeBase.
+
+Entities and relations are interned to integer ids. The triples are kept once in three columns
+sorted by (head, relation, tail), the lookups by tail go through a permutation sorted by (tail, relation, head).
+The rows of an id start at its offset in the head or the tail offsets, so a lookup only slices the arrays.
+The arrays are sorted by numpy and kept in array.array, slicing and indexing them yields plain ints.
+A permutation sorted by (relation, tail, head) indexes the relations, see match for the patterns served.
+The triples added one by one since the last merge are kept in small sets until MAX_PENDING of them are merged.
+"""
+from __future__ import unicode_literals
+from array import array
+from bisect import bisect_left, bisect_right
+import itertools
+import numpy as np
+
+MAX_PENDING = 4096
+ID_TYPE = np.int32
+
+
+def _empty():
+    return array(b'i')
+
+
+def _column(a):
+    return array(b'i', a.astype(ID_TYPE).tostring())
+
+
+def _numpy(a):
+    return np.frombuffer(a, dtype=ID_TYPE) if len(a) > 0 else np.empty(0, dtype=ID_TYPE)
+
+
+class TripleMatch(object):
+    """The triples matching a pattern, iterated lazily once. estimate is the upper bound of their number,
+    it is their number if exact."""
+    def __init__(self, triples, estimate, exact=True):
+        self._triples, self.estimate, self.exact = triples, estimate, exact
+
+    def __iter__(self):
+        return self._triples
+
+    def __repr__(self):
+        return '<%s %s%d>' % (self.__class__.__name__, '' if self.exact else '<=', self.estimate)
+
+
+class TripleStore(object):
+    def __init__(self):
+        self.ids, self.names = {}, []  # name -> id, id -> name
+        self._h, self._r, self._t = _empty(), _empty(), _empty()  # sorted by head, relation and tail
+        self._by_tail = _empty()  # rows sorted by tail, relation and head
+        self._by_rel = _empty()  # rows sorted by relation, tail and head
+        self._rel_tails = _empty()  # the tails of the rows of self._by_rel
+        # id -> its first row in the head, tail and relation order, len(names) + 1 offsets
+        self._head_start, self._tail_start, self._rel_start = _empty(), _empty(), _empty()
+        self._pending = set()  # id triples added since the last merge
+        self._pending_heads, self._pending_rels, self._pending_tails = {}, {}, {}  # id -> id triples of self._pending
+
+    def __len__(self):
+        self.merge()
+        return len(self._h)
+
+    def intern(self, name):
+        i = self.ids.get(name)
+        if i is None:
+            i = self.ids[name] = len(self.names)
+            self.names.append(name)
+        return i
+
+    def add(self, head, rel, tail):
+        triple = (self.intern(head), self.intern(rel), self.intern(tail))
+        if triple not in self._pending and len(self._exact_rows(*triple)) == 0:
+            self._pending.add(triple)
+            self._pending_heads.setdefault(triple[0], set()).add(triple)
+            self._pending_rels.setdefault(triple[1], set()).add(triple)
+            self._pending_tails.setdefault(triple[2], set()).add(triple)
+            if len(self._pending) > MAX_PENDING:
+                self.merge()
+
+    def add_many(self, triples):
+        """Add the (head, relation, tail) triples with one merge."""
+        ids = array(b'l')
+        for h, r, t in triples:
+            ids.extend((self.intern(h), self.intern(r), self.intern(t)))
+        self.merge(np.frombuffer(ids, dtype=np.int_).astype(ID_TYPE).reshape(-1, 3))
+
+    def merge(self, rows=None):
+        """Sort the pending triples and the rows of id triples into the arrays."""
+        parts = [np.column_stack((_numpy(self._h), _numpy(self._r), _numpy(self._t)))]
+        if len(self._pending) > 0:
+            parts.append(np.array(sorted(self._pending), dtype=ID_TYPE))
+        if rows is not None and len(rows) > 0:
+            parts.append(rows)
+        if len(parts) == 1:
+            return
+        hrt = np.concatenate(parts)
+        hrt = hrt[np.lexsort((hrt[:, 2], hrt[:, 1], hrt[:, 0]))]
+        if len(hrt) > 1:
+            unique = np.ones(len(hrt), dtype=bool)
+            unique[1:] = np.any(hrt[1:] != hrt[:-1], axis=1)
+            hrt = hrt[unique]
+        h, r, t = hrt[:, 0], hrt[:, 1], hrt[:, 2]
+        by_tail, by_rel = np.lexsort((h, r, t)), np.lexsort((h, t, r))
+        ids = np.arange(len(self.names) + 1)
+        self._head_start = _column(np.searchsorted(h, ids))
+        self._tail_start = _column(np.searchsorted(t[by_tail], ids))
+        self._rel_start = _column(np.searchsorted(r[by_rel], ids))
+        self._h, self._r, self._t = _column(h), _column(r), _column(t)
+        self._by_tail, self._by_rel, self._rel_tails = _column(by_tail), _column(by_rel), _column(t[by_rel])
+        self._pending, self._pending_heads, self._pending_rels, self._pending_tails = set(), {}, {}, {}
+
+    def _span(self, starts, i):
+        if i + 1 >= len(starts):
+            return 0, 0  # interned after the last merge
+        return starts[i], starts[i + 1]
+
+    def neighbours(self, node, reverse=False):
+        """The set of triples with the node as the head, or the tail if reverse."""
+        i = self.ids.get(node)
+        if i is None:
+            return set()
+        n = self.names
+        if reverse:
+            lo, hi = self._span(self._tail_start, i)
+            h, r = self._h, self._r
+            found = set((n[h[j]], n[r[j]], node) for j in self._by_tail[lo:hi])
+            pending = self._pending_tails.get(i, ())
+        else:
+            lo, hi = self._span(self._head_start, i)
+            found = set(zip([node] * (hi - lo), [n[r] for r in self._r[lo:hi]], [n[t] for t in self._t[lo:hi]]))
+            pending = self._pending_heads.get(i, ())
+        found.update((n[h], n[r], n[t]) for h, r, t in pending)
+        return found
+
+    def has(self, node, reverse=False):
+        i = self.ids.get(node)
+        if i is None:
+            return False
+        lo, hi = self._span(self._tail_start if reverse else self._head_start, i)
+        return hi > lo or i in (self._pending_tails if reverse else self._pending_heads)
+
+    def _exact_rows(self, h, r, t):
+        lo, hi = self._span(self._head_start, h)
+        lo, hi = bisect_left(self._r, r, lo, hi), bisect_right(self._r, r, lo, hi)
+        i = bisect_left(self._t, t, lo, hi)
+        return [i] if i < hi and self._t[i] == t else []
+
+    def _rows(self, h, r, t):
+        """(row numbers, their number, exact) of the merged triples matching the ids, None is any."""
+        if h is not None:
+            lo, hi = self._span(self._head_start, h)
+            if r is not None:
+                lo, hi = bisect_left(self._r, r, lo, hi), bisect_right(self._r, r, lo, hi)
+                if t is not None:
+                    rows = self._exact_rows(h, r, t)
+                    return rows, len(rows), True
+            elif t is not None:  # the rows of the head or of the tail, whichever are fewer, filtered
+                tlo, thi = self._span(self._tail_start, t)
+                if thi - tlo < hi - lo:
+                    by_tail, heads = self._by_tail, self._h
+                    return (by_tail[i] for i in xrange(tlo, thi) if heads[by_tail[i]] == h), thi - tlo, False
+                tails = self._t
+                return (i for i in xrange(lo, hi) if tails[i] == t), hi - lo, False
+            return xrange(lo, hi), hi - lo, True
+        if r is not None:
+            lo, hi = self._span(self._rel_start, r)
+            if t is not None:
+                lo, hi = bisect_left(self._rel_tails, t, lo, hi), bisect_right(self._rel_tails, t, lo, hi)
+            by_rel = self._by_rel
+            return (by_rel[i] for i in xrange(lo, hi)), hi - lo, True
+        if t is not None:
+            lo, hi = self._span(self._tail_start, t)
+            by_tail = self._by_tail
+            return (by_tail[i] for i in xrange(lo, hi)), hi - lo, True
+        return xrange(len(self._h)), len(self._h), True
+
+    def match(self, head=None, rel=None, tail=None):
+        """TripleMatch of the (head, relation, tail) triples matching the pattern, None matches anything.
+        The patterns with the head and the relation, the relation and the tail or one of them
+        are read from one index in O(log n + results), the head and the tail from the fewer of their triples."""
+        ids = [None if name is None else self.ids.get(name, -1) for name in (head, rel, tail)]
+        if -1 in ids:
+            return TripleMatch(iter(()), 0)
+        h, r, t = ids
+        pending = self._pending
+        for i, index in [(h, self._pending_heads), (t, self._pending_tails), (r, self._pending_rels)]:
+            if i is not None:
+                pending = index.get(i, ())
+                break
+        pending = [p for p in pending if all(i is None or i == j for i, j in zip(ids, p))]
+        rows, estimate, exact = self._rows(h, r, t)
+        n, hs, rs, ts = self.names, self._h, self._r, self._t
+        triples = itertools.chain(((n[hs[j]], n[rs[j]], n[ts[j]]) for j in rows),
+                                  ((n[a], n[b], n[c]) for a, b, c in pending))
+        return TripleMatch(triples, estimate + len(pending), exact)
+
+    def heads(self):
+        self.merge()
+        return [self.names[i] for i in np.unique(_numpy(self._h)).tolist()]
+
+    def all_triples(self):
+        self.merge()
+        n = self.names
+        return set(zip([n[h] for h in self._h], [n[r] for r in self._r], [n[t] for t in self._t]))
+
+    def nbytes(self):
+        """Bytes of the arrays, the interned names not included."""
+        arrays = [self._h, self._r, self._t, self._by_tail, self._by_rel, self._rel_tails,
+                  self._head_start, self._tail_start, self._rel_start]
+        return sum(a.itemsize * len(a) for a in arrays)
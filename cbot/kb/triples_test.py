@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# encoding: utf-8
+from __future__ import unicode_literals
+import unittest
+from cbot.kb import triples
+from cbot.kb.triples import TripleStore
+
+
+class TripleStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.store = TripleStore()
+        self.store.add_many([('Prague', 'is_capital', 'Czech Republic'), ('Prague', 'is_city', 'city'),
+                             ('Brno', 'is_city', 'city'), ('Prague', 'is_city', 'city')])
+
+    def test_neighbours(self):
+        self.assertEqual(self.store.neighbours('Prague'),
+                         {('Prague', 'is_capital', 'Czech Republic'), ('Prague', 'is_city', 'city')})
+        self.assertEqual(self.store.neighbours('city', reverse=True),
+                         {('Prague', 'is_city', 'city'), ('Brno', 'is_city', 'city')})
+        self.assertEqual(self.store.neighbours('city'), set())
+        self.assertEqual(len(self.store), 3)
+
+    def test_no_side_effects(self):
+        self.assertFalse(self.store.has('Ostrava'))
+        self.assertEqual(self.store.neighbours('Ostrava', reverse=True), set())
+        self.assertNotIn('Ostrava', self.store.ids)
+        self.assertEqual(sorted(self.store.heads()), ['Brno', 'Prague'])
+
+    def test_pending(self):
+        self.store.add('Ostrava', 'is_city', 'city')
+        self.store.add('Ostrava', 'is_city', 'city')
+        self.assertTrue(self.store.has('Ostrava'))
+        self.assertTrue(self.store.has('city', reverse=True))
+        self.assertEqual(len(self.store.neighbours('city', reverse=True)), 3)
+        for i in range(triples.MAX_PENDING):
+            self.store.add('town %d' % i, 'is_city', 'city')
+        self.assertEqual(len(self.store._pending), 0)  # merged
+        self.assertEqual(len(self.store.neighbours('city', reverse=True)), triples.MAX_PENDING + 3)
+        self.assertIn(('Ostrava', 'is_city', 'city'), self.store.all_triples())
+
+    def test_match(self):
+        self.store.add('Ostrava', 'is_city', 'city')  # pending
+        match = self.store.match('Prague', 'is_city')
+        self.assertEqual((match.estimate, match.exact), (1, True))
+        self.assertEqual(list(match), [('Prague', 'is_city', 'city')])
+        for pattern, expected in [((None, 'is_city', None), {'Prague', 'Brno', 'Ostrava'}),
+                                  ((None, 'is_city', 'city'), {'Prague', 'Brno', 'Ostrava'}),
+                                  ((None, None, 'city'), {'Prague', 'Brno', 'Ostrava'}),
+                                  (('Prague', None, None), {'Prague'}),
+                                  (('Prague', None, 'city'), {'Prague'}),
+                                  (('Prague', 'is_capital', 'Czech Republic'), {'Prague'}),
+                                  (('Prague', 'is_capital', 'city'), set()),
+                                  (('Ostrava', 'is_city', None), {'Ostrava'}),
+                                  (('Pilsen', None, None), set()),
+                                  ((None, None, None), {'Prague', 'Brno', 'Ostrava'})]:
+            match = self.store.match(*pattern)
+            triples = list(match)
+            self.assertEqual(set(h for h, _, _ in triples), expected, pattern)
+            self.assertTrue(all(p is None or p == v for t in triples for p, v in zip(pattern, t)), pattern)
+            self.assertLessEqual(len(triples), match.estimate, pattern)
+            if match.exact:
+                self.assertEqual(len(triples), match.estimate, pattern)
+        self.store.add('Ostrava', 'is_city', 'city')  # not added again once merged
+        self.store.merge()
+        self.store.add('Ostrava', 'is_city', 'city')
+        self.assertEqual(len(self.store._pending), 0)
+
+    def test_match_lazily(self):
+        self.store.add_many(('town %d' % i, 'is_city', 'city') for i in range(1000))
+        match = self.store.match(None, 'is_city', 'city')
+        self.assertEqual(match.estimate, 1002)
+        self.assertEqual(len([t for t, _ in zip(match, range(3))]), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
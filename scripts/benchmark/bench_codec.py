@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Encoding and decoding cost per message of the wire formats.
+
+    text   '<topic> <json>' in one frame, parsed by finding the first '{' (the former format)
+    frames [topic, body] where the body is encoded by cbot.bot.wire
+
+Run from the repository root:
+    PYTHONPATH=. python scripts/benchmark/bench_codec.py
+"""
+from __future__ import unicode_literals, division
+import argparse
+import json
+import time
+import timeit
+from cbot.bot import wire
+from cbot.bot.transport import PubSubTransport
+
+
+def text_encode(topic, msg):
+    return ('%s %s' % (topic, json.dumps(msg))).encode('utf-8')
+
+
+def text_decode(frame):
+    frame = frame.decode('utf-8')
+    json0 = frame.find('{')
+    return PubSubTransport.parse_topic(frame[0:json0].strip()), json.loads(frame[json0:])
+
+
+def frames_encode(topic, msg):
+    return [topic.encode('utf-8'), wire.encode(msg)]
+
+
+def frames_decode(frames):
+    return PubSubTransport.parse_topic(frames[0].decode('utf-8')), wire.decode(frames[1])
+
+
+def sample_messages():
+    session = '310510266187577792968259404894544866101'
+    utterance = {'utterance': 'Hello, how are you doing today?', 'time': time.time(),
+                 'user': 'human', 'name': 'human', 'session': session}
+    stats = {'time': time.time(), 'session': session, 'sessions': 1, 'history_len': 12, 'turns': 12,
+             'turns_per_s': 0.2, 'queue_depth': 0, 'rss_bytes': 123456789, 'request_id': 'f' * 32}
+    belief_state = {'name': 'belief_state', 'session': session,
+                    'history': [{'utterance': 'turn %d' % i, 'dat': 'inform', 'mentions': ['Prague', 'Czech Republic'],
+                                 'probability': 0.5} for i in range(200)]}
+    return {'utterance': utterance, 'stats': ('stat_' + session, stats), 'belief_state': belief_state}
+
+
+def bench(n):
+    results = {}
+    for kind, msg in sample_messages().iteritems():
+        topic = msg[0] if isinstance(msg, tuple) else msg['session']
+        msg = msg[1] if isinstance(msg, tuple) else msg
+        text, frames = text_encode(topic, msg), frames_encode(topic, msg)
+        assert frames_decode(frames)[1] == text_decode(text)[1] == msg
+        results[kind] = {
+            'text': {'bytes': len(text),
+                     'encode_us': 1e6 * timeit.timeit(lambda: text_encode(topic, msg), number=n) / n,
+                     'decode_us': 1e6 * timeit.timeit(lambda: text_decode(text), number=n) / n, },
+            'frames': {'bytes': sum(len(f) for f in frames),
+                       'encode_us': 1e6 * timeit.timeit(lambda: frames_encode(topic, msg), number=n) / n,
+                       'decode_us': 1e6 * timeit.timeit(lambda: frames_decode(frames), number=n) / n, }, }
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-n', '--number', type=int, default=10000, help='Messages encoded and decoded')
+    args = parser.parse_args()
+    print(json.dumps(bench(args.number), indent=4, sort_keys=True))
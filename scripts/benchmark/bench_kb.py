@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Memory and lookup time of the KnowledgeBase on a synthetic knowledge base of millions of triples,
+and for the layouts with match the time of the (?, relation, tail) patterns.
+
+    dict    the former layout, the triples as tuples of names in two defaultdict(set) by head and by tail
+    arrays  cbot.kb.kb.KnowledgeBase, the interned triples in sorted arrays (cbot.kb.triples)
+
+Each layout is built in its own process, the memory is the growth of its resident set while building.
+Run from the repository root:
+    PYTHONPATH=. python scripts/benchmark/bench_kb.py -n 3000000
+"""
+from __future__ import unicode_literals, division
+import argparse
+from collections import defaultdict
+import itertools
+import json
+import multiprocessing
+import random
+import time
+import timeit
+from cbot.bot.proc import rss_bytes
+from cbot.kb.kb import KnowledgeBase
+
+
+class DictKnowledgeBase(object):
+    """The former layout, the lookups of missing nodes insert empty sets."""
+    def __init__(self):
+        self._trip = defaultdict(set)
+        self._rtrip = defaultdict(set)
+
+    def get_neighbours(self, node, reverse=False):
+        return self._rtrip[node] if reverse else self._trip[node]
+
+    def add_triplets(self, triplets):
+        for a, r, b in triplets:
+            self._trip[a].add((a, r, b))
+            self._rtrip[b].add((a, r, b))
+
+
+LAYOUTS = {'dict': DictKnowledgeBase, 'arrays': KnowledgeBase}
+
+
+def synthetic_triples(names, relations, n, seed):
+    rnd = random.Random(seed)
+    for _ in xrange(n):
+        yield rnd.choice(names), rnd.choice(relations), rnd.choice(names)
+
+
+def bench_layout(layout, n, lookups, seed, queue):
+    names = ['entity %d' % i for i in xrange(max(n // 4, 1))]
+    relations = ['relation %d' % i for i in xrange(64)]
+    before = rss_bytes()
+    start = time.time()
+    kb = LAYOUTS[layout]()
+    kb.add_triplets(synthetic_triples(names, relations, n, seed))
+    kb.get_neighbours(names[0])  # the first lookup merges the arrays
+    build_s = time.time() - start
+    rss = rss_bytes() - before
+
+    rnd = random.Random(seed + 1)
+    hits = [rnd.choice(names) for _ in xrange(lookups)]
+    misses = ['missing %d' % i for i in xrange(lookups)]
+    result = {'triples': n, 'build_s': build_s, 'rss_mb': rss / 2 ** 20, 'bytes_per_triple': rss / n}
+    for kind, nodes, reverse in [('head', hits, False), ('tail', hits, True), ('miss', misses, False)]:
+        it = iter(nodes)
+        t = timeit.timeit(lambda: kb.get_neighbours(next(it), reverse), number=lookups)
+        result['%s_lookup_us' % kind] = 1e6 * t / lookups
+    result['rss_after_misses_mb'] = (rss_bytes() - before) / 2 ** 20
+    if hasattr(kb, 'match'):  # the first 10 triples of the (?, relation, tail) patterns
+        patterns = iter([(None, rnd.choice(relations), node) for node in hits])
+        t = timeit.timeit(lambda: list(itertools.islice(kb.match(*next(patterns)), 10)), number=lookups)
+        result['match_relation_tail_us'] = 1e6 * t / lookups
+    queue.put((layout, result))
+
+
+def bench(n, lookups, seed, layouts):
+    results = {}
+    for layout in layouts:
+        queue = multiprocessing.Queue()
+        p = multiprocessing.Process(target=bench_layout, args=(layout, n, lookups, seed, queue))
+        p.start()
+        while p.is_alive() and queue.empty():
+            p.join(1.0)
+        results[layout] = queue.get()[1] if not queue.empty() else {'exitcode': p.exitcode}
+        p.join()
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-n', '--triples', type=int, default=3000000)
+    parser.add_argument('-l', '--lookups', type=int, default=100000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--layout', action='append', choices=sorted(LAYOUTS), help='Default: all')
+    args = parser.parse_args()
+    print(json.dumps(bench(args.triples, args.lookups, args.seed, args.layout or sorted(LAYOUTS)),
+                     indent=4, sort_keys=True))
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+CPU per dialogue turn of the ChatBot message logging, in the bot and in the log sink.
+
+A turn logs the human message, the belief state and the reply.
+    text  the former path: the bot logs JSON text, ChatBotPUBHandler validates it, parses it
+          and dumps it indented, the sink validates and parses every message again
+          and SessionHandler parses it once more for the session
+    dicts the bot logs dicts serialized once in compact form, the session travels in the topic,
+          validation of the --validate-rate fraction of the messages
+
+The bot and the sink are connected by a pair of inproc sockets of one process.
+
+Run from the repository root:
+    PYTHONPATH=. python scripts/benchmark/bench_logging.py
+"""
+from __future__ import unicode_literals, division
+import argparse
+import json
+import logging
+import shutil
+import tempfile
+import time
+import jsonschema
+import zmq
+from zmq.log.handlers import PUBHandler
+from cbot.bot.alias import BELIEF_STATE, HUMAN, SYSTEM
+from cbot.bot.log import ChatBotPUBHandler, ChatBotJsonEncoder, SessionHandler, log_from_subscriber
+from cbot.dm.actions import Inform, Hello
+
+FORMER_SCHEMA = {"name": "string", "session": "string"}
+
+
+class FormerPUBHandler(PUBHandler):
+    def __init__(self, socket, session):
+        PUBHandler.__init__(self, socket)
+        self.session = session
+        self.formatters = dict((level, logging.Formatter('%(message)s\n')) for level in self.formatters)
+
+    def emit(self, record):
+        jsonschema.validate(record.msg, FORMER_SCHEMA)
+        msg = json.loads(record.msg)
+        if 'session' not in msg:
+            msg['session'] = self.session
+        record.msg = json.dumps(msg, sort_keys=True, indent=4, separators=(',', ': '))
+        PUBHandler.emit(self, record)
+
+
+def former_log_from_subscriber(sub, logger):
+    level, msg = sub.recv_multipart()
+    level, msg = level.lower(), msg.strip()
+    jsonschema.validate(msg, FORMER_SCHEMA)
+    json.loads(msg)
+    getattr(logger, level)(msg)
+
+
+def turn(session, history):
+    human = {'utterance': 'I know Little Richard', 'time': time.time(), 'user': HUMAN, 'name': HUMAN,
+             'session': session}
+    state = {'debug_info': '<cbot.dm.state.SimpleTurnState object>', 'name': BELIEF_STATE,
+             'attributes': {'current_user_utterance': 'I know Little Richard',
+                            'user_actions': dict((Inform, Inform(HUMAN, args={'subj': 'I', 'verb': 'know',
+                                                                             'obj': 'Richard %d' % i}))
+                                                 for i in range(history)),
+                            'system_actions': {Hello: Hello(SYSTEM)}, }}
+    reply = {'utterance': 'What know Richard?', 'time': time.time(), 'user': SYSTEM, 'name': SYSTEM,
+             'session': session}
+    return human, state, reply
+
+
+def bench(mode, turns, validate_rate, dir_name):
+    session = '310510266187577792968259404894544866101'
+    bot_logger, sink_logger = logging.getLogger('bench.bot.' + mode), logging.getLogger('bench.sink.' + mode)
+    for logger in [bot_logger, sink_logger]:
+        logger.propagate, logger.handlers = False, []
+        logger.setLevel(logging.DEBUG)
+    ctx = zmq.Context.instance()
+    socket, sub = ctx.socket(zmq.PAIR), ctx.socket(zmq.PAIR)
+    sub.bind('inproc://bench_logging_' + mode)
+    socket.connect('inproc://bench_logging_' + mode)
+    if mode == 'text':
+        bot_logger.addHandler(FormerPUBHandler(socket, session))
+    else:
+        bot_logger.addHandler(ChatBotPUBHandler(socket, session, validate_rate))
+    sink_handler = SessionHandler(dir_name, flush_interval=3600)
+    sink_logger.addHandler(sink_handler)
+
+    bot_cpu = sink_cpu = 0.0
+    for _ in range(turns):
+        human, state, reply = turn(session, 3)
+        start = time.clock()
+        if mode == 'text':
+            bot_logger.warning(json.dumps(human))
+            bot_logger.info(ChatBotJsonEncoder().encode(state))
+            bot_logger.warning(json.dumps(reply))
+        else:
+            bot_logger.warning(human)
+            bot_logger.info(state)
+            bot_logger.warning(reply)
+        bot_cpu += time.clock() - start
+        start = time.clock()
+        for _ in range(3):
+            if mode == 'text':
+                former_log_from_subscriber(sub, sink_logger)
+            else:
+                log_from_subscriber(sub, sink_logger, validate_rate)
+        sink_cpu += time.clock() - start
+    sink_handler.close()
+    socket.close()
+    sub.close()
+    return {'bot_us_per_turn': 1e6 * bot_cpu / turns, 'sink_us_per_turn': 1e6 * sink_cpu / turns}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-n', '--turns', type=int, default=5000)
+    parser.add_argument('--validate-rate', type=float, default=0.0)
+    args = parser.parse_args()
+
+    logging.getLogger('cbot.bot.log').disabled = True  # the console echo of the sink
+    results = {}
+    for mode in ['text', 'dicts']:
+        dir_name = tempfile.mkdtemp()
+        results[mode] = bench(mode, args.turns, args.validate_rate, dir_name)
+        shutil.rmtree(dir_name)
+    print(json.dumps(results, indent=4, sort_keys=True))
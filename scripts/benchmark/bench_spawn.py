@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Spawn-to-ready latency and per bot memory of ChatBots
+started as plain ChatBotProcess (before) and forked from ChatBotZygote (after).
+
+Run from the repository root:
+    PYTHONPATH=. python scripts/benchmark/bench_spawn.py --bots 8
+"""
+from __future__ import unicode_literals, division
+import argparse
+import json
+import time
+import uuid
+from multiprocessing import Process
+import gevent
+import zmq.green as zmqg
+from cbot.bot.connectors import ChatBotProcess
+from cbot.bot.log import chatbot2file_log_loop
+from cbot.bot.proc import rss_bytes, uss_bytes
+from cbot.bot.transport import PubSubEndpoints
+from cbot.bot.zygote import ChatBotZygote
+
+
+def wait_ready(transport, name, timeout, interval=10):
+    """Wait like ChatBotConnector for the ready announcement or a reply to a probe."""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        transport.send('init_sync', name, 'probing connection')
+        if transport.recv(timeout=interval) is not None:
+            return True
+    return False
+
+
+def spawn_process(name, endpoints):
+    bot = ChatBotProcess(name, endpoints)
+    bot.start()
+    return bot
+
+
+def bench(spawn, n, ctx, endpoints, timeout):
+    bots, latencies, failed = [], [], 0
+    for _ in range(n):
+        name = str(int(uuid.uuid4()))
+        transport = endpoints.connector(ctx)
+        transport.subscribe(name, ['init_sync', 'ready'])
+        gevent.sleep(0.1)  # slow joiner
+        start = time.time()
+        bots.append(spawn(name, endpoints))
+        if wait_ready(transport, name, timeout):
+            latencies.append(time.time() - start)
+        else:
+            failed += 1
+        transport.close()
+    rss = [rss_bytes(b.pid) for b in bots if b.is_alive()]
+    uss = [uss_bytes(b.pid) for b in bots if b.is_alive()]
+    transport = endpoints.connector(ctx)
+    for b in bots:
+        transport.send('die', b.name, 'die')
+        b.terminate()
+    transport.close()
+    return {'bots': n,
+            'failed': failed,
+            'ready_latency_s': summary(latencies),
+            'rss_mb': summary([r / 2 ** 20 for r in rss]),
+            'uss_mb': summary([u / 2 ** 20 for u in uss]), }
+
+
+def summary(values):
+    if len(values) == 0:
+        return None
+    values = sorted(values)
+    return {'min': values[0], 'median': values[len(values) // 2], 'max': values[-1],
+            'mean': sum(values) / len(values)}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-n', '--bots', type=int, default=8)
+    parser.add_argument('-t', '--timeout', type=float, default=60.0, help='Seconds to wait for one bot')
+    parser.add_argument('--port-offset', type=int, default=20000)
+    args = parser.parse_args()
+
+    endpoints = PubSubEndpoints(*[args.port_offset + i for i in range(4)])
+    log_process = Process(target=chatbot2file_log_loop)
+    log_process.start()
+    devices = endpoints.start_devices()
+    zygote = ChatBotZygote()
+    zygote.start()
+    ctx = zmqg.Context()
+    time.sleep(1.0)
+
+    results = {'process': bench(spawn_process, args.bots, ctx, endpoints, args.timeout)}
+    first = bench(zygote.spawn, 1, ctx, endpoints, args.timeout)  # the first fork waits until the zygote preloads models
+    results['zygote'] = bench(zygote.spawn, args.bots, ctx, endpoints, args.timeout)
+    results['zygote']['first_ready_latency_s'] = first['ready_latency_s']
+    results['zygote']['zygote_uss_mb'] = uss_bytes(zygote.pid) / 2 ** 20
+    print(json.dumps(results, indent=4, sort_keys=True))
+
+    zygote.shutdown()
+    log_process.terminate()
+    for device in devices:
+        device.join(0.1)
@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Messages/sec and CPU of the transports between ChatBotConnectors and ChatBots.
+
+Every session has its own connector transport (as ChatBotConnector in the web app)
+and its own bot transport hosted by one of the echo worker processes.
+The driver sends a message for every session and waits for all the echoes, repeatedly.
+
+    pubsub: every message passes the forwarder which filters it
+            against the subscriptions of all the connected bots or connectors
+    router: every message is passed by the broker to its recipient only
+
+Run from the repository root:
+    PYTHONPATH=. python scripts/benchmark/bench_transport.py --sessions 10 100 1000
+"""
+from __future__ import unicode_literals, division
+import argparse
+import json
+import time
+from multiprocessing import Process
+import zmq
+from cbot.bot.proc import cpu_seconds
+from cbot.bot.transport import PubSubEndpoints, RouterEndpoints
+
+
+def session_names(n):
+    return ['%06d' % i for i in range(n)]  # fixed width so no name is a topic prefix of another
+
+
+def _in_socket(transport):
+    return transport.isocket if hasattr(transport, 'isocket') else transport.socket
+
+
+def echo_worker(endpoints, names):
+    ctx = zmq.Context()
+    ctx.max_sockets = 2 * len(names) + 100
+    poller = zmq.Poller()
+    transports = {}
+    for name in names:
+        t = endpoints.bot(ctx, name)
+        t.subscribe(name)
+        transports[_in_socket(t)] = t
+        poller.register(_in_socket(t), zmq.POLLIN)
+    while True:
+        for socket, _ in poller.poll():
+            signal, name, payload = transports[socket].recv()
+            transports[socket].send(signal, name, payload)
+
+
+def _pid(device):
+    return device.pid if hasattr(device, 'pid') else device.launcher.pid
+
+
+def _wait_all(poller, transports, expected, timeout):
+    """Receive from the connector transports until expected messages arrived or timeout s elapsed."""
+    received, deadline = 0, time.time() + timeout
+    while received < expected and time.time() < deadline:
+        for socket, _ in poller.poll(timeout=100):
+            if transports[socket].recv() is not None:
+                received += 1
+    return received
+
+
+def bench(endpoints, devices, sessions, messages, workers, timeout):
+    names = session_names(sessions)
+    procs = [Process(target=echo_worker, args=(endpoints, names[i::workers])) for i in range(min(workers, sessions))]
+    for p in procs:
+        p.daemon = True
+        p.start()
+    ctx = zmq.Context()
+    ctx.max_sockets = 2 * sessions + 100  # pubsub connector has two sockets
+    poller = zmq.Poller()
+    connectors, by_socket = {}, {}
+    for name in names:
+        t = endpoints.connector(ctx)
+        t.subscribe(name)
+        connectors[name] = t
+        by_socket[_in_socket(t)] = t
+        poller.register(_in_socket(t), zmq.POLLIN)
+
+    # handshake like ChatBotConnector, until every bot transport is connected
+    pending, deadline = set(names), time.time() + timeout
+    while len(pending) > 0 and time.time() < deadline:
+        for name in pending:
+            connectors[name].send('init_sync', name, 'probing connection')
+        for socket, _ in poller.poll(timeout=100):
+            pending.discard(by_socket[socket].recv()[1])
+    ready = poller.poll(timeout=500)
+    while len(ready) > 0:  # drop late handshake replies
+        for socket, _ in ready:
+            by_socket[socket].recv()
+        ready = poller.poll(timeout=100)
+
+    pids = [None] + [p.pid for p in procs] + [_pid(d) for d in devices]
+    cpu_before = [cpu_seconds(pid) for pid in pids]
+    start, received = time.time(), 0
+    for i in range(messages):
+        for name in names:
+            connectors[name].send(None, name, {'utterance': 'message %d' % i, 'session': name})
+        received += _wait_all(poller, by_socket, sessions, timeout)
+    elapsed = time.time() - start
+    cpu = [after - before for before, after in zip(cpu_before, [cpu_seconds(pid) for pid in pids])]
+
+    for t in connectors.values():
+        t.close()
+    for p in procs:
+        p.terminate()
+    return {'sessions': sessions,
+            'not_ready': len(pending),
+            'sent': sessions * messages,
+            'received': received,
+            'msgs_per_s': received / elapsed,
+            'cpu_s': {'connectors': cpu[0],
+                      'bots': sum(cpu[1:1 + len(procs)]),
+                      'devices': sum(cpu[1 + len(procs):]),
+                      'total': sum(cpu)},
+            'cpu_ms_per_msg': 1000 * sum(cpu) / max(received, 1), }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-s', '--sessions', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('-m', '--messages', type=int, default=20, help='Messages per session')
+    parser.add_argument('-w', '--workers', type=int, default=4, help='Processes hosting the bot transports')
+    parser.add_argument('--transport', choices=['pubsub', 'router'], nargs='+', default=['pubsub', 'router'])
+    parser.add_argument('-t', '--timeout', type=float, default=30.0)
+    parser.add_argument('--port-offset', type=int, default=21000)
+    args = parser.parse_args()
+
+    results = {}
+    for transport in args.transport:
+        if transport == 'router':
+            endpoints = RouterEndpoints(args.port_offset + 4)
+        else:
+            endpoints = PubSubEndpoints(*[args.port_offset + i for i in range(4)])
+        devices = endpoints.start_devices()
+        time.sleep(1.0)
+        results[transport] = [bench(endpoints, devices, n, args.messages, args.workers, args.timeout)
+                              for n in args.sessions]
+        for d in devices:
+            (d if hasattr(d, 'terminate') else d.launcher).terminate()
+    print(json.dumps(results, indent=4, sort_keys=True))
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Turn latency from ChatBotConnector.send to the delivered reply, per transport.
+
+The dialogues are hosted by one ChatBotHostPool host, so the transports differ only in the path:
+    pubsub: connector -> bot forwarder -> host process -> user forwarder -> connector
+    router: connector -> broker -> host process -> broker -> connector
+    inproc: connector -> gevent queue -> ChatBotHostGreenlet in this process -> gevent queue -> connector
+
+Every session sends its next utterance once the previous one was answered.
+
+Run from the repository root:
+    PYTHONPATH=. python scripts/benchmark/bench_turn.py --sessions 10 --turns 20
+"""
+from __future__ import unicode_literals, division
+import argparse
+import json
+import time
+from multiprocessing import Process
+import gevent
+from gevent.queue import Queue, Empty
+import zmq.green as zmqg
+from cbot.bot.connectors import ChatBotConnector, ConnectorHub
+from cbot.bot.log import chatbot2file_log_loop, wrap_msg
+from cbot.bot.metrics import Summary
+from cbot.bot.pool import ChatBotHostPool
+from cbot.bot.transport import PubSubEndpoints, RouterEndpoints, InProcEndpoints
+
+
+def dialogue(connector, replies, turns, latency, timeout):
+    for i in range(turns):
+        start = time.time()
+        connector.send(wrap_msg('I like Little Richard %d' % i))
+        try:
+            replies.get(timeout=timeout)
+        except Empty:
+            return
+        latency.observe(time.time() - start)
+
+
+def bench(endpoints, sessions, turns, timeout):
+    ctx = zmqg.Context()
+    pool = ChatBotHostPool(endpoints, hosts=1, max_sessions=sessions, ready_timeout=timeout, ctx=ctx)
+    warm = pool.lease(timeout=timeout)  # wait until the models are loaded
+    if warm is None:
+        pool.shutdown()
+        return {'sessions': sessions, 'failed': 'host not ready'}
+    pool.release(warm)
+    hub = ConnectorHub(endpoints, ctx)
+    queues, connectors = {}, []
+    for _ in range(sessions):
+        c = ChatBotConnector(lambda m, room: queues[room].put(m), endpoints, ctx=ctx, pool=pool, hub=hub)
+        if c.initialized.get():
+            queues[c.room] = Queue()
+            connectors.append(c)
+    latency = Summary(window=sessions * turns)
+    start = time.time()
+    gevent.joinall([gevent.spawn(dialogue, connector, queues[connector.room], turns, latency, timeout)
+                    for connector in connectors])
+    elapsed = time.time() - start
+    for c in connectors:
+        c.kill()
+    hub.close()
+    pool.shutdown()
+    s = latency.snapshot()
+    return {'sessions': sessions,
+            'not_ready': sessions - len(connectors),
+            'turns': s['count'],
+            'turns_per_s': s['count'] / elapsed,
+            'latency_ms': dict((k, 1000 * v) for k, v in s.iteritems() if k != 'count' and v is not None), }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-s', '--sessions', type=int, nargs='+', default=[1, 10])
+    parser.add_argument('-n', '--turns', type=int, default=20, help='Turns per session')
+    parser.add_argument('--transport', choices=['pubsub', 'router', 'inproc'], nargs='+',
+                        default=['pubsub', 'router', 'inproc'])
+    parser.add_argument('-t', '--timeout', type=float, default=60.0)
+    parser.add_argument('--port-offset', type=int, default=22000)
+    args = parser.parse_args()
+
+    log_process = Process(target=chatbot2file_log_loop)
+    log_process.start()
+    results = {}
+    for transport in args.transport:
+        if transport == 'router':
+            endpoints = RouterEndpoints(args.port_offset + 4)
+        elif transport == 'inproc':
+            endpoints = InProcEndpoints()
+        else:
+            endpoints = PubSubEndpoints(*[args.port_offset + i for i in range(4)])
+        devices = endpoints.start_devices()
+        time.sleep(1.0)
+        results[transport] = [bench(endpoints, n, args.turns, args.timeout) for n in args.sessions]
+        for d in devices:
+            (d if hasattr(d, 'terminate') else d.launcher).terminate()
+    print(json.dumps(results, indent=4, sort_keys=True))
+    log_process.terminate()
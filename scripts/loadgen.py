@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Load generator for app/cleverobot/run.py.
+
+Opens N simulated Socket.IO sessions (begin, utterances, end like static/js/chat.js)
+and replays the human utterances of the recorded cbot/bot/logs/*input_output.log dialogues
+with a think time between the reply and the next utterance.
+
+Prints JSON with the turn latency percentiles (utterance sent -> first reply received),
+handshake failures, turn timeouts and the bot count and RSS reported by the server /stats and /metrics.
+
+The server speaks the socket.io 0.9 protocol of flask-socketio 0.6 (gevent-socketio),
+use socketIO-client < 0.6 from app-requirements.txt.
+
+Run from the repository root against a running server:
+    PYTHONPATH=. python scripts/loadgen.py --port 3000 --sessions 50 --think-time 2.0 > load.json
+"""
+from __future__ import unicode_literals, division
+from gevent import monkey
+monkey.patch_all()
+import argparse
+import glob
+import json
+import logging
+import random
+import time
+import urllib2
+import gevent
+from gevent.event import AsyncResult
+from socketIO_client import SocketIO
+from cbot.bot.alias import HUMAN
+from cbot.bot.metrics import Summary
+
+DEFAULT_UTTERANCES = ['Hello', 'I know Little Richard', 'Do you know him?', 'I like Little Richard', 'Bye']
+
+
+def read_utterances(path):
+    """Human utterances of one recorded dialogue, the messages are JSON objects one after another."""
+    with open(path, 'r') as r:
+        content = r.read().decode('utf-8')
+    decoder, i, utterances = json.JSONDecoder(), 0, []
+    while True:
+        while i < len(content) and content[i].isspace():
+            i += 1
+        if i == len(content):
+            return utterances
+        try:
+            msg, i = decoder.raw_decode(content, i)
+        except ValueError:
+            logging.warning('Skipping the rest of %s, cannot parse JSON at %d', path, i)
+            return utterances
+        if isinstance(msg, dict) and msg.get('name', msg.get('user')) == HUMAN and msg.get('utterance'):
+            utterances.append(msg['utterance'])
+
+
+class Session(object):
+    """One simulated browser tab."""
+    def __init__(self, host, port, utterances, think_time, timeout, latency):
+        self.host, self.port = host, port
+        self.utterances, self.think_time, self.timeout = utterances, think_time, timeout
+        self.latency = latency
+        self.counts = {'turns': 0, 'timeouts': 0, 'server_errors': 0, 'handshake_failed': 0}
+        self._reply = AsyncResult()
+
+    def _on_reply(self, *args):
+        self._reply.set(time.time())
+
+    def _on_error(self, *args):
+        self.counts['server_errors'] += 1  # run.py broadcasts them to all sessions
+
+    def run(self):
+        try:
+            io = SocketIO(self.host, self.port, wait_for_connection=False)
+        except Exception as e:
+            logging.warning('Cannot connect: %s', e)
+            self.counts['handshake_failed'] += 1
+            return
+        io.on('socketbot', self._on_reply)
+        io.on('server_error', self._on_error)
+        receiver = gevent.spawn(io.wait)
+        try:
+            io.emit('begin', {'setup': 'unused'})
+            for i, utterance in enumerate(self.utterances):
+                if i > 0:
+                    gevent.sleep(random.expovariate(1 / self.think_time) if self.think_time > 0 else 0)
+                self._reply = AsyncResult()
+                start = time.time()
+                io.emit('utterance', {'time_sent': int(1000 * start), 'user': HUMAN, 'utterance': utterance})
+                try:
+                    replied = self._reply.get(timeout=self.timeout)
+                except gevent.Timeout:
+                    self.counts['timeouts'] += 1
+                    if i == 0:
+                        self.counts['handshake_failed'] += 1  # begin failed or the bot never answered
+                        return
+                    continue
+                self.counts['turns'] += 1
+                self.latency.observe(replied - start)
+            io.emit('end', {'time_sent': int(1000 * time.time()), 'user': HUMAN, 'utterance': ''})
+        finally:
+            receiver.kill()
+            io.disconnect()
+
+
+def server_stats(host, port):
+    """Bots and RSS of the fleet (/stats) and the connector metrics (/metrics), None if unavailable."""
+    stats = {}
+    for route in ['stats', 'metrics']:
+        try:
+            stats[route] = json.load(urllib2.urlopen('http://%s:%d/%s' % (host, port, route), timeout=10))
+        except Exception as e:
+            logging.warning('Cannot get /%s: %s', route, e)
+            stats[route] = None
+    return stats
+
+
+def run(args, conversations):
+    latency = Summary(window=10 ** 6)
+    sessions = [Session(args.host, args.port, conversations[i % len(conversations)][:args.turns],
+                        args.think_time, args.timeout, latency) for i in range(args.sessions)]
+    start, greenlets = time.time(), []
+    for s in sessions:
+        greenlets.append(gevent.spawn(s.run))
+        gevent.sleep(args.ramp_up / max(args.sessions, 1))
+    peak = server_stats(args.host, args.port)  # all sessions began
+    gevent.joinall(greenlets)
+    elapsed = time.time() - start
+    counts = dict((k, sum(s.counts[k] for s in sessions)) for k in ['turns', 'timeouts', 'handshake_failed'])
+    counts['server_errors'] = max([s.counts['server_errors'] for s in sessions] + [0])
+    fleet = peak['stats'] or {}
+    return {'time': start,
+            'config': vars(args),
+            'elapsed_s': elapsed,
+            'sessions': args.sessions,
+            'counts': counts,
+            'turns_per_s': counts.get('turns', 0) / elapsed,
+            'turn_latency_s': latency.snapshot(),
+            'bots': fleet.get('bots'),
+            'rss_bytes': fleet.get('rss_bytes'),
+            'server_at_peak': peak,
+            'server_at_end': server_stats(args.host, args.port), }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('-p', '--port', type=int, default=3000)
+    parser.add_argument('-n', '--sessions', type=int, default=10)
+    parser.add_argument('--logs', default='cbot/bot/logs/*input_output.log',
+                        help='Glob of the recorded dialogues to replay, built-in utterances if nothing matches')
+    parser.add_argument('--turns', type=int, default=20, help='Maximum utterances replayed per session')
+    parser.add_argument('--think-time', type=float, default=1.0,
+                        help='Mean seconds (exponentially distributed) between a reply and the next utterance')
+    parser.add_argument('--ramp-up', type=float, default=5.0, help='Seconds over which the sessions are started')
+    parser.add_argument('-t', '--timeout', type=float, default=30.0, help='Seconds to wait for a reply')
+    parser.add_argument('-o', '--output', help='Write the JSON report to the file instead of stdout')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    conversations = [u for u in (read_utterances(p) for p in sorted(glob.glob(args.logs))) if len(u) > 0]
+    if len(conversations) == 0:
+        logging.warning('No recorded dialogues match %s, replaying built-in utterances', args.logs)
+        conversations = [DEFAULT_UTTERANCES]
+    report = json.dumps(run(args, conversations), indent=4, sort_keys=True)
+    if args.output is not None:
+        with open(args.output, 'w') as w:
+            w.write(report)
+    else:
+        print(report)
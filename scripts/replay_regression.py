@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Replay regression over all the recorded dialogues of a log directory or segment stores.
+
+Every dialogue is replayed by cbot.bot.replay.ReplayEngine in a pool of processes, each with its own
+ChatBot and the knowledge base loaded once. The JSON report has for each session and turn
+the recorded and replayed replies, the understood user action, the user mentions and the turn time,
+and a summary with the turn time percentiles.
+
+Replies are compared with the recording. With --baseline, the report of a replay of the previous code,
+the replies, user actions and user mentions are compared with the baseline, e.g. to check a policy change:
+
+    PYTHONPATH=. python scripts/replay_regression.py -o baseline.json
+    git checkout my-policy-change
+    PYTHONPATH=. python scripts/replay_regression.py --baseline baseline.json -o report.json
+"""
+from __future__ import unicode_literals, division
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import time
+from cbot.bot.log import read_messages, session_logs
+from cbot.bot.metrics import Summary
+from cbot.bot.replay import ReplayEngine, REGRESSION_FIELDS, read_session, changes, summarize
+from cbot.bot.store import SegmentStore
+
+ROOT = os.path.realpath(os.path.join(os.path.dirname(__file__), '../cbot/bot/logs'))
+
+_engine = None  # of the worker process
+_stores = {}  # of the worker process, store dir -> (SegmentStore, its read_active())
+
+
+def init_worker(seed, stores):
+    global _engine
+    logging.getLogger('cbot').setLevel(logging.WARNING)  # the policy logs every chosen action
+    _engine = ReplayEngine(seed=seed)
+    for store_dir in stores or ():  # the active segments are scanned once, not for every session
+        store = SegmentStore(store_dir)
+        _stores[store_dir] = store, store.read_active()
+
+
+def replay_session(task):
+    """Return (session, replayed turns, error) of the session."""
+    session, source = task
+    try:
+        if isinstance(source, tuple):
+            msgs = read_session(*source)
+        else:
+            store, active = _stores[source]
+            msgs = read_messages(msg for _, msg in store.read(session, active))
+        return session, list(_engine.replay(msgs, session)), None
+    except Exception as e:
+        logging.exception(e)
+        return session, None, repr(e)
+
+
+def tasks(root, stores):
+    if stores is None:
+        for session, paths in sorted(session_logs(root).iteritems()):
+            yield session, paths
+    else:
+        for store_dir in stores:
+            for session in sorted(SegmentStore(store_dir).sessions()):
+                yield session, store_dir
+
+
+def regression(root, stores=None, baseline=None, processes=None, seed=0):
+    start = time.time()
+    baseline_sessions = None if baseline is None else baseline['sessions']
+    report = {'sessions': {}}
+    summary = {'sessions': 0, 'failed': 0, 'turns': 0, 'replies_diverged': 0,
+               'changed': dict((f, 0) for f in REGRESSION_FIELDS) if baseline is not None else None,
+               'changed_sessions': 0 if baseline is not None else None}
+    turn_time = Summary(window=10 ** 6)
+
+    pool = multiprocessing.Pool(processes, initializer=init_worker, initargs=(seed, stores))
+    try:
+        for session, turns, error in pool.imap_unordered(replay_session, tasks(root, stores), chunksize=4):
+            summary['sessions'] += 1
+            if error is not None:
+                summary['failed'] += 1
+                report['sessions'][session] = {'error': error}
+                continue
+            s = summarize(turns)
+            summary['turns'] += s['turns']
+            summary['replies_diverged'] += s['replies_diverged']
+            for t in turns:
+                turn_time.observe(t['time_s'])
+            if baseline_sessions is not None:
+                baseline_turns = baseline_sessions.get(session, {}).get('turns') or []
+                for i, t in enumerate(turns):
+                    t['changed'] = changes(t, baseline_turns[i] if i < len(baseline_turns) else None)
+                    for f in t['changed']:
+                        summary['changed'][f] += 1
+                summary['changed_sessions'] += any(len(t['changed']) > 0 for t in turns)
+            report['sessions'][session] = {'turns': turns, 'time_s': s['time_s']}
+    finally:
+        pool.close()
+        pool.join()
+    summary['turn_time_s'] = turn_time.snapshot()
+    summary['wall_s'] = time.time() - start
+    report['summary'] = summary
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-r', '--root', default=ROOT, help='Directory of the session log files')
+    parser.add_argument('--store', action='append', help='Segment store (app/cleverobot/run.py --log-store) '
+                                                         'to replay instead of the root, may be repeated')
+    parser.add_argument('-b', '--baseline', help='Report of a previous replay to compare with')
+    parser.add_argument('-j', '--processes', type=int, default=None, help='Default: number of CPUs')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('-o', '--output', default='-')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    baseline = None
+    if args.baseline is not None:
+        with open(args.baseline, 'r') as r:
+            baseline = json.load(r)
+    report = regression(args.root, args.store, baseline, args.processes, args.seed)
+    out = json.dumps(report, sort_keys=True, indent=2)
+    if args.output == '-':
+        print out
+    else:
+        with open(args.output, 'w') as w:
+            w.write(out)
+        print json.dumps(report['summary'], sort_keys=True, indent=2)